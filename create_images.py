@@ -1,17 +1,21 @@
 """ 
 This script is used to create images and steering angle from a video file.
 """
+import argparse
+import logging
 import os
 import sys
 import cv2
 
 
+from src.cnn_training.shards import LAYOUTS, extract
 from src.opencv_auto.driver import AutoDrive
 
 
 def save_image_and_steering_angle(filename):
     """
-    Save images and steering angle from a video file
+    Save images and steering angle from a video file as one PNG per frame,
+    the layout the training notebook reads
     """
     lane_follower = AutoDrive()
     cap = cv2.VideoCapture(f"{filename}.avi")
@@ -23,7 +27,9 @@ def save_image_and_steering_angle(filename):
         i = len(os.listdir(directory)) + 5
 
         while cap.isOpened():
-            _, frame = cap.read()
+            ret, frame = cap.read()
+            if not ret:
+                break
             lane_follower.follow_lane(frame)
             cv2.imwrite(
                 f"./data/images/{i:03d}_{lane_follower.curr_steering_angle:03d}.png",
@@ -37,5 +43,38 @@ def save_image_and_steering_angle(filename):
         cv2.destroyAllWindows()
 
 
+def main(argv=None):
+    """
+    Label videos into array shards, or into PNGs with --png
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("videos", nargs="+", help="recorded car_video*.avi files")
+    parser.add_argument("--output", default="./data/shards")
+    parser.add_argument("--layout", choices=LAYOUTS, default="frame")
+    parser.add_argument("--shard-size", type=int, default=256)
+    parser.add_argument("--warmup", type=int, default=60)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--png", action="store_true", help="write PNGs instead")
+    args = parser.parse_args(argv)
+
+    # videos may be given without their extension, as they used to be
+    videos = [v if os.path.splitext(v)[1] else v + ".avi" for v in args.videos]
+    if args.png:
+        for video in videos:
+            save_image_and_steering_angle(os.path.splitext(video)[0])
+        return 0
+
+    extract(
+        videos,
+        args.output,
+        layout=args.layout,
+        shard_size=args.shard_size,
+        warmup=args.warmup,
+        workers=args.workers,
+    )
+    return 0
+
+
 if __name__ == "__main__":
-    save_image_and_steering_angle(sys.argv[1])
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
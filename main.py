@@ -2,19 +2,32 @@
 Main entry point for the self-driving car
 """
 
+import argparse
+import json
+import inspect
 import logging
 import datetime
+import sys
+import time
 import picar
 import cv2
+import numpy as np
 
-from src.opencv_auto.driver import AutoDrive
-
-# from src.cnn_driving.driver import (
-#    CNNDrive,
-# )  # Uncomment this line to use the CNN driving model
-
-from src.object_detection.model import DetectionModel
 from src.opencv_auto.utility import show_image
+from src.pipeline.capture import CameraStream
+from src.pipeline.labels import LabelLogger
+from src.pipeline.processes import RemoteDetector, RemoteStage, steering_stage
+from src.pipeline.recorder import VideoRecorder
+from src.pipeline.startup import (
+    DETECTORS,
+    LANE_FOLLOWERS,
+    StartupTimer,
+    create_detector,
+    create_lane_follower,
+    warm_up,
+)
+from src.pipeline.telemetry import Telemetry, TimedWheels
+from src.pipeline.workers import StageWorker, stop_all
 
 logger = logging.getLogger(__name__)
 
@@ -24,21 +37,69 @@ class DriveBerry(object):
     Base class for a self-driving car
     """
 
-    def __init__(self, initial_speed=35, screen_width=640, screen_height=480):
+    def __init__(
+        self,
+        initial_speed=35,
+        screen_width=640,
+        screen_height=480,
+        record_fps=20.0,
+        overlay_fps=5.0,
+        record_events_only=False,
+        headless=False,
+        detection_every=1,
+        detection_rate=None,
+        detector_process=False,
+        steering_process=False,
+        frame_budget_ms=None,
+        telemetry_port=None,
+        telemetry_sink=False,
+        log_labels=False,
+        lane_follower="opencv",
+        lane_follower_options=None,
+        detector="edgetpu",
+        detector_options=None,
+        warm_up=True,
+    ):
+        """
+        lane_follower: "opencv" or "cnn"; lane_follower_options go to its
+            constructor, e.g. {"backend": "tflite"}
+        detector: "edgetpu", or None to drive without object detection
+        warm_up: run every model once on a dummy frame before driving
+        config_error checks which of these options can be combined
+        """
         logger.info("Creating an instance of DriveBerry")
+        self.startup = StartupTimer()
 
         self.screen_width = screen_width
         self.screen_height = screen_height
         self.initial_speed = initial_speed
 
+        # object detection runs on every Nth frame and at most this many Hz;
+        # signs change far more slowly than lane geometry
+        self.detection_every = detection_every
+        self.detection_rate = detection_rate
+
+        # pipelined mode can run the detector and the CNN lane follower in
+        # their own processes, on their own cores
+        self.detector_process = detector_process
+        self.steering_process = steering_process
+
+        # per-frame stage timings of both drive loops; over frame_budget_ms
+        # they first drop the overlays, then object detection
+        self.frame_budget_ms = frame_budget_ms
+        self.telemetry_port = telemetry_port
+        self.telemetry_sink = telemetry_sink
+
+        # store every frame the lane follower saw with its steering angle as
+        # training shards, instead of relabelling the lossy recording later
+        self.log_labels = log_labels
+
         picar.setup()
 
         logger.debug("Setting up camera")
         self.camera = cv2.VideoCapture(-1)
-        self.camera.set(
-            3, self.screen_width
-        )  # this will set the width of the camera to 320 pixels
-        self.camera.set(4, self.screen_height)
+        self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.screen_width)
+        self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.screen_height)
 
         logger.debug("Setting up front wheels")
         self.front_wheels = picar.front_wheels.Front_Wheels()
@@ -48,30 +109,40 @@ class DriveBerry(object):
         self.back_wheels.forward()
         self.back_wheels.speed = 0
 
-        self.lane_follower = AutoDrive(self)
-        # self.lane_follower = CNNDrive(self)
-
-        self.object_detector = DetectionModel(self)
+        # headless: overlays are only rendered when the recorder keeps them;
+        # only the chosen follower and detector import their libraries, e.g.
+        # TensorFlow for the CNN or pycoral for the Edge TPU
+        self.render_overlays = not headless
+        self.lane_follower = create_lane_follower(
+            lane_follower,
+            self,
+            render_overlays=not headless,
+            timer=self.startup,
+            **(lane_follower_options or {}),
+        )
+        self.detector_options = detector_options or {}
+        self.object_detector = create_detector(
+            detector, self, timer=self.startup, **self.detector_options
+        )
+        self.warm_up = warm_up
 
         logger.debug("Setting up video capture")
 
-        self.fourcc = cv2.VideoWriter_fourcc(*"XVID")
+        # raw frames at camera rate, overlays decimated; in event mode only the
+        # seconds around a stop sign or a lost lane are written
         datestr = datetime.datetime.now().strftime("%y%m%d_%H%M%S")
-        self.video_orig = self.create_video_recorder(f"./data/car_video{datestr}.avi")
-        self.video_lane = self.create_video_recorder(
-            f"./data/car_video_lane{datestr}.avi"
+        self.recorder = VideoRecorder(
+            (self.screen_width, self.screen_height), event_mode=record_events_only
         )
-        self.video_objs = self.create_video_recorder(
-            f"./data/car_video_objs{datestr}.avi"
+        self.recorder.add_stream("orig", f"./data/car_video{datestr}.avi", record_fps)
+        self.recorder.add_stream(
+            "lane", f"./data/car_video_lane{datestr}.avi", overlay_fps
         )
-
-    def create_video_recorder(self, filename):
-        """
-        Create a video recorder with the given filename
-        """
-        return cv2.VideoWriter(
-            filename, self.fourcc, 20.0, (self.screen_width, self.screen_height)
+        self.recorder.add_stream(
+            "objs", f"./data/car_video_objs{datestr}.avi", overlay_fps
         )
+        self.telemetry_path = f"./data/telemetry{datestr}.jsonl"
+        self.labels_dir = f"./data/labels{datestr}"
 
     def __enter__(self):
         """Entry point"""
@@ -91,9 +162,7 @@ class DriveBerry(object):
         self.back_wheels.speed = 0
         self.front_wheels.turn(90)
         self.camera.release()
-        self.video_orig.release()
-        self.video_lane.release()
-        self.video_objs.release()
+        self.recorder.close()
         cv2.destroyAllWindows()
 
     def follow_lane(self, image):
@@ -110,36 +179,362 @@ class DriveBerry(object):
         image = self.object_detector.process_objects_on_road(image)
         return image
 
-    def drive(self, speed=35):
+    def mark_recording_events(self, timestamp=None):
+        """
+        Tell the recorder about stop signs and lost lanes
+        """
+        detector = self.object_detector
+        if detector is not None and "stop sign" in detector.last_labels:
+            self.recorder.mark_event("stop sign", timestamp)
+
+        lane_lines = getattr(self.lane_follower, "lane_lines", None)
+        if lane_lines is not None and len(lane_lines) == 0:
+            self.recorder.mark_event("lost lane", timestamp)
+
+    def drive(self, speed=35, pipelined=False):
         """
         Drive the car at a given speed
         """
+        if pipelined:
+            self.drive_pipelined(speed)
+            return
+
         logger.info(f"Starting to drive at speed {speed}...")
+        startup = self.warm_up_stages()
+        telemetry = Telemetry(
+            budget_ms=self.frame_budget_ms,
+            sink_path=self.telemetry_path if self.telemetry_sink else None,
+            startup=startup,
+        )
+        if self.telemetry_port is not None:
+            telemetry.serve(self.telemetry_port)
+        watchdog = telemetry.watchdog
+        labels = LabelLogger(self.labels_dir) if self.log_labels else None
+
+        # book the wheel commands to actuation, wherever they are sent from
+        wheels = self.front_wheels, self.back_wheels
+        self.front_wheels = TimedWheels(self.front_wheels, telemetry)
+        self.back_wheels = TimedWheels(self.back_wheels, telemetry)
+
         self.back_wheels.speed = speed
+        lane_follower = self.lane_follower
+        detector = self.object_detector
         i = 0
-        while self.camera.isOpened():
-            ret, lane_frame = self.camera.read()
-            object_frame = lane_frame.copy()
+        try:
+            while self.camera.isOpened():
+                telemetry.begin_frame()
+                ret, lane_frame = self.camera.read()
+                telemetry.mark("capture")
+                frame = object_frame = lane_frame
+
+                if ret:
+                    i += 1
+                    logger.debug(f"Processing frame {i}")
+                    overlays = not watchdog.skip_overlays
+                    lane_follower.render_overlays = self.render_overlays and overlays
+                    self.recorder.write("orig", lane_frame)
+                    telemetry.mark("recording")
+
+                    show_image("Detected Objects", object_frame)
+
+                    detect = i % self.detection_every == 0 and detector is not None
+                    if detect and not watchdog.skip_detection:
+                        object_frame = self.process_objects_on_road(object_frame)
+                        telemetry.mark("detection")
+                        if overlays:
+                            self.recorder.write("objs", object_frame)
+                        telemetry.mark("recording")
+
+                    lane_frame = lane_follower.follow_lane(lane_frame)
+                    telemetry.mark("lane")
+                    if labels is not None:
+                        labels.log_follower(frame, lane_follower)
+                    if overlays:
+                        self.recorder.write("lane", lane_frame)
+                    self.mark_recording_events()
+                    telemetry.mark("recording")
+                    if detector is not None:
+                        detector.tick()
+                    telemetry.mark("actuation")
+                    telemetry.end_frame(i)
+
+                    if cv2.waitKey(1) & 0xFF == ord("q"):
+                        break
+        finally:
+            self.front_wheels, self.back_wheels = wheels
+            lane_follower.render_overlays = self.render_overlays
+            telemetry.close()
+            if labels is not None:
+                labels.close()
+
+    def drive_pipelined(self, speed=35):
+        """
+        Drive the car with capture, lane following and object detection
+        running in their own threads. Every stage works on the freshest frame
+        and stale frames are dropped instead of queued. The lane worker steers
+        as soon as its result is ready. The rate limited detection worker
+        only publishes its detections; this control loop applies the control
+        rules to the newest of them, records and handles the keyboard.
+        Telemetry books every steered frame: capture is its wait from the
+        camera to the lane worker, lane the worker's time including the
+        steering command, detection the time of a detection applied with it.
+        The frame budget applies to the capture to control loop latency.
+        """
+        logger.info(f"Starting to drive pipelined at speed {speed}...")
+        remotes, follow_lane, detect_objects = self.start_processes()
+        startup = self.warm_up_stages(remotes)
+        telemetry = Telemetry(
+            budget_ms=self.frame_budget_ms,
+            sink_path=self.telemetry_path if self.telemetry_sink else None,
+            startup=startup,
+        )
+        if self.telemetry_port is not None:
+            telemetry.serve(self.telemetry_port)
+        watchdog = telemetry.watchdog
+        labels = None
+        if self.log_labels:
+            labels = LabelLogger(self.labels_dir)
+            follow_lane = self.labelled(follow_lane, labels)
+        stream = CameraStream(self.camera)
+        raw_frames = stream.subscribe()
+        lane_worker = StageWorker("lane", follow_lane, stream.subscribe())
+        threads = [stream, lane_worker]
+        objs_worker = None
+        if detect_objects is not None:
+            objs_worker = StageWorker(
+                "objects",
+                detect_objects,
+                stream.subscribe(),
+                every_nth=self.detection_every,
+                max_rate=self.detection_rate,
+            )
+            threads.append(objs_worker)
+        detector = self.object_detector
+        lane_follower = self.lane_follower
+        for thread in threads:
+            thread.start()
 
-            if ret:
-                i += 1
-                logger.debug(f"Processing frame {i}")
-                self.video_orig.write(lane_frame)
+        self.back_wheels.speed = speed
+        lane_seq = 0
+        objs_seq = 0
+        try:
+            while stream.is_alive():
+                seq, lane = lane_worker.results.wait_newer(lane_seq, timeout=0.1)
+                if detector is not None:
+                    detector.tick()
+                if seq == lane_seq:
+                    continue
+                lane_seq = seq
+                start = time.perf_counter()
+                logger.debug(
+                    f"Frame {lane.index} steered "
+                    f"{(lane.finished - lane.timestamp) * 1000:.1f} ms after capture"
+                )
+                timings = {
+                    "capture": (lane.started - lane.timestamp) * 1000,
+                    "lane": (lane.finished - lane.started) * 1000,
+                }
+                # the workers read these flags on their next frame
+                overlays = not watchdog.skip_overlays
+                lane_follower.render_overlays = self.render_overlays and overlays
+                if objs_worker is not None:
+                    objs_worker.paused = watchdog.skip_detection
+
+                packet = raw_frames.get(timeout=0)
+                if packet is not None:
+                    self.recorder.write("orig", packet.image, packet.timestamp)
+                if overlays:
+                    self.recorder.write("lane", lane.value, lane.timestamp)
+
+                actuation = 0.0
+                seq, objs = objs_worker.results.get() if objs_worker else (0, None)
+                if seq != objs_seq:
+                    objs_seq = seq
+                    timings["detection"] = (objs.finished - objs.started) * 1000
+                    objects, objects_frame = objs.value
+                    control_start = time.perf_counter()
+                    detector.control_car(
+                        objects, objs.timestamp, objects_frame.shape
+                    )
+                    actuation = time.perf_counter() - control_start
+                    show_image("Detected Objects", objects_frame)
+                    if overlays:
+                        self.recorder.write("objs", objects_frame, objs.timestamp)
+                    logger.debug(f"Object detection {objs_worker.stats()}")
+                self.mark_recording_events(lane.timestamp)
+
+                now = time.perf_counter()
+                timings["actuation"] = actuation * 1000
+                timings["recording"] = (now - start - actuation) * 1000
+                total_ms = (now - lane.timestamp) * 1000
+                telemetry.record(lane.index, timings, total_ms, lane.timestamp)
 
-                show_image("Detected Objects", object_frame)
+                if cv2.waitKey(1) & 0xFF == ord("q"):
+                    break
+        finally:
+            stop_all(threads)
+            lane_follower.render_overlays = self.render_overlays
+            telemetry.close()
+            for remote in remotes:
+                remote.close()
+            if labels is not None:
+                labels.close()
+
+    def labelled(self, follow_lane, labels):
+        """
+        Wrap a lane stage so every frame it steers is logged with its labels
+        """
 
-                object_frame = self.process_objects_on_road(object_frame)
-                self.video_objs.write(object_frame)
+        def follow_and_log(frame):
+            result = follow_lane(frame)
+            labels.log_follower(frame, self.lane_follower)
+            return result
 
-                lane_frame = self.lane_follower.follow_lane(lane_frame)
-                self.video_lane.write(lane_frame)
+        return follow_and_log
 
-                if cv2.waitKey(1) & 0xFF == ord("q"):
-                    break
+    def start_processes(self):
+        """
+        Start the stages that run in their own process.
+        Returns (processes, lane stage, detection stage).
+        """
+        shape = (self.screen_height, self.screen_width, 3)
+        remotes = []
+        follow_lane = self.follow_lane
+        detect_objects = None
+        if self.object_detector is not None:
+            detect_objects = self.object_detector.detect_objects
+
+        if self.object_detector is not None and self.detector_process:
+            detector = RemoteDetector(shape, options=self.detector_options)
+            remotes.append(detector)
+            detect_objects = detector.detect_objects
+
+        if self.steering_process:
+            # only the CNN lane follower can run remotely, the parent instance
+            # just turns the wheels to the angles the child computes
+            lane_follower = self.lane_follower
+            steering = RemoteStage(
+                "steering",
+                steering_stage,
+                shape,
+                options={
+                    "backend": lane_follower.backend_name,
+                    "model_path": lane_follower.model_path,
+                    "backend_options": lane_follower.backend_options,
+                },
+            )
+            remotes.append(steering)
+
+            def follow_lane(frame):
+                return lane_follower.apply_steering_angle(frame, steering(frame))
+
+        return remotes, follow_lane, detect_objects
+
+    def warm_up_stages(self, remotes=None):
+        """
+        Run every model once on a black frame before the wheels start, then
+        report the startup times. remotes: the processes of drive_pipelined,
+        which replace the local stages they run
+        """
+        if self.warm_up:
+            frame = np.zeros((self.screen_height, self.screen_width, 3), np.uint8)
+            stages = {}
+            steering_remote = remotes is not None and self.steering_process
+            detector_remote = remotes is not None and self.detector_process
+            compute = getattr(self.lane_follower, "compute_steering_angle", None)
+            if compute is not None and not steering_remote:
+                stages["lane follower"] = compute
+            if self.object_detector is not None and not detector_remote:
+                stages["detector"] = self.object_detector.detect_objects
+            for remote in remotes or []:
+                stages[f"{remote.name} process"] = remote
+            for name, stage in stages.items():
+                warm_up(name, stage, frame, self.startup)
+        return self.startup.report()
+
+
+def config_error(config, pipelined):
+    """
+    Why DriveBerry(**config) cannot drive, None if it can
+    """
+    parameters = inspect.signature(DriveBerry.__init__).parameters
+    unknown = sorted(set(config) - set(parameters) - {"self"})
+    if unknown:
+        return f"unknown DriveBerry arguments {unknown}"
+    settings = {name: p.default for name, p in parameters.items() if name != "self"}
+    settings.update(config)
+
+    follower, detector = settings["lane_follower"], settings["detector"]
+    if follower not in LANE_FOLLOWERS:
+        return f"unknown lane follower {follower}, use one of {list(LANE_FOLLOWERS)}"
+    if detector is not None and detector not in DETECTORS:
+        return f"unknown detector {detector}, use one of {list(DETECTORS)}"
+    if settings["steering_process"] and follower != "cnn":
+        # the child process runs a CNNDrive; AutoDrive has no remote stage
+        return f"--steering-process needs the cnn lane follower, not {follower}"
+    if settings["detector_process"] and detector is None:
+        return "--detector-process needs a detector"
+    processes = settings["steering_process"] or settings["detector_process"]
+    if processes and not pipelined:
+        return "--steering-process and --detector-process only run pipelined"
+    return None
+
+
+def main(argv=None):
+    """
+    Drive with the stages chosen on the command line or in a config file
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--config",
+        help='JSON file of DriveBerry arguments, e.g. {"lane_follower": "cnn", '
+        '"lane_follower_options": {"backend": "tflite"}}',
+    )
+    parser.add_argument("--follower", choices=list(LANE_FOLLOWERS))
+    parser.add_argument("--detector", choices=list(DETECTORS) + ["none"])
+    parser.add_argument("--speed", type=int, default=35)
+    parser.add_argument("--sequential", action="store_true")
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="no display attached: draw overlays only for the recording",
+    )
+    parser.add_argument(
+        "--steering-process",
+        action="store_true",
+        help="run the cnn lane follower in its own process",
+    )
+    parser.add_argument(
+        "--detector-process",
+        action="store_true",
+        help="run the object detector in its own process",
+    )
+    args = parser.parse_args(argv)
+
+    config = {}
+    if args.config:
+        with open(args.config) as file:
+            config.update(json.load(file))
+    if args.headless:
+        config["headless"] = True
+    if args.follower:
+        config["lane_follower"] = args.follower
+    if args.detector:
+        config["detector"] = None if args.detector == "none" else args.detector
+    if args.steering_process:
+        config["steering_process"] = True
+    if args.detector_process:
+        config["detector_process"] = True
+    error = config_error(config, pipelined=not args.sequential)
+    if error is not None:
+        parser.error(error)
+
+    with DriveBerry(**config) as car:
+        car.drive(args.speed, pipelined=not args.sequential)
+    return 0
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
     logging.info("Starting car")
-    with DriveBerry() as car:
-        car.drive(35)
+    sys.exit(main())
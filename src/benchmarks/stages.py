@@ -0,0 +1,346 @@
+"""
+Time every stage of the drive loop in isolation and compare with a baseline.
+
+    python -m src.benchmarks.stages
+    python -m src.benchmarks.stages --video data/car_video.avi
+    python -m src.benchmarks.stages --update-baseline
+
+Runs without the camera, picar or the Edge TPU. The CNN falls back to a
+CPU stand-in of the same shape when no model backend can be loaded, and the
+detector runs on a CPU stand-in interpreter; stand-ins are marked in the
+report. Detector stages need pycoral installed and are skipped otherwise.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from src.cnn_driving.utility import Preprocessor, img_preprocess
+from src.opencv_auto.frame_processing import (
+    BOTTOM_HALF_ROI,
+    average_slope_intercept,
+    detect_edges,
+    detect_lane,
+    detect_line_segments,
+    detect_roi_edges,
+    region_of_interest,
+)
+from src.opencv_auto.kinematics import compute_steering_angle
+
+logger = logging.getLogger(__name__)
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# lane tape color inside LOWER_BLUE..UPPER_BLUE
+LANE_COLOR = (150, 90, 40)
+
+
+def synthetic_frames(count=8, width=640, height=480, seed=0):
+    """
+    Deterministic camera-like frames with two lane lines at varying offsets
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(count):
+        shift = int(40 * np.sin(2 * np.pi * i / count))
+        noise = rng.integers(0, 120, (height, width, 1), dtype=np.uint8)
+        frame = np.repeat(noise, 3, axis=2)
+        top = height // 2
+        cv2.line(frame, (100 + shift, height), (250 + shift, top), LANE_COLOR, 12)
+        cv2.line(frame, (540 + shift, height), (400 + shift, top), LANE_COLOR, 12)
+        frames.append(frame)
+    return frames
+
+
+def video_frames(path, count=8):
+    """
+    The first frames of a recorded video
+    """
+    cap = cv2.VideoCapture(path)
+    frames = []
+    try:
+        while cap.isOpened() and len(frames) < count:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+    finally:
+        cap.release()
+    if not frames:
+        raise ValueError(f"No frames could be read from {path}")
+    return frames
+
+
+class StandInCNN(object):
+    """
+    Linear CPU stand-in with the input and output shape of the CNN
+    """
+
+    input_dtype = np.float32
+    raw_pixel_input = False
+
+    def __init__(self, seed=0):
+        rng = np.random.default_rng(seed)
+        self.weights = rng.standard_normal((66 * 200 * 3, 1)).astype(np.float32)
+
+    def predict(self, x):
+        return x.reshape(len(x), -1) @ self.weights
+
+
+def load_cnn():
+    """
+    The first CNN backend that loads, else the stand-in; returns (name, backend)
+    """
+    from src.cnn_driving.backends import create_backend
+
+    for name in ("tflite", "keras"):
+        try:
+            return name, create_backend(name)
+        except (ImportError, OSError, ValueError) as e:
+            logger.debug(f"CNN backend {name} unavailable: {e}")
+    return "stand-in", StandInCNN()
+
+
+class StandInInterpreter(object):
+    """
+    CPU stand-in for the Edge TPU interpreter of the SSD detector: a
+    300x300 input and fixed detections, enough to run pycoral's pre- and
+    post-processing
+    """
+
+    def __init__(self, size=300, num_detections=10, seed=0):
+        rng = np.random.default_rng(seed)
+        corners = np.sort(rng.uniform(0, 1, (num_detections, 2, 2)), axis=1)
+        self._tensors = [
+            np.zeros((1, size, size, 3), np.uint8),
+            corners.reshape(1, num_detections, 4).astype(np.float32),
+            rng.integers(0, 4, (1, num_detections)).astype(np.float32),
+            rng.uniform(0.3, 1.0, (1, num_detections)).astype(np.float32),
+            np.array([num_detections], np.float32),
+        ]
+
+    def allocate_tensors(self):
+        pass
+
+    def invoke(self):
+        pass
+
+    def _get_full_signature_list(self):
+        return {}
+
+    def get_input_details(self):
+        tensor = self._tensors[0]
+        return [{"index": 0, "shape": np.array(tensor.shape), "dtype": tensor.dtype}]
+
+    def get_output_details(self):
+        return [
+            {"index": i, "shape": np.array(t.shape), "dtype": t.dtype}
+            for i, t in enumerate(self._tensors[1:], 1)
+        ]
+
+    def tensor(self, index):
+        return lambda: self._tensors[index]
+
+    def get_tensor(self, index):
+        return self._tensors[index].copy()
+
+
+def build_stages(frames, roi=BOTTOM_HALF_ROI):
+    """
+    Ordered {name: callable(i)} of the stages, each running on the
+    precomputed inputs of frame i % len(frames)
+    """
+    n = len(frames)
+    edges = [detect_edges(frame) for frame in frames]
+    roi_edges = [detect_roi_edges(frame, roi)[0] for frame in frames]
+    segments = [detect_line_segments(e) for e in roi_edges]
+    lane_lines = [detect_lane(frame)[0] for frame in frames]
+    preprocess = Preprocessor()
+    batches = [preprocess(frame).copy() for frame in frames]
+
+    stages = {
+        "detect_edges": lambda i: detect_edges(frames[i % n]),
+        "region_of_interest": lambda i: region_of_interest(edges[i % n], roi),
+        "detect_line_segments": lambda i: detect_line_segments(roi_edges[i % n]),
+        "average_slope_intercept": lambda i: average_slope_intercept(
+            frames[i % n], segments[i % n]
+        ),
+        "compute_steering_angle": lambda i: compute_steering_angle(
+            frames[i % n], lane_lines[i % n]
+        ),
+        "detect_lane": lambda i: detect_lane(frames[i % n]),
+        "img_preprocess": lambda i: img_preprocess(frames[i % n]),
+        "cnn_preprocess": lambda i: preprocess(frames[i % n]),
+    }
+
+    cnn_name, cnn = load_cnn()
+    stages[f"cnn_inference[{cnn_name}]"] = lambda i: cnn.predict(batches[i % n])
+
+    try:
+        from pycoral.adapters import detect
+
+        from src.object_detection.model import DetectionModel
+    except ImportError as e:
+        logger.warning(f"Skipping the detector stages, pycoral is missing: {e}")
+        return stages
+
+    model = DetectionModel()
+    model._interpreter = StandInInterpreter()
+    model.set_input(frames[0])
+    stages["detector_preprocess[stand-in]"] = lambda i: model.set_input(frames[i % n])
+    stages["detector_postprocess[stand-in]"] = lambda i: model.control_car(
+        detect.get_objects(model.interpreter, score_threshold=0.65)
+    )
+    return stages
+
+
+def measure(stage, iterations=200, warmup=10, alloc_calls=20):
+    """
+    Latency percentiles in milliseconds and the peak memory allocated by a
+    single call in KiB, as tracked by tracemalloc
+    """
+    for i in range(warmup):
+        stage(i)
+
+    times = np.empty(iterations)
+    for i in range(iterations):
+        start = time.perf_counter_ns()
+        stage(i)
+        times[i] = time.perf_counter_ns() - start
+    p50, p95, p99 = np.percentile(times, [50, 95, 99]) / 1e6
+
+    peaks = []
+    tracemalloc.start()
+    try:
+        for i in range(alloc_calls):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            stage(i)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "p50_ms": round(float(p50), 4),
+        "p95_ms": round(float(p95), 4),
+        "p99_ms": round(float(p99), 4),
+        "alloc_kib": round(float(np.median(peaks)) / 1024, 1),
+    }
+
+
+def machine():
+    """
+    Description of the machine the numbers were taken on
+    """
+    return {
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+    }
+
+
+def compare(
+    results, baseline, tolerance=0.25, min_delta_ms=0.02, alloc_slack_kib=1.0
+):
+    """
+    Names of the stages whose median latency or allocations regressed
+    against the baseline by more than tolerance. The median is compared as
+    the tail percentiles are too noisy on a loaded machine to gate on.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            logger.info(f"{name}: no baseline")
+            continue
+        max_alloc = base["alloc_kib"] * (1 + tolerance) + alloc_slack_kib
+        max_ms = max(base["p50_ms"] * (1 + tolerance), base["p50_ms"] + min_delta_ms)
+        slower = result["p50_ms"] > max_ms
+        if slower or result["alloc_kib"] > max_alloc:
+            regressions.append(name)
+            logger.warning(f"{name} regressed: {base} -> {result}")
+    return regressions
+
+
+def report(results, baseline):
+    """
+    Log a table of the results next to the baseline's median
+    """
+    logger.info(
+        f"{'stage':<34}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+        f"{'KiB/call':>10}{'base p50':>10}"
+    )
+    for name, r in results.items():
+        base = baseline.get(name, {}).get("p50_ms", float("nan"))
+        logger.info(
+            f"{name:<34}{r['p50_ms']:>9.3f}{r['p95_ms']:>9.3f}{r['p99_ms']:>9.3f}"
+            f"{r['alloc_kib']:>10.1f}{base:>10.3f}"
+        )
+
+
+def main(argv=None):
+    """
+    Run the suite; exits with 1 if a stage regressed against the baseline
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--video", default=None, help="take frames from a recording")
+    parser.add_argument("--frames", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--stage", action="append", help="only run these stages")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--output", default=None, help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.video:
+        frames = video_frames(args.video, args.frames)
+    else:
+        frames = synthetic_frames(args.frames)
+
+    # time the stages, not their debug logging
+    logging.getLogger("src").setLevel(logging.INFO)
+
+    stages = build_stages(frames)
+    results = {}
+    for name, stage in stages.items():
+        if args.stage and name.split("[")[0] not in args.stage:
+            continue
+        results[name] = measure(stage, args.iterations)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            stored = json.load(file)
+        baseline = stored["stages"]
+        if stored["machine"] != machine():
+            logger.warning(
+                f"Baseline was taken on {stored['machine']}, this is {machine()}"
+            )
+
+    report(results, baseline)
+    document = {"machine": machine(), "frames": args.video or "synthetic"}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(dict(document, stages=results), file, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(dict(document, stages={**baseline, **results}), file, indent=2)
+        logger.info(f"Wrote {args.baseline}")
+        return 0
+
+    return 1 if compare(results, baseline, args.tolerance) else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(main())
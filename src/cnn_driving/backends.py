@@ -0,0 +1,146 @@
+"""
+Inference backends for the CNN driving model
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MODEL_PATHS = {
+    "keras": "src/cnn_driving/model/lane_follower_cnn.keras",
+    "tflite": "src/cnn_driving/model/lane_follower_cnn_float16.tflite",
+}
+
+
+def load_interpreter_class():
+    """
+    The lightweight tflite_runtime interpreter, falling back to the one
+    bundled with TensorFlow
+    """
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class KerasBackend(object):
+    """
+    Runs the full Keras model
+    """
+
+    input_dtype = np.float32
+
+    def __init__(self, model_path=MODEL_PATHS["keras"], fold_normalization=False):
+        """
+        fold_normalization: move the division by 255 into the model graph, so
+            the model takes the raw pixel values
+        """
+        from tensorflow import keras
+
+        logger.info(f"Loading Keras model {model_path}")
+        self.model = keras.models.load_model(model_path)
+        self.raw_pixel_input = fold_normalization
+        if fold_normalization:
+            inputs = keras.Input(shape=self.model.input_shape[1:])
+            outputs = self.model(keras.layers.Rescaling(1 / 255)(inputs))
+            self.model = keras.Model(inputs, outputs)
+
+    def predict(self, x):
+        """
+        Steering angles of a (N, 66, 200, 3) float batch, shape (N, 1)
+        """
+        return self.model.predict(x, verbose=0)
+
+
+class TFLiteBackend(object):
+    """
+    Runs a converted .tflite model with a preallocated interpreter.
+    Quantized inputs are quantized in place in the interpreter's input tensor,
+    quantized outputs are dequantized.
+    """
+
+    def __init__(self, model_path=MODEL_PATHS["tflite"], num_threads=None):
+        logger.info(f"Loading TFLite model {model_path}")
+        Interpreter = load_interpreter_class()
+        self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+
+        input_details = self.interpreter.get_input_details()[0]
+        output_details = self.interpreter.get_output_details()[0]
+        self.input_index = input_details["index"]
+        self.input_dtype = input_details["dtype"]
+        self.input_quantization = input_details["quantization"]
+        self.output_index = output_details["index"]
+        self.output_quantization = output_details["quantization"]
+        self.input_shape = tuple(input_details["shape"])
+
+        # view onto the interpreter's input buffer, must be re-fetched per call
+        self._input = self.interpreter.tensor(self.input_index)
+
+    @property
+    def quantized_input(self):
+        return self.input_dtype in (np.uint8, np.int8)
+
+    @property
+    def raw_pixel_input(self):
+        """
+        True if the quantized input is exactly the uint8 pixel value, i.e.
+        scale 1/255 and zero point 0, so frames can skip the normalization
+        """
+        scale, zero_point = self.input_quantization
+        return (
+            self.input_dtype == np.uint8
+            and zero_point == 0
+            and np.isclose(scale, 1 / 255)
+        )
+
+    def resize(self, batch_size):
+        """
+        Reallocate the interpreter for batches of another size
+        """
+        self.input_shape = (batch_size,) + self.input_shape[1:]
+        self.interpreter.resize_tensor_input(self.input_index, self.input_shape)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.tensor(self.input_index)
+
+    def predict(self, x):
+        """
+        Steering angles of a (N, 66, 200, 3) batch normalized to [0, 1],
+        shape (N, 1). Models with raw_pixel_input also take uint8 pixels.
+        The interpreter is resized when N changes, the car always sends 1.
+        """
+        if len(x) != self.input_shape[0]:
+            self.resize(len(x))
+        tensor = self._input()
+        if not self.quantized_input:
+            tensor[...] = x
+        elif x.dtype == np.uint8 and self.raw_pixel_input:
+            tensor[...] = x
+        else:
+            scale, zero_point = self.input_quantization
+            info = np.iinfo(self.input_dtype)
+            tensor[...] = np.clip(np.rint(x / scale + zero_point), info.min, info.max)
+        del tensor
+
+        self.interpreter.invoke()
+
+        output = self.interpreter.get_tensor(self.output_index)
+        scale, zero_point = self.output_quantization
+        if scale:
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+def create_backend(backend="keras", model_path=None, **kwargs):
+    """
+    Create an inference backend by name
+    """
+    backends = {"keras": KerasBackend, "tflite": TFLiteBackend}
+    if backend not in backends:
+        raise ValueError(f"Unknown CNN backend {backend}, use one of {list(backends)}")
+    return backends[backend](model_path or MODEL_PATHS[backend], **kwargs)
@@ -0,0 +1,136 @@
+"""
+Convert the Keras lane follower to TFLite and check it against the original.
+
+    python -m src.cnn_driving.convert float16 data/car_video*.avi
+    python -m src.cnn_driving.convert int8 data/car_video*.avi
+
+The recorded videos provide the frames: every other sampled frame is the
+representative dataset of the int8 calibration, the others are held out to
+check the converted model on. The bundled model was saved by Keras 2.14;
+TensorFlow 2.16 and later load it with tf_keras installed,
+TF_USE_LEGACY_KERAS=1 and --model src/cnn_driving/model/lane_follower_cnn.h5.
+"""
+
+import argparse
+import logging
+import sys
+
+import cv2
+import numpy as np
+
+from src.cnn_driving.backends import MODEL_PATHS, KerasBackend, TFLiteBackend
+from src.cnn_driving.utility import img_preprocess
+
+logger = logging.getLogger(__name__)
+
+# maximum steering difference in degrees from the Keras model that a
+# converted model may show on any recorded frame
+STEERING_TOLERANCE = {"float32": 0.5, "float16": 1.0, "int8": 3.0}
+
+
+def sample_frames(video_paths, num_samples=200):
+    """
+    Preprocessed frames spread evenly over the recorded videos
+    """
+    per_video = max(1, num_samples // len(video_paths))
+    samples = []
+    for path in video_paths:
+        cap = cv2.VideoCapture(path)
+        try:
+            count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            wanted = set(np.linspace(0, max(count - 1, 0), per_video, dtype=int))
+            index = 0
+            while cap.isOpened():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if index in wanted:
+                    samples.append(img_preprocess(frame).astype(np.float32))
+                index += 1
+        finally:
+            cap.release()
+
+    logger.info(f"Sampled {len(samples)} frames from {len(video_paths)} videos")
+    return samples
+
+
+def convert(model, quantization, samples, output_path):
+    """
+    Convert a loaded Keras model to TFLite.
+    quantization: float32, float16 or int8; int8 is calibrated on samples and
+        takes the raw uint8 pixels as input
+    """
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+
+        def representative_dataset():
+            # pin the input range to [0, 1] so the uint8 input is the pixel
+            full_range = np.linspace(0, 1, 66 * 200 * 3, dtype=np.float32)
+            yield [full_range.reshape(1, 66, 200, 3)]
+            for sample in samples:
+                yield [sample[np.newaxis]]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8
+    elif quantization != "float32":
+        raise ValueError(f"Unknown quantization {quantization}")
+
+    with open(output_path, "wb") as file:
+        file.write(converter.convert())
+    logger.info(f"Wrote {output_path}")
+
+
+def compare_backends(reference, candidate, samples):
+    """
+    Absolute steering differences in degrees between two backends
+    """
+    differences = []
+    for sample in samples:
+        x = sample[np.newaxis]
+        expected = reference.predict(x)[0, 0]
+        actual = candidate.predict(x)[0, 0]
+        differences.append(abs(float(expected) - float(actual)))
+    return np.array(differences)
+
+
+def main(argv=None):
+    """
+    Convert, then check the converted model stays within STEERING_TOLERANCE
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("quantization", choices=sorted(STEERING_TOLERANCE))
+    parser.add_argument("videos", nargs="+", help="recorded car_video*.avi files")
+    parser.add_argument("--model", default=MODEL_PATHS["keras"])
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    output = args.output
+    if output is None:
+        output = args.model.rsplit(".", 1)[0] + f"_{args.quantization}.tflite"
+    samples = sample_frames(args.videos, args.samples)
+    calibration, held_out = samples[::2], samples[1::2] or samples
+    keras_backend = KerasBackend(args.model)
+    convert(keras_backend.model, args.quantization, calibration, output)
+
+    candidate = TFLiteBackend(output)
+    differences = compare_backends(keras_backend, candidate, held_out)
+    tolerance = STEERING_TOLERANCE[args.quantization]
+    logger.info(
+        f"Steering difference to Keras on {len(held_out)} held out frames: "
+        f"mean {differences.mean():.2f}, p99 {np.percentile(differences, 99):.2f}, "
+        f"max {differences.max():.2f} degrees (tolerance {tolerance})"
+    )
+    return 0 if differences.max() <= tolerance else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
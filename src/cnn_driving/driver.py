@@ -3,13 +3,12 @@ This module contains the main class for the lane follower.
 """
 
 import logging
-import math
 
-import cv2
 import numpy as np
-from tensorflow.keras.models import load_model
 
-from src.cnn_driving.utility import img_preprocess, display_heading_line, show_image
+from src.cnn_driving.backends import create_backend
+from src.cnn_driving.utility import Preprocessor, display_heading_line, show_image
+from src.opencv_auto.utility import LazyOverlay, OverlayCanvas
 
 logger = logging.getLogger(__name__)
 
@@ -20,21 +19,60 @@ class CNNDrive(object):
     """
 
     def __init__(
-        self, car=None, model_path="src/cnn_driving/model/lane_follower_cnn.keras"
+        self,
+        car=None,
+        model_path=None,
+        render_overlays=True,
+        backend="keras",
+        backend_options=None,
     ):
+        """
+        car: the car that should be controlled by this object
+        model_path: model file, defaults to the bundled model of the backend
+        backend: "keras" for the full TensorFlow model or "tflite" for a
+            converted model; src/cnn_driving/convert.py checks converted
+            models against Keras, to 1 degree for float16 and 3 for int8
+        backend_options: extra arguments of the backend, e.g.
+            {"fold_normalization": True} to normalize inside the Keras graph
+        """
         logger.info("Creating a CNNDrive instance...")
 
         self.car = car
+        self.render_overlays = render_overlays
         self.curr_steering_angle = 90
-        self.model = load_model(model_path)
+        self.canvas = OverlayCanvas()
+        self.backend_name = backend
+        self.model_path = model_path
+        self.backend_options = backend_options or {}
+        self._backend = None
+        self.preprocess = None
+
+    @property
+    def backend(self):
+        """
+        The inference backend, loaded on first use so an instance that only
+        steers with angles computed in another process never loads the model
+        """
+        if self._backend is None:
+            self._backend = create_backend(
+                self.backend_name, self.model_path, **self.backend_options
+            )
+            # preprocess straight into the input layout the backend wants
+            if self._backend.raw_pixel_input:
+                self.preprocess = Preprocessor(
+                    self._backend.input_dtype, normalize=False
+                )
+            else:
+                self.preprocess = Preprocessor(np.float32)
+        return self._backend
 
     def compute_steering_angle(self, frame):
         """
         Compute the steering angle based on the input frame
         """
-        preprocessed = img_preprocess(frame)
-        x = np.asarray([preprocessed])
-        steering_angle = self.model.predict(x)[0]
+        backend = self.backend
+        x = self.preprocess(frame)
+        steering_angle = backend.predict(x)[0, 0]
 
         logger.debug("new steering angle: %s" % steering_angle)
         return int(steering_angle + 0.5)
@@ -45,12 +83,34 @@ class CNNDrive(object):
         """
 
         show_image("orig", frame)
+        return self.apply_steering_angle(frame, self.compute_steering_angle(frame))
+
+    def reset(self):
+        """
+        Steer straight ahead again; the model itself keeps no state between
+        frames
+        """
+        self.curr_steering_angle = 90
 
-        self.curr_steering_angle = self.compute_steering_angle(frame)
+    def apply_steering_angle(self, frame, steering_angle):
+        """
+        Turn the wheels to a steering angle computed for the frame
+        """
+        self.curr_steering_angle = steering_angle
         logger.debug("curr_steering_angle = %d" % self.curr_steering_angle)
 
         if self.car is not None:
             self.car.front_wheels.turn(self.curr_steering_angle)
-        final_frame = display_heading_line(frame, self.curr_steering_angle)
 
-        return final_frame
+        overlay = LazyOverlay(self.render_overlay, frame, self.curr_steering_angle)
+        if self.render_overlays:
+            return overlay()
+        return overlay
+
+    def render_overlay(self, frame, steering_angle, out=None):
+        """
+        Draw the heading line over the frame
+        """
+        return display_heading_line(
+            frame, steering_angle, canvas=self.canvas, out=out
+        )
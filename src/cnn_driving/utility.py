@@ -2,22 +2,72 @@
 Utility functions for CNN driving model
 """
 
-import math
 import cv2
 import numpy as np
 
+from src.opencv_auto.utility import OverlayCanvas, draw_heading_line
+
+# input image size (200,66) Nvidia model
+INPUT_WIDTH = 200
+INPUT_HEIGHT = 66
+
+
+class Preprocessor(object):
+    """
+    Preprocesses frames straight into a preallocated (1, 66, 200, 3) model
+    input. The YUV conversion is per pixel and commutes with the linear blur
+    and resize, so it runs last on the small image; the blur still runs
+    before the resize, which it does not commute with.
+    """
+
+    def __init__(self, dtype=np.float32, normalize=True, crop=True):
+        """
+        dtype: float32, or uint8 for quantized models that take raw pixels
+        normalize: scale to [0, 1]; turn off for models that normalize in
+            their graph
+        crop: keep only the bottom half of the frame; off for frames that
+            were stored cropped already
+        """
+        self.normalize = normalize and np.dtype(dtype).kind == "f"
+        self.crop = crop
+        self.batch = np.empty((1, INPUT_HEIGHT, INPUT_WIDTH, 3), dtype)
+        self._blurred = None
+        self._resized = np.empty((INPUT_HEIGHT, INPUT_WIDTH, 3), np.uint8)
+        self._yuv = np.empty((INPUT_HEIGHT, INPUT_WIDTH, 3), np.uint8)
+
+    def __call__(self, image, out=None):
+        """
+        Preprocess a BGR frame, returns the reused input batch
+        out: (66, 200, 3) array of the same dtype to write to instead of the
+            batch, returned
+        """
+        if self.crop:
+            height, _, _ = image.shape
+            image = image[int(height / 2) :, :, :]
+        if self._blurred is None or self._blurred.shape != image.shape:
+            self._blurred = np.empty_like(image)
+
+        cv2.GaussianBlur(image, (3, 3), 0, dst=self._blurred)
+        cv2.resize(self._blurred, (INPUT_WIDTH, INPUT_HEIGHT), dst=self._resized)
+
+        target = self.batch[0] if out is None else out
+        if self.batch.dtype == np.uint8:
+            cv2.cvtColor(self._resized, cv2.COLOR_BGR2YUV, dst=target)
+        elif self.normalize:
+            cv2.cvtColor(self._resized, cv2.COLOR_BGR2YUV, dst=self._yuv)
+            np.multiply(self._yuv, 1 / 255, out=target)
+        else:
+            cv2.cvtColor(self._resized, cv2.COLOR_BGR2YUV, dst=self._yuv)
+            np.copyto(target, self._yuv)
+        return self.batch if out is None else out
+
 
 def img_preprocess(image):
     """
     Preprocess image for CNN driving model
+    Same operations as the Preprocessor CNNDrive uses, as a new float32 array
     """
-    height, _, _ = image.shape
-    image = image[int(height / 2) :, :, :]
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2YUV)
-    image = cv2.GaussianBlur(image, (3, 3), 0)
-    image = cv2.resize(image, (200, 66))  # input image size (200,66) Nvidia model
-    image = image / 255
-    return image
+    return Preprocessor()(image)[0]
 
 
 def display_heading_line(
@@ -25,22 +75,18 @@ def display_heading_line(
     steering_angle,
     line_color=(0, 0, 255),
     line_width=5,
+    canvas=None,
+    out=None,
 ):
     """
     Find the heading line from steering angle
+    canvas: OverlayCanvas to reuse, otherwise new buffers are allocated
+    out: optional buffer that receives the blended image
     """
-    heading_image = np.zeros_like(frame)
-    height, width, _ = frame.shape
-    steering_angle_radian = steering_angle / 180.0 * math.pi
-    x1 = int(width / 2)
-    y1 = height
-    x2 = int(x1 - height / 2 / math.tan(steering_angle_radian))
-    y2 = int(height / 2)
-
-    cv2.line(heading_image, (x1, y1), (x2, y2), line_color, line_width)
-    heading_image = cv2.addWeighted(frame, 0.8, heading_image, 1, 1)
-
-    return heading_image
+    if canvas is None:
+        canvas = OverlayCanvas(num_outputs=1)
+    draw_heading_line(canvas.clear(frame), steering_angle, line_color, line_width)
+    return canvas.blend(frame, out)
 
 
 def show_image(title, frame):
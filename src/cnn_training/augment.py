@@ -0,0 +1,125 @@
+"""
+Batched training augmentation: the notebook's pan, zoom, blur, brightness
+and horizontal flip of a whole (N, H, W, 3) uint8 batch, its random
+parameters drawn at once
+"""
+
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class BatchAugmenter(object):
+    """
+    Draws the random parameters of a whole batch in one go and applies every
+    augmentation to the images that drew it, each with probability p as in
+    the notebook's random_augment. The operations run per image with OpenCV
+    and write into the batch in place; on camera frames that is faster than
+    numpy broadcasts over the batch, which need float temporaries. The
+    notebook's pan followed by its zoom is composed into one affine warp,
+    so a frame is interpolated once instead of twice. The warp's scratch
+    buffer is kept per thread, so the loader's workers can share one
+    augmenter.
+    """
+
+    def __init__(
+        self,
+        p=0.5,
+        pan=0.1,
+        zoom=(1.0, 1.3),
+        brightness=(0.7, 1.3),
+        blur=(1, 5),
+        seed=None,
+    ):
+        """
+        p: probability of each augmentation, the flip included
+        pan: maximum shift as a fraction of the image size, in x and y
+        zoom: range of the scale around the image center
+        brightness: range of the factor the pixels are multiplied by
+        blur: range of the box blur kernel size, both ends included
+        seed: seed of the generator used when a call brings none
+        """
+        self.p = p
+        self.pan = pan
+        self.zoom = zoom
+        self.brightness = brightness
+        self.blur = blur
+        self.rng = np.random.default_rng(seed)
+        self._buffers = threading.local()
+
+    def __call__(self, images, angles, rng=None):
+        """
+        Augment a batch in place; returns the images and the new angles,
+        flipped frames steer 180 - angle
+        """
+        rng = rng or self.rng
+        count, height, width = images.shape[:3]
+        angles = np.array(angles, dtype=np.float32)
+
+        chosen = rng.random((5, count)) < self.p
+        shifts = rng.uniform(-self.pan, self.pan, (count, 2)) * (width, height)
+        scales = rng.uniform(*self.zoom, count)
+        factors = rng.uniform(*self.brightness, count)
+        kernels = rng.integers(self.blur[0], self.blur[1] + 1, count)
+        pan, zoom, blur, bright, flip = chosen
+
+        shifts[~pan] = 0.0
+        scales[~zoom] = 1.0
+        self.warp(images, np.flatnonzero(pan | zoom), shifts, scales)
+        self.box_blur(images, kernels * blur)
+        self.scale_brightness(images, np.flatnonzero(bright), factors)
+
+        for i in np.flatnonzero(flip):
+            cv2.flip(images[i], 1, dst=images[i])
+        angles[flip] = 180 - angles[flip]
+        return images, angles
+
+    def warp(self, images, selected, shifts, scales):
+        """
+        Shift, then zoom the selected images about their center, as the
+        notebook's pan and zoom Affines do, with black borders like imgaug's
+        """
+        height, width = images.shape[1:3]
+        warped = getattr(self._buffers, "warped", None)
+        if warped is None or warped.shape != images.shape[1:]:
+            warped = self._buffers.warped = np.empty(images.shape[1:], np.uint8)
+
+        center = np.array([width / 2, height / 2])
+        matrix = np.zeros((2, 3))
+        for i in selected:
+            scale = scales[i]
+            matrix[0, 0] = matrix[1, 1] = scale
+            # x -> scale * (x + shift - center) + center
+            matrix[:, 2] = (1 - scale) * center + scale * shifts[i]
+            cv2.warpAffine(
+                images[i],
+                matrix,
+                (width, height),
+                dst=warped,
+                flags=cv2.INTER_LINEAR,
+                borderMode=cv2.BORDER_CONSTANT,
+                borderValue=0,
+            )
+            images[i] = warped
+
+    def box_blur(self, images, kernels):
+        """
+        Box blur every image with its kernel size, 0 and 1 leave it as is
+        """
+        for size in np.unique(kernels):
+            if size <= 1:
+                continue
+            for i in np.flatnonzero(kernels == size):
+                cv2.blur(images[i], (int(size), int(size)), dst=images[i])
+
+    def scale_brightness(self, images, selected, factors):
+        """
+        Multiply the selected images by their factor, rounded and saturating
+        at 255
+        """
+        for i in selected:
+            cv2.convertScaleAbs(images[i], dst=images[i], alpha=float(factors[i]))
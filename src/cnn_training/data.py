@@ -0,0 +1,262 @@
+"""
+Training batches read from the labelled shards of src/cnn_training/shards.py.
+Frames are memory mapped, augmented and run through the car's Preprocessor
+in parallel workers, a batch at a time, and prefetched. With the shards
+written by src.cnn_training.shards, their index by src.cnn_training.index
+and model the notebook's Keras model:
+
+    from src.cnn_training.augment import BatchAugmenter
+    from src.cnn_training.data import BatchLoader, ShardDataset, split_by_shard
+    from src.cnn_training.index import AngleIndex
+
+    dataset = ShardDataset("data/shards")
+    train, valid = split_by_shard(dataset)
+    index = AngleIndex.load("data/shards")
+    augment = BatchAugmenter()
+    train_batches = BatchLoader(dataset, train, index=index, augment=augment)
+    valid_batches = BatchLoader(dataset, valid, index=index, training=False)
+    model.fit(
+        train_batches.tf_dataset(),
+        steps_per_epoch=train_batches.steps,
+        validation_data=valid_batches.tf_dataset(),
+        validation_steps=valid_batches.steps,
+    )
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.cnn_driving.utility import INPUT_HEIGHT, INPUT_WIDTH, Preprocessor
+from src.cnn_training.shards import open_shards
+
+logger = logging.getLogger(__name__)
+
+
+class ShardDataset(object):
+    """
+    The shards of a directory as one memory mapped, indexable dataset
+    """
+
+    def __init__(self, shard_dir):
+        self.shard_dir = shard_dir
+        self.manifest, self.images, self.angles = open_shards(shard_dir)
+        self.layout = self.manifest["layout"]
+        counts = [len(images) for images in self.images]
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        logger.info(
+            f"{len(self)} {self.layout} frames in {len(self.images)} shards "
+            f"of {shard_dir}"
+        )
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    @property
+    def frame_shape(self):
+        return self.images[0].shape[1:]
+
+    def shard_of(self, indices):
+        return np.searchsorted(self.offsets, indices, side="right") - 1
+
+    def gather(self, indices, out=None):
+        """
+        Copy the frames with the given global indices into one array
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if out is None:
+            out = np.empty((len(indices),) + self.frame_shape, np.uint8)
+        shards = self.shard_of(indices)
+        for shard in np.unique(shards):
+            selected = shards == shard
+            out[selected] = self.images[shard][indices[selected] - self.offsets[shard]]
+        return out
+
+
+def split_by_shard(dataset, validation=0.2, seed=0):
+    """
+    Train and validation indices drawn from disjoint shards, so neighbouring
+    near-identical frames never end up on both sides
+    """
+    rng = np.random.default_rng(seed)
+    shards = rng.permutation(len(dataset.images))
+    num_valid = max(1, int(round(len(shards) * validation))) if len(shards) > 1 else 0
+    train, valid = [], []
+    for i, shard in enumerate(shards):
+        indices = np.arange(dataset.offsets[shard], dataset.offsets[shard + 1])
+        (valid if i < num_valid else train).append(indices)
+    return (
+        np.concatenate(train) if train else np.empty(0, np.int64),
+        np.concatenate(valid) if valid else np.empty(0, np.int64),
+    )
+
+
+class BatchLoader(object):
+    """
+    Batches of (model input, steering angle) from a ShardDataset.
+    Every batch is gathered, augmented and preprocessed by one worker; the
+    preprocessing is the Preprocessor CNNDrive runs on the car, so training
+    sees exactly the inputs the car will.
+    """
+
+    def __init__(
+        self,
+        dataset,
+        indices=None,
+        batch_size=100,
+        training=True,
+        augment=None,
+        index=None,
+        seed=None,
+    ):
+        """
+        dataset: a ShardDataset or the directory of the shards
+        indices: the samples to use, e.g. from split_by_shard; all by default
+        training: shuffle every epoch and augment; validation batches keep
+            the order and are not augmented
+        augment: callable (images, angles, rng) -> (images, angles) working
+            on uint8 BGR frame batches, e.g. a BatchAugmenter
+        index: an AngleIndex of the dataset; only its frames are used, with
+            the near-duplicates pruned, and training epochs draw epoch_size
+            samples balanced over its angle bins instead of a permutation
+        seed: makes the shuffling and augmentation reproducible
+        """
+        if not isinstance(dataset, ShardDataset):
+            dataset = ShardDataset(dataset)
+        if augment is not None and training and dataset.layout == "yuv":
+            raise ValueError(
+                "yuv shards are already preprocessed, augmentation needs shards "
+                "of the frame or crop layout"
+            )
+        self.dataset = dataset
+        if index is not None and indices is not None:
+            index = index.subset(indices)
+        if index is not None:
+            indices = index.indices
+        elif indices is None:
+            indices = np.arange(len(dataset))
+        self.indices = np.asarray(indices)
+        self.index = index if training else None
+        self.batch_size = batch_size
+        self.training = training
+        self.augment = augment if training else None
+        self.seed = np.random.SeedSequence(seed).entropy
+        self._local = threading.local()
+
+    @property
+    def steps(self):
+        """
+        Batches per epoch
+        """
+        return -(-self.epoch_size // self.batch_size)
+
+    @property
+    def epoch_size(self):
+        if self.index is not None:
+            return self.index.epoch_size
+        return len(self.indices)
+
+    def epoch(self, number):
+        """
+        (indices, batch seed) of every batch of an epoch
+        """
+        indices = self.indices
+        if self.training:
+            rng = np.random.default_rng([self.seed, number])
+            if self.index is not None:
+                indices = self.index.sample(self.epoch_size, rng)
+            else:
+                indices = rng.permutation(indices)
+        for batch in range(self.steps):
+            chunk = indices[batch * self.batch_size : (batch + 1) * self.batch_size]
+            state = np.random.SeedSequence([self.seed, number, batch]).generate_state(1)
+            yield chunk, int(state[0])
+
+    def _preprocessor(self):
+        # Preprocessor keeps per call buffers, one per worker thread
+        preprocessor = getattr(self._local, "preprocessor", None)
+        if preprocessor is None:
+            crop = self.dataset.layout == "frame"
+            preprocessor = Preprocessor(np.float32, crop=crop)
+            self._local.preprocessor = preprocessor
+        return preprocessor
+
+    def load(self, indices, batch_seed=0):
+        """
+        The model inputs, float32 (N, 66, 200, 3), and angles, float32 (N,),
+        of the given samples
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        images = self.dataset.gather(indices)
+        angles = self.dataset.angles[indices].astype(np.float32)
+        if self.augment is not None:
+            rng = np.random.default_rng(int(batch_seed))
+            images, angles = self.augment(images, angles, rng)
+
+        x = np.empty((len(indices), INPUT_HEIGHT, INPUT_WIDTH, 3), np.float32)
+        if self.dataset.layout == "yuv":
+            np.multiply(images, 1 / 255, out=x)
+        else:
+            preprocess = self._preprocessor()
+            for image, out in zip(images, x):
+                preprocess(image, out=out)
+        return x, np.asarray(angles, dtype=np.float32)
+
+    def batches(self, epochs=1, workers=4, prefetch=2):
+        """
+        Yield (x, y) batches in order, loaded by a pool of worker threads
+        that stays prefetch batches per worker ahead; epochs=None repeats
+        forever, as a Keras generator
+        """
+        ahead = max(1, workers * prefetch)
+
+        def jobs():
+            number = 0
+            while epochs is None or number < epochs:
+                yield from self.epoch(number)
+                number += 1
+
+        with ThreadPoolExecutor(workers, thread_name_prefix="batches") as pool:
+            pending = []
+            for indices, batch_seed in jobs():
+                pending.append(pool.submit(self.load, indices, batch_seed))
+                if len(pending) >= ahead:
+                    yield pending.pop(0).result()
+            for future in pending:
+                yield future.result()
+
+    def tf_dataset(self, parallel_calls=None, prefetch=None):
+        """
+        The batches as an endless tf.data.Dataset, loaded by a parallel map
+        and prefetched; parallel_calls and prefetch default to AUTOTUNE
+        """
+        import tensorflow as tf
+
+        autotune = tf.data.AUTOTUNE
+
+        def jobs():
+            number = 0
+            while True:
+                yield from self.epoch(number)
+                number += 1
+
+        def load(indices, batch_seed):
+            x, y = tf.numpy_function(
+                self.load, [indices, batch_seed], [tf.float32, tf.float32]
+            )
+            x.set_shape([None, INPUT_HEIGHT, INPUT_WIDTH, 3])
+            y.set_shape([None])
+            return x, y
+
+        jobs = tf.data.Dataset.from_generator(
+            jobs,
+            output_signature=(
+                tf.TensorSpec([None], tf.int64),
+                tf.TensorSpec([], tf.int64),
+            ),
+        )
+        return jobs.map(
+            load, num_parallel_calls=parallel_calls or autotune, deterministic=True
+        ).prefetch(prefetch or autotune)
@@ -0,0 +1,262 @@
+"""
+Measure how far the CNN lane follower drifts from the OpenCV teacher.
+
+    python -m src.cnn_training.evaluate data/car_video*.avi
+    python -m src.cnn_training.evaluate data/car_video*.avi --backend tflite
+    python -m src.cnn_training.evaluate data/shards --output evaluation.json
+
+Videos are streamed in chunks. The teacher angles of every chunk are
+computed by a process pool with detect_lane and compute_steering_angle,
+then smoothed in order exactly as AutoDrive does. Meanwhile this process
+runs the student on large batches of the same frames. No more than a
+batch of frames is held at a time, only the angles of every frame are
+kept, so hour-long recordings run in bounded memory.
+Shard directories already hold the teacher's labels, only the student
+runs on them.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from src.cnn_driving.utility import INPUT_HEIGHT, INPUT_WIDTH, Preprocessor
+from src.cnn_training.shards import open_at, plan_chunks
+from src.opencv_auto.kinematics import stabilize_steering_angle
+
+logger = logging.getLogger(__name__)
+
+
+def teacher_chunk(video_path, start, stop):
+    """
+    Unsmoothed teacher angles and lane line counts of frames start..stop,
+    each frame on its own; -90 where no lane line was found
+    """
+    from src.opencv_auto.frame_processing import detect_lane
+    from src.opencv_auto.kinematics import compute_steering_angle
+
+    # the per frame logging of the lane pipeline costs more than the frames
+    logging.getLogger("src.opencv_auto").setLevel(logging.WARNING)
+    angles = np.empty(stop - start, np.int16)
+    lines = np.empty(stop - start, np.int8)
+    cap = open_at(video_path, start)
+    count = 0
+    try:
+        while count < len(angles):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            lane_lines, _ = detect_lane(frame)
+            angles[count] = compute_steering_angle(frame, lane_lines)
+            lines[count] = len(lane_lines)
+            count += 1
+    finally:
+        cap.release()
+    return angles[:count], lines[:count]
+
+
+class TeacherSmoother(object):
+    """
+    Turns the per frame angles into the ones AutoDrive steers, whose
+    stabilization only depends on the previous angle
+    """
+
+    def __init__(self, initial_angle=90):
+        self.angle = initial_angle
+
+    def __call__(self, raw_angles, num_lines):
+        angles = np.empty(len(raw_angles), np.int16)
+        for i, (raw, lines) in enumerate(zip(raw_angles, num_lines)):
+            if lines > 0:
+                self.angle = stabilize_steering_angle(self.angle, int(raw), int(lines))
+            angles[i] = self.angle
+        return angles
+
+
+class Student(object):
+    """
+    A CNN backend predicting the angles of many frames per call
+    """
+
+    def __init__(self, backend, batch_size=64):
+        self.backend = backend
+        self.batch_size = batch_size
+        if backend.raw_pixel_input:
+            self.preprocess = Preprocessor(backend.input_dtype, normalize=False)
+        else:
+            self.preprocess = Preprocessor(np.float32)
+        dtype = self.preprocess.batch.dtype
+        self.batch = np.empty((batch_size, INPUT_HEIGHT, INPUT_WIDTH, 3), dtype)
+        self.seconds = 0.0
+
+    def predict(self, x):
+        """
+        Angles the car would steer for a batch of model inputs, rounded as
+        CNNDrive rounds them
+        """
+        start = time.perf_counter()
+        angles = np.floor(self.backend.predict(x)[:, 0] + 0.5)
+        self.seconds += time.perf_counter() - start
+        return angles.astype(np.int16)
+
+    def frames(self, cap, count):
+        """
+        Angles of the next count frames of a capture, fewer if it ends
+        """
+        angles = []
+        filled = 0
+        while count > 0:
+            ret, frame = cap.read()
+            if ret:
+                self.preprocess(frame, out=self.batch[filled])
+                filled += 1
+                count -= 1
+            if filled == self.batch_size or (filled and (not ret or count == 0)):
+                angles.append(self.predict(self.batch[:filled]))
+                filled = 0
+            if not ret:
+                break
+        return np.concatenate(angles) if angles else np.empty(0, np.int16)
+
+
+def evaluate_video(video_path, student, pool, chunk_size=1024):
+    """
+    Yield (teacher angles, student angles) chunk by chunk, the teacher's
+    from the pool while this process runs the student
+    """
+    chunks = plan_chunks([video_path], chunk_size)
+    futures = [pool.submit(teacher_chunk, *chunk) for chunk in chunks]
+    smooth = TeacherSmoother()
+    cap = cv2.VideoCapture(video_path)
+    try:
+        for (_, start, stop), future in zip(chunks, futures):
+            predicted = student.frames(cap, stop - start)
+            teacher = smooth(*future.result())
+            count = min(len(teacher), len(predicted))
+            yield teacher[:count], predicted[:count]
+    finally:
+        cap.release()
+        for future in futures:
+            future.cancel()
+
+
+def evaluate_shards(shard_dir, student, workers=2):
+    """
+    Yield (teacher angles, student angles) batch by batch of a shard
+    directory, the teacher's being its labels
+    """
+    from src.cnn_training.data import BatchLoader
+
+    loader = BatchLoader(shard_dir, batch_size=student.batch_size, training=False)
+    for x, y in loader.batches(workers=workers):
+        yield y.astype(np.int16), student.predict(x)
+
+
+def worst_windows(errors, window=20, count=5):
+    """
+    (start, mean absolute error) of the count non-overlapping windows of
+    window frames with the largest mean error, worst first
+    """
+    if len(errors) < window:
+        window = len(errors)
+    if window == 0:
+        return []
+    sums = np.cumsum(np.concatenate([[0.0], errors]))
+    means = (sums[window:] - sums[:-window]) / window
+    windows = []
+    for _ in range(count):
+        start = int(np.argmax(means))
+        if not np.isfinite(means[start]):
+            break
+        windows.append((start, float(means[start])))
+        means[max(0, start - window + 1) : start + window] = -np.inf
+    return windows
+
+
+def summarize(name, teacher, student, elapsed, window=20, count=5):
+    """
+    Error statistics of a source, in degrees
+    """
+    errors = np.abs(student.astype(np.float32) - teacher)
+    summary = {
+        "source": name,
+        "frames": len(errors),
+        "fps": round(len(errors) / max(elapsed, 1e-9), 1),
+    }
+    if len(errors):
+        summary.update(
+            mae=round(float(errors.mean()), 3),
+            rmse=round(float(np.sqrt(np.mean(errors**2))), 3),
+            p95=round(float(np.percentile(errors, 95)), 3),
+            max=int(errors.max()),
+            worst_windows=[
+                {"start": start, "stop": start + window, "mae": round(mae, 3)}
+                for start, mae in worst_windows(errors, window, count)
+            ],
+        )
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("sources", nargs="+", help="car_video*.avi or shard dirs")
+    parser.add_argument("--backend", choices=["keras", "tflite"], default="keras")
+    parser.add_argument("--model", default=None, help="defaults to the bundled one")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--window", type=int, default=20, help="frames per window")
+    parser.add_argument("--output", default=None, help="write the summary as JSON")
+    args = parser.parse_args(argv)
+
+    from src.cnn_driving.backends import create_backend
+
+    student = Student(create_backend(args.backend, args.model), args.batch_size)
+    summaries = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(args.workers) as pool:
+        for source in args.sources:
+            source_start = time.perf_counter()
+            if os.path.isdir(source):
+                chunks = evaluate_shards(source, student)
+            else:
+                chunks = evaluate_video(source, student, pool, args.chunk_size)
+            pairs = list(chunks)
+            teacher = np.concatenate([t for t, _ in pairs] or [np.empty(0)])
+            predicted = np.concatenate([s for _, s in pairs] or [np.empty(0)])
+            elapsed = time.perf_counter() - source_start
+            summaries.append(
+                summarize(source, teacher, predicted, elapsed, args.window)
+            )
+            logger.info(json.dumps(summaries[-1]))
+
+    elapsed = time.perf_counter() - start
+    frames = sum(summary["frames"] for summary in summaries)
+    errors = sum(summary.get("mae", 0) * summary["frames"] for summary in summaries)
+    report = {
+        "backend": args.backend,
+        "frames": frames,
+        "mae": round(errors / max(frames, 1), 3),
+        "fps": round(frames / max(elapsed, 1e-9), 1),
+        "student_fps": round(frames / max(student.seconds, 1e-9), 1),
+        "sources": summaries,
+    }
+    logger.info(
+        f"{frames} frames, MAE {report['mae']} deg, {report['fps']} fps, "
+        f"student inference {report['student_fps']} fps"
+    )
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(main())
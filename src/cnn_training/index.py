@@ -0,0 +1,252 @@
+"""
+Index the frames of a shard directory by steering angle and drop the
+near-duplicates among consecutive frames.
+
+    python -m src.cnn_training.index data/shards
+    python -m src.cnn_training.index data/shards --bins 25 --per-bin 400
+
+Frames recorded at 20 fps change little from one to the next. A frame is
+dropped when its perceptual hash is within max_distance bits of the last
+kept frame of its shard and the teacher steered it the same. The kept frames
+are grouped into the notebook's angle bins, with the bins capped at per_bin
+samples per epoch, and written to index.npz next to the manifest, from
+where BatchLoader draws balanced epochs.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX = "index.npz"
+
+# set bits of every byte value
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], np.uint8)
+
+
+def perceptual_hashes(images, yuv=False, size=8, chunk=256):
+    """
+    64 bit difference hashes of a (N, H, W, 3) frame array, as (N, 8) uint8.
+    Every frame is shrunk to a (size, size + 1) gray image and a bit is set
+    where a pixel is brighter than its right neighbour, so the hash ignores
+    small shifts in brightness, noise and compression.
+    yuv: the frames are in the yuv shard layout, hash their Y channel
+    """
+    count = len(images)
+    # uint8 like the frames, cv2.resize only writes into a dst of their type
+    gray = np.empty((min(chunk, count), size, size + 1), np.uint8)
+    hashes = np.empty((count, size * size // 8), np.uint8)
+    for start in range(0, count, chunk):
+        frames = images[start : start + chunk]
+        for frame, out in zip(frames, gray):
+            luma = frame[..., 0] if yuv else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            cv2.resize(luma, (size + 1, size), dst=out, interpolation=cv2.INTER_AREA)
+        bits = gray[: len(frames), :, 1:] > gray[: len(frames), :, :-1]
+        hashes[start : start + len(frames)] = np.packbits(
+            bits.reshape(len(frames), -1), axis=1
+        )
+    return hashes
+
+
+def hamming(a, b):
+    """
+    Number of differing bits between hashes, broadcast over the leading axes
+    """
+    return POPCOUNT[np.bitwise_xor(a, b)].sum(axis=-1, dtype=np.int64)
+
+
+def prune_duplicates(hashes, angles, max_distance=4, max_angle_change=0):
+    """
+    Positions of the frames to keep in one shard's sequence: a frame is
+    dropped if it is within max_distance bits and max_angle_change degrees
+    of the last kept frame
+    """
+    if len(hashes) == 0:
+        return np.empty(0, np.int64)
+    # compare every frame with its predecessor in bulk; only the frames close
+    # to it can be duplicates of the last kept one, the others are all kept
+    close = np.zeros(len(hashes), bool)
+    close[1:] = hamming(hashes[1:], hashes[:-1]) <= max_distance
+
+    keep = np.ones(len(hashes), bool)
+    last = 0
+    for i in np.flatnonzero(close):
+        if not close[i - 1]:
+            last = i - 1
+        similar = hamming(hashes[i], hashes[last]) <= max_distance
+        if similar and abs(int(angles[i]) - int(angles[last])) <= max_angle_change:
+            keep[i] = False
+        else:
+            last = i
+    return np.flatnonzero(keep)
+
+
+class AngleIndex(object):
+    """
+    Dataset indices grouped by steering angle bin. Sorted by bin with the
+    start of every bin, so a balanced sample is a choice of bins followed
+    by a uniform pick inside them, O(1) per sample.
+    """
+
+    def __init__(self, indices, angles, edges, per_bin=400, dropped=0):
+        """
+        indices: global dataset indices of the kept frames
+        angles: their steering angles
+        edges: bin edges, as from np.histogram
+        per_bin: samples an epoch takes at most from a bin, None for all
+        dropped: number of near-duplicates removed, for the record
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        angles = np.asarray(angles)
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.per_bin = per_bin
+        self.dropped = dropped
+
+        bins = np.clip(np.digitize(angles, self.edges[1:-1]), 0, self.num_bins - 1)
+        order = np.argsort(bins, kind="stable")
+        self.indices = indices[order]
+        self.angles = angles[order]
+        self.counts = np.bincount(bins, minlength=self.num_bins)
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)]).astype(np.int64)
+
+        quota = self.counts if per_bin is None else np.minimum(self.counts, per_bin)
+        self.quota = quota
+        self.epoch_size = int(quota.sum())
+        self.weights = quota / max(1, self.epoch_size)
+
+    @property
+    def num_bins(self):
+        return len(self.edges) - 1
+
+    def __len__(self):
+        return len(self.indices)
+
+    @classmethod
+    def build(
+        cls, dataset, bins=25, per_bin=400, max_distance=4, max_angle_change=0
+    ):
+        """
+        Hash every shard of a ShardDataset, prune its near-duplicates and bin
+        the rest; max_distance=None keeps all frames
+        """
+        keep = []
+        for shard, images in enumerate(dataset.images):
+            offset = dataset.offsets[shard]
+            if max_distance is None:
+                keep.append(np.arange(len(images)) + offset)
+                continue
+            angles = dataset.angles[offset : offset + len(images)]
+            hashes = perceptual_hashes(images, yuv=dataset.layout == "yuv")
+            kept = prune_duplicates(hashes, angles, max_distance, max_angle_change)
+            keep.append(kept + offset)
+            logger.debug(f"Shard {shard}: kept {len(kept)} of {len(images)}")
+
+        indices = np.concatenate(keep) if keep else np.empty(0, np.int64)
+        angles = dataset.angles[indices]
+        edges = np.histogram_bin_edges(angles, bins)
+        return cls(indices, angles, edges, per_bin, len(dataset) - len(indices))
+
+    def subset(self, indices):
+        """
+        The index restricted to some dataset indices, e.g. the training side
+        of split_by_shard, with the same bins
+        """
+        selected = np.isin(self.indices, indices)
+        return AngleIndex(
+            self.indices[selected],
+            self.angles[selected],
+            self.edges,
+            self.per_bin,
+            self.dropped,
+        )
+
+    def sample(self, count, rng=None):
+        """
+        count dataset indices, each drawn from a bin chosen in proportion to
+        its capped size, so no angle dominates an epoch
+        """
+        if self.epoch_size == 0:
+            raise ValueError("Cannot sample from an empty angle index")
+        rng = rng or np.random.default_rng()
+        bins = rng.choice(self.num_bins, count, p=self.weights)
+        picks = (rng.random(count) * self.counts[bins]).astype(np.int64)
+        return self.indices[self.offsets[bins] + picks]
+
+    def histogram(self):
+        """
+        (bin start angle, frames, samples per epoch) of every bin
+        """
+        return list(zip(self.edges[:-1].round(1), self.counts, self.quota))
+
+    def save(self, path):
+        np.savez(
+            path,
+            indices=self.indices.astype(np.int32),
+            angles=self.angles.astype(np.int16),
+            edges=self.edges,
+            params=json.dumps({"per_bin": self.per_bin, "dropped": self.dropped}),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        path: an index file or the shard directory it is in
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, INDEX)
+        with np.load(path) as stored:
+            params = json.loads(str(stored["params"]))
+            return cls(stored["indices"], stored["angles"], stored["edges"], **params)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("shard_dir")
+    parser.add_argument("--bins", type=int, default=25)
+    parser.add_argument("--per-bin", type=int, default=400, help="0 for no cap")
+    parser.add_argument(
+        "--max-distance",
+        type=int,
+        default=4,
+        help="hash bits a duplicate may differ in, -1 keeps every frame",
+    )
+    parser.add_argument(
+        "--max-angle-change",
+        type=int,
+        default=0,
+        help="degrees a duplicate's angle may differ by",
+    )
+    parser.add_argument("--output", help="defaults to SHARD_DIR/index.npz")
+    args = parser.parse_args(argv)
+
+    from src.cnn_training.data import ShardDataset
+
+    dataset = ShardDataset(args.shard_dir)
+    index = AngleIndex.build(
+        dataset,
+        bins=args.bins,
+        per_bin=args.per_bin or None,
+        max_distance=None if args.max_distance < 0 else args.max_distance,
+        max_angle_change=args.max_angle_change,
+    )
+    output = args.output or os.path.join(args.shard_dir, INDEX)
+    index.save(output)
+
+    for start, frames, samples in index.histogram():
+        logger.info(f"{start:>6} deg: {frames:>6} frames, {samples:>5} per epoch")
+    logger.info(
+        f"Kept {len(index)} of {len(dataset)} frames, {index.epoch_size} samples "
+        f"per epoch, wrote {output}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(main())
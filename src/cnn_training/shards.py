@@ -0,0 +1,236 @@
+"""
+Label recorded videos with the OpenCV teacher and store the frames in
+array shards, extracted in parallel.
+
+    python create_images.py data/car_video*.avi --output data/shards
+    python create_images.py data/car_video*.avi --output data/shards --layout yuv
+
+Every video is split into chunks of shard_size frames, each labelled by a
+worker process into its own .npy shard. The teacher's angle is smoothed
+over the previous frames, so a worker first runs the teacher over the
+warmup frames before its chunk; they are not stored. With a warmup the
+labels match a serial run once the smoothed angle has caught up, which
+takes at most a few frames on a lane that was seen on both sides.
+"""
+
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from src.cnn_driving.utility import Preprocessor
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+
+# frame layouts a shard can store
+LAYOUTS = ("frame", "crop", "yuv")
+
+
+def frame_count(video_path):
+    """
+    Number of frames of a video, counted by reading it if the container does
+    not know
+    """
+    cap = cv2.VideoCapture(video_path)
+    try:
+        count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if count <= 0:
+            count = 0
+            while cap.grab():
+                count += 1
+        return count
+    finally:
+        cap.release()
+
+
+def open_at(video_path, index):
+    """
+    Open a video positioned at frame index. Falls back to decoding from the
+    start when the container cannot seek exactly.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if index == 0:
+        return cap
+    cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+    if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == index:
+        return cap
+
+    cap.release()
+    cap = cv2.VideoCapture(video_path)
+    for _ in range(index):
+        if not cap.grab():
+            break
+    return cap
+
+
+class FrameStore(object):
+    """
+    Converts frames into the layout kept in a shard
+    """
+
+    def __init__(self, layout="frame"):
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown layout {layout}, use one of {LAYOUTS}")
+        self.layout = layout
+        self.preprocess = Preprocessor(np.uint8) if layout == "yuv" else None
+
+    def shape(self, frame_shape):
+        height, width, channels = frame_shape
+        if self.layout == "crop":
+            return (height - int(height / 2), width, channels)
+        if self.layout == "yuv":
+            return self.preprocess.batch.shape[1:]
+        return frame_shape
+
+    def __call__(self, frame):
+        """
+        frame: the camera's full BGR frame; "crop" keeps its bottom half,
+            which is all img_preprocess looks at, "yuv" keeps the model's
+            input before the division by 255
+        """
+        if self.layout == "crop":
+            return frame[int(frame.shape[0] / 2) :]
+        if self.layout == "yuv":
+            return self.preprocess(frame)[0]
+        return frame
+
+
+def label_chunk(video_path, start, stop, output_path, layout="frame", warmup=60):
+    """
+    Label frames start..stop of a video with a fresh AutoDrive and write
+    them to output_path.npy and their angles to output_path_angles.npy.
+    Returns the shard's manifest entry.
+    """
+    from src.opencv_auto.driver import AutoDrive
+
+    lane_follower = AutoDrive(render_overlays=False)
+    store = FrameStore(layout)
+    first = max(0, start - warmup)
+    cap = open_at(video_path, first)
+
+    images = None
+    angles = np.empty(stop - start, np.int16)
+    count = 0
+    try:
+        index = first
+        while index < stop:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            lane_follower.follow_lane(frame)
+            if index >= start:
+                if images is None:
+                    images = np.lib.format.open_memmap(
+                        output_path + ".npy",
+                        mode="w+",
+                        dtype=np.uint8,
+                        shape=(stop - start,) + store.shape(frame.shape),
+                    )
+                images[count] = store(frame)
+                angles[count] = lane_follower.curr_steering_angle
+                count += 1
+            index += 1
+    finally:
+        cap.release()
+
+    if images is None:
+        return None
+    images.flush()
+    if count < len(images):
+        # the container announced more frames than it has
+        truncated = np.array(images[:count])
+        del images
+        np.save(output_path + ".npy", truncated)
+    else:
+        del images
+    np.save(output_path + "_angles.npy", angles[:count])
+
+    return {
+        "images": os.path.basename(output_path) + ".npy",
+        "angles": os.path.basename(output_path) + "_angles.npy",
+        "video": video_path,
+        "start": start,
+        "count": count,
+    }
+
+
+def plan_chunks(video_paths, shard_size):
+    """
+    (video, start, stop) of every shard
+    """
+    chunks = []
+    for path in video_paths:
+        count = frame_count(path)
+        for start in range(0, count, shard_size):
+            chunks.append((path, start, min(start + shard_size, count)))
+    return chunks
+
+
+def extract(
+    video_paths,
+    output_dir,
+    layout="frame",
+    shard_size=256,
+    warmup=60,
+    workers=None,
+):
+    """
+    Label the videos in parallel into shards in output_dir and write the
+    manifest; returns it
+    layout: "frame" for full BGR frames, "crop" for their bottom half or
+        "yuv" for the preprocessed (66, 200, 3) model input as uint8
+    shard_size: frames per shard, also the unit of work of a process
+    warmup: frames the teacher runs before a shard to settle its angle
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    chunks = plan_chunks(video_paths, shard_size)
+    logger.info(f"Labelling {len(chunks)} shards of {len(video_paths)} videos")
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = []
+        for path, start, stop in chunks:
+            name = os.path.splitext(os.path.basename(path))[0]
+            output_path = os.path.join(output_dir, f"{name}_{start:06d}")
+            futures.append(
+                pool.submit(
+                    label_chunk, path, start, stop, output_path, layout, warmup
+                )
+            )
+        shards = [f.result() for f in futures]
+
+    shards = [shard for shard in shards if shard is not None and shard["count"]]
+    manifest = {
+        "layout": layout,
+        "warmup": warmup,
+        "frames": sum(shard["count"] for shard in shards),
+        "shards": shards,
+    }
+    with open(os.path.join(output_dir, MANIFEST), "w") as file:
+        json.dump(manifest, file, indent=2)
+    logger.info(f"Wrote {manifest['frames']} frames in {len(shards)} shards")
+    return manifest
+
+
+def load_manifest(shard_dir):
+    with open(os.path.join(shard_dir, MANIFEST)) as file:
+        return json.load(file)
+
+
+def open_shards(shard_dir):
+    """
+    Memory map every shard of a directory.
+    Returns the manifest, the list of image arrays and all angles.
+    """
+    manifest = load_manifest(shard_dir)
+    images, angles = [], []
+    for shard in manifest["shards"]:
+        path = os.path.join(shard_dir, shard["images"])
+        images.append(np.load(path, mmap_mode="r"))
+        angles.append(np.load(os.path.join(shard_dir, shard["angles"])))
+    angles = np.concatenate(angles) if angles else np.empty(0, np.int16)
+    return manifest, images, angles
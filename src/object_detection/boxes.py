@@ -0,0 +1,38 @@
+"""
+    Plain detection results, attribute compatible with pycoral's detect.Object
+    and detect.BBox, so they are built, tracked and pickled without pycoral
+"""
+from collections import namedtuple
+
+Detection = namedtuple("Detection", ["id", "score", "bbox"])
+
+
+class BoundingBox(namedtuple("BoundingBox", ["xmin", "ymin", "xmax", "ymax"])):
+    """
+    Box corners in pixels, like pycoral's BBox
+    """
+
+    __slots__ = ()
+
+    @property
+    def width(self):
+        return self.xmax - self.xmin
+
+    @property
+    def height(self):
+        return self.ymax - self.ymin
+
+    @property
+    def area(self):
+        return self.width * self.height
+
+    def translate(self, offset_x, offset_y):
+        """
+        The box moved by an offset, e.g. from a crop into the full frame
+        """
+        return BoundingBox(
+            self.xmin + offset_x,
+            self.ymin + offset_y,
+            self.xmax + offset_x,
+            self.ymax + offset_y,
+        )
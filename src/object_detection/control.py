@@ -0,0 +1,126 @@
+"""
+    Time based car control rules driven by detected objects
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StopSignController(object):
+    """
+    Non-blocking stop sign rule: driving -> stopping -> stopped -> resuming.
+    trigger() starts a stop, update() advances the state machine and must be
+    called on every tick of the drive loop; neither of them ever sleeps.
+    """
+
+    DRIVING = "driving"
+    STOPPING = "stopping"
+    STOPPED = "stopped"
+    RESUMING = "resuming"
+
+    def __init__(
+        self,
+        car=None,
+        cruise_speed=40,
+        brake_duration=0.3,
+        stop_duration=3.0,
+        accelerate_duration=0.5,
+        rearm_delay=5.0,
+        clock=time.monotonic,
+    ):
+        """
+        car: the car whose back wheels are controlled, may be None
+        cruise_speed: speed to resume to after a stop
+        brake_duration/accelerate_duration: seconds to ramp the speed
+        stop_duration: seconds to stand still
+        rearm_delay: seconds after resuming in which stop signs are ignored,
+            so the sign we just stopped at does not stop us again
+        """
+        self.car = car
+        self.cruise_speed = cruise_speed
+        self.brake_duration = brake_duration
+        self.stop_duration = stop_duration
+        self.accelerate_duration = accelerate_duration
+        self.rearm_delay = rearm_delay
+        self.clock = clock
+
+        self.state = self.DRIVING
+        self.stops = 0
+        self._entered = clock()
+        self._start_speed = cruise_speed
+        self._armed_at = -float("inf")
+        self._lock = threading.Lock()
+
+    @property
+    def armed(self):
+        return self.state == self.DRIVING and self.clock() >= self._armed_at
+
+    def trigger(self, now=None):
+        """
+        Start a stop if the rule is armed; returns True if it started
+        """
+        now = self.clock() if now is None else now
+        with self._lock:
+            if self.state != self.DRIVING or now < self._armed_at:
+                return False
+            logger.info(f"Stopping car for {self.stop_duration} seconds")
+            self.stops += 1
+            self._start_speed = self._speed(self.cruise_speed)
+            self._enter(self.STOPPING, now)
+            return True
+
+    def reset(self, now=None):
+        """
+        Back to driving and armed, dropping a stop in progress; the count of
+        stops is kept
+        """
+        now = self.clock() if now is None else now
+        with self._lock:
+            self.state = self.DRIVING
+            self._entered = now
+            self._start_speed = self.cruise_speed
+            self._armed_at = -float("inf")
+
+    def update(self, now=None):
+        """
+        Advance the state machine and set the speed for this tick
+        """
+        now = self.clock() if now is None else now
+        with self._lock:
+            elapsed = now - self._entered
+            if self.state == self.STOPPING:
+                progress = self._progress(elapsed, self.brake_duration)
+                self._set_speed(self._start_speed * (1 - progress))
+                if progress >= 1:
+                    self._enter(self.STOPPED, now)
+            elif self.state == self.STOPPED:
+                self._set_speed(0)
+                if elapsed >= self.stop_duration:
+                    self._enter(self.RESUMING, now)
+            elif self.state == self.RESUMING:
+                progress = self._progress(elapsed, self.accelerate_duration)
+                self._set_speed(self.cruise_speed * progress)
+                if progress >= 1:
+                    self._armed_at = now + self.rearm_delay
+                    self._enter(self.DRIVING, now)
+            return self.state
+
+    def _enter(self, state, now):
+        logger.debug(f"Stop sign rule: {self.state} -> {state}")
+        self.state = state
+        self._entered = now
+
+    @staticmethod
+    def _progress(elapsed, duration):
+        return 1.0 if duration <= 0 else min(1.0, elapsed / duration)
+
+    def _speed(self, default):
+        if self.car is None:
+            return default
+        return self.car.back_wheels.speed
+
+    def _set_speed(self, speed):
+        if self.car is not None:
+            self.car.back_wheels.speed = int(speed)
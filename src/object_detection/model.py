@@ -4,16 +4,20 @@
 import logging
 import time
 
-from pycoral.adapters import common
-from pycoral.adapters import detect
-from pycoral.utils.edgetpu import make_interpreter
-
 import cv2
 
+from src.object_detection.control import StopSignController
+from src.object_detection.tracker import ObjectTracker
+
 # set up logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# detection crops as (x0, y0, x1, y1) fractions of the frame
+FULL_FRAME = (0.0, 0.0, 1.0, 1.0)
+RIGHT_HALF = (0.5, 0.0, 1.0, 1.0)
+TOP_HALF = (0.0, 0.0, 1.0, 0.5)
+
 
 class DetectionModel(object):
     """
@@ -26,15 +30,24 @@ class DetectionModel(object):
         speed_limit=40,
         model_path="src/object_detection/artifacts/road_signs_quantized_edgetpu.tflite",
         label_path="src/object_detection/artifacts/labels.txt",
+        crop=FULL_FRAME,
+        clock=None,
     ):
         """
         Initialize the DetectionModel
+        crop: part of the frame to detect in, e.g. RIGHT_HALF where the signs
+            stand; boxes are still reported in frame coordinates
+        clock: time source of the tracker and the control rules, e.g. the
+            video time when replaying recordings
         """
         logger.info("Initializing DetectionModel")
 
         # set variables
         self.car = car
         self.speed_limit = speed_limit
+        self.crop = crop
+
+        # size of the frames seen, until the first one arrives assume the camera's
         self.width = 640
         self.height = 480
 
@@ -42,12 +55,34 @@ class DetectionModel(object):
         self.model_path = model_path
         self.label_path = label_path
         self.labels = self.load_labels(self.label_path)
-        self.interpreter = make_interpreter(self.model_path)
-        self.interpreter.allocate_tensors()
+        self._interpreter = None
+        self._resized = None
+
+        # control rules act on tracked objects, so a skipped detection does
+        # not lose a sign and the same sign is only stopped at once
+        self.tracker = ObjectTracker(clock=clock)
+        self.stop_sign_rule = StopSignController(
+            car, cruise_speed=speed_limit, clock=clock or time.monotonic
+        )
+        self.stopped_for = set()
+
+        # labels of the most recent detection, read by the recorder
+        self.last_labels = []
 
-        # stop sign related config
-        self.stopped = False
-        self.stop_sign_count = 0
+    @property
+    def interpreter(self):
+        """
+        The Edge TPU interpreter, opened on first use so an instance that only
+        applies the control rules to detections from another process never
+        claims the TPU. pycoral is only imported here and in the methods that
+        use the interpreter, so importing this module stays cheap.
+        """
+        if self._interpreter is None:
+            from pycoral.utils.edgetpu import make_interpreter
+
+            self._interpreter = make_interpreter(self.model_path)
+            self._interpreter.allocate_tensors()
+        return self._interpreter
 
     def load_labels(self, path):
         """
@@ -60,14 +95,13 @@ class DetectionModel(object):
         """
         Detect objects on the road
         """
+        from pycoral.adapters import detect
 
         # Load labels
         labels = self.labels
 
         # Read and preprocess an image.
-        _, scale = common.set_resized_input(
-            self.interpreter, frame.shape[:2], lambda size: cv2.resize(frame, size)
-        )
+        (x0, y0), scale = self.set_input(frame)
 
         start = time.perf_counter()
 
@@ -79,6 +113,8 @@ class DetectionModel(object):
         results = detect.get_objects(
             self.interpreter, score_threshold=0.65, image_scale=scale
         )
+        if x0 or y0:
+            results = [obj._replace(bbox=obj.bbox.translate(x0, y0)) for obj in results]
 
         logger.debug("%.2f ms" % (inference_time * 1000))
 
@@ -93,39 +129,106 @@ class DetectionModel(object):
 
         return results, frame
 
-    def is_close_by(self, obj, frame_height, min_height_pct=-0.107):
+    def crop_box(self, shape):
+        """
+        The crop in pixels of a frame of this shape, (x0, y0, x1, y1)
+        """
+        height, width = shape[:2]
+        x0, y0, x1, y1 = self.crop
+        return (
+            int(x0 * width),
+            int(y0 * height),
+            int(x1 * width),
+            int(y1 * height),
+        )
+
+    def set_input(self, frame):
+        """
+        Resize the crop of the frame straight into the interpreter's input
+        tensor, like common.set_resized_input but without the intermediate
+        image. The padding is only zeroed when the resized size changes.
+        Returns the crop's offset and the (x, y) scale of the resize.
         """
-        Check if object is close by (Not used yet)
+        from pycoral.adapters import common
+
+        self.height, self.width = frame.shape[:2]
+        x0, y0, x1, y1 = self.crop_box(frame.shape)
+        image = frame[y0:y1, x0:x1]
+
+        input_width, input_height = common.input_size(self.interpreter)
+        height, width = image.shape[:2]
+        scale = min(input_width / width, input_height / height)
+        size = (int(width * scale), int(height * scale))
+
+        tensor = common.input_tensor(self.interpreter)
+        if size != self._resized:
+            tensor.fill(0)
+            self._resized = size
+        cv2.resize(image, size, dst=tensor[: size[1], : size[0]])
+        # the interpreter refuses to run while we hold a view of its buffer
+        del tensor
+        return (x0, y0), (scale, scale)
+
+    def is_close_by(self, obj, frame_height, min_height_pct=0.107):
+        """
+        Check if object is close by: its box covers enough of the frame height
         """
         bbox = obj.bbox
-        obj_height = bbox.ymin - bbox.ymax
-        print(obj_height / frame_height)
+        obj_height = bbox.ymax - bbox.ymin
         return obj_height / frame_height > min_height_pct
 
-    def control_car(self, objects):
+    def control_car(self, objects, timestamp=None, frame_shape=None):
         """
         Control the car based on detected objects
+        timestamp: capture time of the frame the objects were detected in
+        frame_shape: shape of that frame, for objects detected elsewhere,
+            e.g. by a RemoteDetector; local detections record it themselves
         """
         logger.debug("Controlling car")
+        if frame_shape is not None:
+            self.height, self.width = frame_shape[:2]
+        self.last_labels = [self.labels[obj.id] for obj in objects]
         if len(objects) == 0:
             logger.debug("No objects detected, continue driving")
-        else:
-            for obj in objects:
-                label = self.labels[obj.id]
-
-                # handle stop sign
-                if label == "stop sign":
-                    self.stop_sign_count += 1
-                    logger.info("Detected Stop Sign")
-                    if self.stop_sign_count == 2 and self.stopped is False:
-                        logger.info("Stopping car for 3 seconds")
-
-                        # stop and start the car
-                        self.car.back_wheels.speed = 0
-                        time.sleep(3)
-                        self.car.back_wheels.speed = self.speed_limit
-                        self.stopped = True
-                        self.stop_sign_count = 0
+        for obj in objects:
+            if self.labels[obj.id] == "stop sign":
+                logger.info("Detected Stop Sign")
+
+        self.apply_rules(self.tracker.update(objects, timestamp))
+
+    def apply_rules(self, tracks):
+        """
+        Apply the control rules to the confirmed tracks
+        """
+        for track in tracks:
+            label = self.labels[track.id]
+
+            # handle stop sign, once per track
+            if label != "stop sign" or track.track_id in self.stopped_for:
+                continue
+            if self.is_close_by(track, self.height) and self.stop_sign_rule.trigger():
+                logger.info(f"Stopping for stop sign track {track.track_id}")
+                self.stopped_for.add(track.track_id)
+
+        self.stopped_for &= {track.track_id for track in self.tracker.tracks}
+
+    def tick(self, now=None):
+        """
+        Advance the time based control rules, called on every drive loop tick.
+        Tracks are extrapolated, so signs approach between detections.
+        """
+        self.apply_rules(self.tracker.predict())
+        self.stop_sign_rule.update(now)
+
+    def reset(self):
+        """
+        Forget the tracked objects and any stop in progress, e.g. before
+        replaying another recording
+        """
+        self.tracker.reset()
+        self.stop_sign_rule.reset()
+        self.stopped_for = set()
+        self.last_labels = []
 
     def process_objects_on_road(self, frame):
         """
@@ -0,0 +1,155 @@
+"""
+    Associates detections across frames into tracks with stable ids
+"""
+import logging
+import time
+
+import numpy as np
+
+from src.object_detection.boxes import BoundingBox
+
+logger = logging.getLogger(__name__)
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """
+    Intersection over union of every box in boxes_a with every box in
+    boxes_b, both (N, 4) arrays of xmin, ymin, xmax, ymax
+    """
+    a = np.asarray(boxes_a, dtype=float).reshape(-1, 1, 4)
+    b = np.asarray(boxes_b, dtype=float).reshape(1, -1, 4)
+    width = np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0])
+    height = np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1])
+    intersection = np.clip(width, 0, None) * np.clip(height, 0, None)
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0.0)
+
+
+class Track(object):
+    """
+    One object followed across frames. Attribute compatible with pycoral's
+    detect.Object: id is the class id, track_id the stable identity.
+    """
+
+    def __init__(self, track_id, obj, timestamp, smoothing=0.5):
+        """
+        obj: the detection that started the track
+        smoothing: weight of the newest measurement in the box velocity
+        """
+        self.track_id = track_id
+        self.id = obj.id
+        self.score = obj.score
+        self.smoothing = smoothing
+        self.hits = 1
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self._box = np.array(tuple(obj.bbox), dtype=float)
+        self._velocity = np.zeros(4)
+        self.bbox = BoundingBox(*self._box.tolist())
+
+    def predict(self, timestamp, max_gap):
+        """
+        Extrapolate the box to a moment without a detection
+        """
+        dt = min(max(timestamp - self.last_seen, 0.0), max_gap)
+        self.bbox = BoundingBox(*(self._box + self._velocity * dt).tolist())
+        return self.bbox
+
+    def update(self, obj, timestamp):
+        """
+        Correct the track with a matched detection
+        """
+        box = np.array(tuple(obj.bbox), dtype=float)
+        dt = timestamp - self.last_seen
+        if dt > 0:
+            velocity = (box - self._box) / dt
+            self._velocity += self.smoothing * (velocity - self._velocity)
+        self._box = box
+        self.bbox = BoundingBox(*box.tolist())
+        self.score = obj.score
+        self.hits += 1
+        self.last_seen = timestamp
+
+
+class ObjectTracker(object):
+    """
+    Greedy IoU tracker: every detection is matched to the overlapping track
+    of the same class it overlaps most, unmatched detections start new tracks
+    and tracks not seen for max_age seconds are dropped. In between
+    detections the boxes are extrapolated with their measured velocity.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_age=1.0, min_hits=2, clock=None):
+        """
+        iou_threshold: minimum overlap of a detection with a track's
+            predicted box to continue that track
+        max_age: seconds a track survives without a matching detection
+        min_hits: detections a track needs before it is confirmed
+        clock: time source of the timestamps, defaults to the capture clock
+        """
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.clock = clock or time.perf_counter
+        self.tracks = []
+        self._next_id = 1
+
+    def update(self, objects, timestamp=None):
+        """
+        Associate a frame's detections with the tracks, returns the
+        confirmed tracks
+        """
+        timestamp = self.clock() if timestamp is None else timestamp
+        self.predict(timestamp)
+
+        unmatched = list(range(len(objects)))
+        if self.tracks and objects:
+            overlap = iou_matrix(
+                [track.bbox for track in self.tracks], [obj.bbox for obj in objects]
+            )
+            same_class = np.equal.outer(
+                [track.id for track in self.tracks], [obj.id for obj in objects]
+            )
+            overlap[~same_class] = 0.0
+
+            # best pairs first, each track and detection used once
+            for flat in np.argsort(overlap, axis=None)[::-1]:
+                t, d = np.unravel_index(flat, overlap.shape)
+                if overlap[t, d] < self.iou_threshold:
+                    break
+                if d not in unmatched or self.tracks[t].last_seen == timestamp:
+                    continue
+                self.tracks[t].update(objects[d], timestamp)
+                unmatched.remove(d)
+
+        for d in unmatched:
+            track = Track(self._next_id, objects[d], timestamp)
+            logger.debug(f"New track {track.track_id} of class {track.id}")
+            self.tracks.append(track)
+            self._next_id += 1
+
+        return self.confirmed()
+
+    def predict(self, timestamp=None):
+        """
+        Extrapolate all tracks to a moment without detections and drop the
+        expired ones, returns the confirmed tracks
+        """
+        timestamp = self.clock() if timestamp is None else timestamp
+        alive = []
+        for track in self.tracks:
+            if timestamp - track.last_seen > self.max_age:
+                logger.debug(f"Track {track.track_id} expired")
+                continue
+            track.predict(timestamp, self.max_age)
+            alive.append(track)
+        self.tracks = alive
+        return self.confirmed()
+
+    def confirmed(self):
+        return [track for track in self.tracks if track.hits >= self.min_hits]
+
+    def reset(self):
+        self.tracks = []
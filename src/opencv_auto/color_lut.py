@@ -0,0 +1,157 @@
+"""
+    Optional precomputed BGR -> lane mask lookup table, an alternative to the
+    HSV conversion and inRange that detect_edges uses by default. The table
+    takes 16 MB per set of bounds; whether it is faster than cvtColor and
+    inRange depends on the machine, so measure it before switching.
+"""
+import logging
+import os
+import sys
+import threading
+
+import cv2
+import numpy as np
+
+from src.opencv_auto.frame_processing import LOWER_BLUE, UPPER_BLUE, hsv_mask
+
+logger = logging.getLogger(__name__)
+
+
+def build_table(lower=LOWER_BLUE, upper=UPPER_BLUE):
+    """
+    Evaluate the HSV mask once for every one of the 2**24 BGR colors.
+    The table is indexed by (b << 16) | (g << 8) | r.
+    """
+    key = np.arange(1 << 24, dtype=np.uint32)
+    colors = np.empty((4096, 4096, 3), np.uint8)
+    colors[..., 0] = (key >> 16).reshape(4096, 4096)
+    colors[..., 1] = (key >> 8).reshape(4096, 4096)
+    colors[..., 2] = key.reshape(4096, 4096)
+    return hsv_mask(colors, lower, upper).ravel()
+
+
+class ColorMaskLUT(object):
+    """
+    Lane mask computed with a single table lookup per pixel, e.g.
+    AutoDrive(color_mask=ColorMaskLUT()).
+    Produces bit-identical masks to hsv_mask for the same bounds.
+    """
+
+    def __init__(self, lower=LOWER_BLUE, upper=UPPER_BLUE, cache_dir=None):
+        """
+        lower/upper: HSV bounds of the lane color
+        cache_dir: directory to keep built tables in, keyed by their bounds,
+            e.g. ./data/lut; by default every table is built in memory
+        """
+        logger.info("Creating an instance of ColorMaskLUT")
+        self.cache_dir = cache_dir
+        self.lower = None
+        self.upper = None
+        self.table = None
+        self._key = None
+        self._mask = None
+        self.set_bounds(lower, upper)
+
+    def cache_path(self, lower, upper):
+        """
+        File name of the cached table for the given bounds
+        """
+        bounds = "_".join(str(int(v)) for v in tuple(lower) + tuple(upper))
+        return os.path.join(self.cache_dir, f"lane_mask_{bounds}.npy")
+
+    def load_table(self, lower, upper):
+        """
+        Load the table for these bounds from disk, building and caching it
+        if it is not there yet
+        """
+        if self.cache_dir is None:
+            return build_table(lower, upper)
+
+        path = self.cache_path(lower, upper)
+        if os.path.exists(path):
+            logger.debug(f"Loading lane mask table {path}")
+            return np.load(path)
+
+        logger.info(f"Building lane mask table for {lower} - {upper}")
+        table = build_table(lower, upper)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        np.save(path, table)
+        return table
+
+    def set_bounds(self, lower, upper, background=False):
+        """
+        Switch to new HSV bounds while the car keeps driving; the old table
+        is used until the new one is ready
+        """
+        lower = tuple(int(v) for v in lower)
+        upper = tuple(int(v) for v in upper)
+
+        def swap():
+            table = self.load_table(lower, upper)
+            self.table, self.lower, self.upper = table, lower, upper
+            logger.info(f"Lane mask bounds set to {lower} - {upper}")
+
+        if not background:
+            swap()
+            return None
+        thread = threading.Thread(target=swap, name="lut", daemon=True)
+        thread.start()
+        return thread
+
+    def calibrate(self, frame, region, percentiles=(2, 98), margin=10, **kwargs):
+        """
+        Derive the bounds from a snapshot of the track.
+        region: (x0, y0, x1, y1) box covering only lane tape in the frame
+        """
+        x0, y0, x1, y1 = region
+        hsv = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2HSV).reshape(-1, 3)
+        low, high = np.percentile(hsv, percentiles, axis=0)
+        lower = np.clip(low - margin, 0, 255)
+        upper = np.clip(high + margin, 0, (179, 255, 255))
+        return self.set_bounds(lower, upper, **kwargs)
+
+    def __call__(self, frame):
+        """
+        Mask of the pixels within the bounds
+        """
+        table = self.table
+        height, width = frame.shape[:2]
+        if self._key is None or self._key.shape != (height, width):
+            self._key = np.empty((height, width), np.uint32)
+            self._mask = np.empty((height, width), np.uint8)
+
+        key = self._key
+        np.copyto(key, frame[..., 0])
+        key <<= 8
+        key |= frame[..., 1]
+        key <<= 8
+        key |= frame[..., 2]
+        return np.take(table, key, out=self._mask, mode="clip")
+
+
+def validate(video_path, lut=None):
+    """
+    Compare the table against the HSV path on every frame of a video,
+    returns the number of frames whose masks differ
+    """
+    lut = lut or ColorMaskLUT()
+    cap = cv2.VideoCapture(video_path)
+    frames, mismatches = 0, 0
+    try:
+        while cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames += 1
+            if not np.array_equal(lut(frame), hsv_mask(frame, lut.lower, lut.upper)):
+                mismatches += 1
+    finally:
+        cap.release()
+
+    logger.info(f"{mismatches} of {frames} frames differ")
+    return mismatches
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(1 if validate(sys.argv[1]) else 0)
@@ -4,9 +4,16 @@ This file contains the driver for the lane detection using opencv.
 
 import logging
 
-from .frame_processing import detect_lane
+from .frame_processing import BOTTOM_HALF_ROI, detect_lane
 from .kinematics import compute_steering_angle, stabilize_steering_angle
-from .utility import display_heading_line, show_image
+from .tracking import LaneTracker
+from .utility import (
+    LazyOverlay,
+    OverlayCanvas,
+    draw_heading_line,
+    draw_lines,
+    show_image,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -16,13 +23,38 @@ class AutoDrive(object):
     Base class for a self-driving car
     """
 
-    def __init__(self, car=None):
+    def __init__(
+        self,
+        car=None,
+        render_overlays=True,
+        roi=BOTTOM_HALF_ROI,
+        color_mask=None,
+        tracking=False,
+        processing_scale=1.0,
+    ):
         """
         car: the car that should be controlled by this object
+        render_overlays: draw the overlay on every frame; when False,
+            follow_lane returns a LazyOverlay that is only drawn on demand
+        roi: region of interest polygon in fractions of the frame size
+        color_mask: lane color filter, e.g. a ColorMaskLUT; defaults to HSV
+        tracking: follow Kalman filtered lane lines with a LaneTracker instead
+            of detecting them in every frame
+        processing_scale: detect lanes on a frame downscaled by this factor,
+            e.g. 1/4 turns 640x480 into 160x120
         """
         logger.info("Creating an instance of AutoDrive")
         self.car = car
+        self.render_overlays = render_overlays
+        self.roi = roi
+        self.color_mask = color_mask
+        self.processing_scale = processing_scale
+        self.tracker = None
+        if tracking:
+            self.tracker = LaneTracker(roi, color_mask, scale=processing_scale)
         self.curr_steering_angle = 90
+        self.lane_lines = None
+        self.canvas = OverlayCanvas()
 
     def follow_lane(self, frame):
         """
@@ -31,10 +63,59 @@ class AutoDrive(object):
 
         show_image("orig", frame)
 
-        lane_lines, frame = detect_lane(frame, show_image_windows=False)
-        final_frame = self.steer(frame, lane_lines)
+        if self.tracker is not None:
+            lane_lines = self.tracker.detect(frame)
+        else:
+            lane_lines, _ = detect_lane(
+                frame,
+                show_image_windows=False,
+                roi=self.roi,
+                color_mask=self.color_mask,
+                scale=self.processing_scale,
+            )
+        self.lane_lines = lane_lines
+        self.steer(frame, lane_lines)
 
-        return final_frame
+        overlay = LazyOverlay(
+            self.render_overlay, frame, lane_lines, self.curr_steering_angle
+        )
+        if self.render_overlays:
+            final_frame = overlay()
+            show_image("heading", final_frame)
+            return final_frame
+        return overlay
+
+    def reset(self):
+        """
+        Forget the lane lines and steering angle of the previous frames
+        """
+        self.curr_steering_angle = 90
+        self.lane_lines = None
+        if self.tracker is not None:
+            self.tracker.reset()
+
+    @property
+    def lane_confidence(self):
+        """
+        Confidence in the current lane lines from 0 to 1: the tracker's
+        confidence of the tracked lines, else the fraction of the two lines
+        that were found
+        """
+        if self.tracker is not None:
+            tracked = self.tracker.lines
+            return sum(self.tracker.confidence[side] for side in tracked) / 2
+        return len(self.lane_lines or []) / 2
+
+    def render_overlay(self, frame, lane_lines, steering_angle, out=None):
+        """
+        Draw the lane lines and, if there are any, the heading line in a
+        single blend over the frame
+        """
+        line_image = self.canvas.clear(frame)
+        draw_lines(line_image, lane_lines)
+        if len(lane_lines) > 0:
+            draw_heading_line(line_image, steering_angle)
+        return self.canvas.blend(frame, out)
 
     def steer(self, frame, lane_lines):
         """
@@ -43,16 +124,18 @@ class AutoDrive(object):
         logger.debug("steering...")
         if len(lane_lines) == 0:
             logger.error("No lane lines detected, nothing to do.")
-            return frame
+            return self.curr_steering_angle
 
         new_steering_angle = compute_steering_angle(frame, lane_lines)
-        self.curr_steering_angle = stabilize_steering_angle(
-            self.curr_steering_angle, new_steering_angle, len(lane_lines)
-        )
+        if self.tracker is not None:
+            # tracked lines are already filtered, no need to clamp the angle
+            self.curr_steering_angle = new_steering_angle
+        else:
+            self.curr_steering_angle = stabilize_steering_angle(
+                self.curr_steering_angle, new_steering_angle, len(lane_lines)
+            )
 
         if self.car is not None:
             self.car.front_wheels.turn(self.curr_steering_angle)
-        curr_heading_image = display_heading_line(frame, self.curr_steering_angle)
-        show_image("heading", curr_heading_image)
 
-        return curr_heading_image
+        return self.curr_steering_angle
@@ -2,6 +2,7 @@
 This module contains functions for processing a frame
 """
 
+import functools
 import logging
 import cv2
 import numpy as np
@@ -15,20 +16,41 @@ from src.opencv_auto.utility import (
 
 logger = logging.getLogger(__name__)
 
+# region of interest as a tuple of (x, y) polygon vertices in fractions of
+# (width, height); tuples so the derived masks can be cached
+BOTTOM_HALF_ROI = ((0, 1 / 2), (1, 1 / 2), (1, 1), (0, 1))
 
-def detect_edges(frame):
+# HSV bounds of the blue lane tape
+LOWER_BLUE = (60, 40, 40)
+UPPER_BLUE = (150, 190, 190)
+
+# context kept around the cropped ROI so that Canny's gradients and
+# non-maximum suppression at the ROI border see the same pixels as before
+EDGE_MARGIN = 4
+
+
+def hsv_mask(frame, lower=LOWER_BLUE, upper=UPPER_BLUE):
     """
-    Detect edges using Canny Edge Detection algorithm
+    Mask the pixels of a BGR frame whose HSV value lies within the bounds
     """
-
-    # filter for blue lane lines
     hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
     show_image("hsv", hsv)
 
+    return cv2.inRange(hsv, np.array(lower), np.array(upper))
+
+
+def detect_edges(frame, color_mask=None):
+    """
+    Detect edges using Canny Edge Detection algorithm
+    color_mask: callable mapping the frame to the lane mask, e.g. a
+        ColorMaskLUT; defaults to the HSV blue filter
+    """
+
     # mask the image to isolate only blue colors
-    lower_blue = np.array([60, 40, 40])
-    upper_blue = np.array([150, 190, 190])
-    mask = cv2.inRange(hsv, lower_blue, upper_blue)
+    if color_mask is None:
+        mask = hsv_mask(frame)
+    else:
+        mask = color_mask(frame)
     show_image("blue mask", mask)
 
     # detect edges
@@ -37,28 +59,56 @@ def detect_edges(frame):
     return edges
 
 
-def region_of_interest(canny):
+def roi_polygon(shape, roi=BOTTOM_HALF_ROI):
     """
-    Focus on a region of interest
+    Pixel coordinates of the region of interest for a frame shape
     """
-    height, width = canny.shape
-    mask = np.zeros_like(canny)
-
-    # only focus bottom half of the screen
-    polygon = np.array(
-        [
-            [
-                (0, height * 1 / 2),
-                (width, height * 1 / 2),
-                (width, height),
-                (0, height),
-            ]
-        ],
-        np.int32,
-    )
+    height, width = shape[:2]
+    return np.array([[(width * x, height * y) for x, y in roi]], np.int32)
+
+
+def roi_box(shape, roi=BOTTOM_HALF_ROI):
+    """
+    Bounding box (x0, y0, x1, y1) of the region of interest, clipped to the
+    frame, with exclusive x1/y1
+    """
+    height, width = shape[:2]
+    polygon = roi_polygon(shape, roi)[0]
+    x0, y0 = np.maximum(polygon.min(axis=0), 0)
+    x1, y1 = polygon.max(axis=0) + 1
+    return int(x0), int(y0), int(min(x1, width)), int(min(y1, height))
+
+
+@functools.lru_cache(maxsize=8)
+def roi_mask(shape, roi=BOTTOM_HALF_ROI, cropped=False):
+    """
+    Cached, read-only mask of the region of interest for a frame shape.
+    With cropped, the mask only covers roi_box and is None when the polygon
+    fills that box, i.e. when cropping alone is enough.
+    """
+    height, width = shape[:2]
+    polygon = roi_polygon(shape, roi)
+    offset = (0, 0)
+    if cropped:
+        x0, y0, x1, y1 = roi_box(shape, roi)
+        height, width = y1 - y0, x1 - x0
+        offset = (x0, y0)
 
     # fill the polygon with white
-    cv2.fillPoly(mask, polygon, 255)
+    mask = np.zeros((height, width), np.uint8)
+    cv2.fillPoly(mask, polygon - np.array(offset, np.int32), 255)
+    if cropped and mask.all():
+        return None
+
+    mask.setflags(write=False)
+    return mask
+
+
+def region_of_interest(canny, roi=BOTTOM_HALF_ROI):
+    """
+    Focus on a region of interest
+    """
+    mask = roi_mask(canny.shape, roi)
     show_image("mask", mask)
 
     # mask area of interest
@@ -67,13 +117,39 @@ def region_of_interest(canny):
     return masked_image
 
 
-def detect_line_segments(masked_image):
+def detect_roi_edges(frame, roi=BOTTOM_HALF_ROI, color_mask=None):
+    """
+    Detect edges only inside the region of interest.
+    The frame is cropped to the ROI box (plus EDGE_MARGIN of context) before
+    color conversion and Canny, and masked when the ROI is not a rectangle.
+    Returns the edges of the ROI box and the box's (x, y) offset in the frame.
+    """
+    height, width = frame.shape[:2]
+    x0, y0, x1, y1 = roi_box(frame.shape, roi)
+    top, left = min(EDGE_MARGIN, y0), min(EDGE_MARGIN, x0)
+    bottom, right = min(EDGE_MARGIN, height - y1), min(EDGE_MARGIN, width - x1)
+
+    edges = detect_edges(
+        frame[y0 - top : y1 + bottom, x0 - left : x1 + right], color_mask
+    )
+    edges = edges[top : top + y1 - y0, left : left + x1 - x0]
+
+    mask = roi_mask(frame.shape, roi, cropped=True)
+    if mask is not None:
+        edges = cv2.bitwise_and(edges, mask)
+
+    return edges, (x0, y0)
+
+
+def detect_line_segments(masked_image, scale=1.0):
     """
     Detect line segments using Probabilistic Hough Transform
+    scale: resolution of masked_image relative to the camera frame; the
+        pixel based thresholds are scaled to match
     """
     precision = 1  # precision in pixel
     angle = np.pi / 180  # degree in radian
-    min_threshold = 20  # minimal of votes #was 10
+    min_threshold = max(1, round(20 * scale))  # minimal of votes #was 10
 
     # detect line segments
     line_segments = cv2.HoughLinesP(
@@ -82,11 +158,11 @@ def detect_line_segments(masked_image):
         angle,
         min_threshold,
         np.array([]),
-        minLineLength=8,
-        maxLineGap=4,
+        minLineLength=8 * scale,
+        maxLineGap=4 * scale,
     )
 
-    if line_segments is not None:
+    if line_segments is not None and logger.isEnabledFor(logging.DEBUG):
         for line_segment in line_segments:
             logger.debug("detected line_segment:")
             logger.debug(
@@ -108,65 +184,96 @@ def average_slope_intercept(frame, line_segments):
         return lane_lines
 
     _, width, _ = frame.shape
-    left_fit = []
-    right_fit = []
 
     boundary = 1 / 3
     left_region_boundary = width * (1 - boundary)
     right_region_boundary = width * boundary
 
-    for line_segment in line_segments:
-        for x1, y1, x2, y2 in line_segment:
-            if x1 == x2:
-                # logger.info(
-                #     f"skipping vertical line segment (slope=inf): {line_segment}"
-                # )
-                continue
-            fit = np.polyfit((x1, x2), (y1, y2), 1)
-            slope = fit[0]
-            intercept = fit[1]
-            if slope < 0:
-                if x1 < left_region_boundary and x2 < left_region_boundary:
-                    left_fit.append((slope, intercept))
-            else:
-                if x1 > right_region_boundary and x2 > right_region_boundary:
-                    right_fit.append((slope, intercept))
-
-    left_fit_average = np.average(left_fit, axis=0)
-    if len(left_fit) > 0:
-        lane_lines.append(make_points(frame, left_fit_average))
-
-    right_fit_average = np.average(right_fit, axis=0)
-    if len(right_fit) > 0:
-        lane_lines.append(make_points(frame, right_fit_average))
+    # fit all segments at once, skipping vertical ones (slope=inf);
+    # horizontal ones have a slope of exactly 0 and count as right
+    segments = np.asarray(line_segments).reshape(-1, 4)
+    segments = segments[segments[:, 0] != segments[:, 2]]
+    x1, y1, x2, y2 = segments.T
+    slope = (y2 - y1) / (x2 - x1)
+    intercept = y1 - slope * x1
+    fit = np.stack((slope, intercept), axis=1)
+
+    left = (slope < 0) & (x1 < left_region_boundary) & (x2 < left_region_boundary)
+    right = (slope >= 0) & (x1 > right_region_boundary) & (x2 > right_region_boundary)
+
+    if left.any():
+        lane_lines.append(make_points(frame, fit[left].mean(axis=0)))
+
+    # only horizontal segments on the right make no lane line, a flat line
+    # never reaches the bottom of the frame
+    if right.any() and slope[right].any():
+        lane_lines.append(make_points(frame, fit[right].mean(axis=0)))
 
     logger.debug(f"lane lines: {lane_lines}")
 
     return lane_lines
 
 
-def detect_lane(frame, show_image_windows=False):
+def downscale(frame, scale):
+    """
+    Resize a frame by scale, averaging pixels so thin lane lines survive.
+    Halves first while possible: OpenCV's INTER_AREA is only vectorized for
+    a factor of two, chaining those is several times faster for 1/4.
+    """
+    height, width = frame.shape[:2]
+    size = (round(width * scale), round(height * scale))
+    while scale <= 0.5:
+        height, width = frame.shape[:2]
+        frame = cv2.resize(
+            frame, (width // 2, height // 2), interpolation=cv2.INTER_AREA
+        )
+        scale *= 2
+    if frame.shape[1::-1] != size:
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    return frame
+
+
+def detect_lane(
+    frame,
+    show_image_windows=False,
+    canvas=None,
+    roi=BOTTOM_HALF_ROI,
+    color_mask=None,
+    scale=1.0,
+):
     """
     Detect lane lines in a frame
+    The lane lines image is only rendered when show_image_windows is set,
+    otherwise None is returned in its place.
+    canvas: OverlayCanvas to draw the debug images into
+    roi: region of interest polygon in fractions of the frame size
+    color_mask: callable producing the lane mask, see detect_edges
+    scale: run the pipeline on a frame downscaled by this factor, e.g. 1/4;
+        the lane lines are still returned in full resolution coordinates
     """
     logger.debug("detecting lane lines...")
 
-    edges = detect_edges(frame)
-    if show_image_windows:
-        show_image("edges", edges)
-
-    cropped_edges = region_of_interest(edges)
+    small_frame = frame if scale == 1 else downscale(frame, scale)
+    cropped_edges, (x0, y0) = detect_roi_edges(small_frame, roi, color_mask)
     if show_image_windows:
         show_image("edges cropped", cropped_edges)
 
-    line_segments = detect_line_segments(cropped_edges)
-    line_segment_image = display_lines(frame, line_segments)
-    if show_image_windows:
+    # map the segments from ROI back to full resolution frame coordinates
+    line_segments = detect_line_segments(cropped_edges, scale)
+    if line_segments is not None:
+        line_segments += np.array([x0, y0, x0, y0], line_segments.dtype)
+        if scale != 1:
+            line_segments = (line_segments + 0.5) / scale - 0.5
+    if show_image_windows and line_segments is not None:
+        line_segment_image = display_lines(
+            frame, line_segments.astype(np.int32), canvas=canvas
+        )
         show_image("line segments", line_segment_image)
 
     lane_lines = average_slope_intercept(frame, line_segments)
-    lane_lines_image = display_lines(frame, lane_lines)
+    lane_lines_image = None
     if show_image_windows:
+        lane_lines_image = display_lines(frame, lane_lines, canvas=canvas)
         show_image("lane lines", lane_lines_image)
 
     return lane_lines, lane_lines_image
@@ -0,0 +1,237 @@
+"""
+    Temporal lane tracking: Kalman filtered lane lines that are searched for
+    in narrow bands around their prediction instead of in the whole frame
+"""
+import logging
+
+import numpy as np
+
+from src.opencv_auto.frame_processing import (
+    BOTTOM_HALF_ROI,
+    detect_lane,
+    hsv_mask,
+    roi_box,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class LaneLineFilter(object):
+    """
+    Constant velocity Kalman filter over a lane line's bottom position and
+    slope. The line is x(y) = position + slope * (y - frame height).
+    """
+
+    def __init__(
+        self,
+        position,
+        slope,
+        position_noise=4.0,
+        slope_noise=0.05,
+        process_noise=(1.0, 1e-3),
+    ):
+        """
+        position, slope: initial measurement
+        position_noise, slope_noise: standard deviation of a measurement
+        process_noise: standard deviation of the per-frame change of the
+            position and slope rates
+        """
+        self.state = np.array([position, slope, 0.0, 0.0])
+        self.covariance = np.diag([position_noise**2, slope_noise**2, 1.0, 1e-2])
+
+        self.transition = np.eye(4)
+        self.transition[0, 2] = 1.0
+        self.transition[1, 3] = 1.0
+        self.observation = np.eye(2, 4)
+        self.measurement_noise = np.diag([position_noise**2, slope_noise**2])
+        self.process_noise = np.diag([0.0, 0.0, *np.square(process_noise)])
+
+    @property
+    def position(self):
+        return self.state[0]
+
+    @property
+    def slope(self):
+        return self.state[1]
+
+    def predict(self):
+        """
+        Advance the filter by one frame
+        """
+        self.state = self.transition @ self.state
+        self.covariance = (
+            self.transition @ self.covariance @ self.transition.T + self.process_noise
+        )
+
+    def update(self, position, slope):
+        """
+        Correct the prediction with a measured line
+        """
+        innovation = np.array([position, slope]) - self.observation @ self.state
+        innovation_cov = (
+            self.observation @ self.covariance @ self.observation.T
+            + self.measurement_noise
+        )
+        gain = self.covariance @ self.observation.T @ np.linalg.inv(innovation_cov)
+        self.state = self.state + gain @ innovation
+        self.covariance = (np.eye(4) - gain @ self.observation) @ self.covariance
+
+
+class LaneTracker(object):
+    """
+    Tracks the left and right lane lines across frames.
+    A full detect_lane runs only to (re)acquire the lines: at start, on every
+    frame a side is missing, e.g. because the confidence of its line
+    dropped, and every redetect_interval frames to correct the tracked ones.
+    """
+
+    def __init__(
+        self,
+        roi=BOTTOM_HALF_ROI,
+        color_mask=None,
+        band_width=40,
+        row_step=4,
+        min_pixels=3,
+        min_confidence=0.3,
+        redetect_interval=30,
+        scale=1.0,
+    ):
+        """
+        roi, color_mask, scale: as for detect_lane, used to acquire lines
+        band_width: half width in pixels of the band searched around a line
+        row_step: only every row_step-th row of the band is searched
+        min_pixels: lane pixels a row needs to count as a hit
+        min_confidence: fraction of hit rows below which a line is lost
+        """
+        logger.info("Creating an instance of LaneTracker")
+        self.roi = roi
+        self.color_mask = color_mask if color_mask is not None else hsv_mask
+        self.band_width = band_width
+        self.row_step = row_step
+        self.min_pixels = min_pixels
+        self.min_confidence = min_confidence
+        self.redetect_interval = redetect_interval
+        self.scale = scale
+
+        self.lines = {}
+        self.confidence = {}
+        self.frames_since_detection = 0
+        self._shape = None
+
+    def reset(self):
+        """
+        Forget the tracked lines, the next frame runs a full detection
+        """
+        self.lines = {}
+        self.confidence = {}
+
+    def detect(self, frame):
+        """
+        Lane lines of the frame in the format of detect_lane
+        """
+        if frame.shape != self._shape:
+            self._shape = frame.shape
+            self.reset()
+
+        self.frames_since_detection += 1
+        if not self.lines or self.frames_since_detection >= self.redetect_interval:
+            self.acquire(frame)
+        else:
+            self.track(frame)
+
+        return self.lane_lines(frame.shape)
+
+    def acquire(self, frame, sides=None):
+        """
+        Full-frame detection, (re)initialising the filters of found lines.
+        sides: only start filters for these untracked sides, leaving the
+            tracked ones alone; None corrects all and restarts the interval
+        """
+        logger.debug(f"acquiring lane lines {sides or ''}")
+        if sides is None:
+            self.frames_since_detection = 0
+        lane_lines, _ = detect_lane(
+            frame, roi=self.roi, color_mask=self.color_mask, scale=self.scale
+        )
+
+        height = frame.shape[0]
+        for line in lane_lines:
+            x1, y1, x2, y2 = line[0]
+            slope = (x2 - x1) / (y2 - y1)
+            position = x1 + slope * (height - y1)
+            side = "left" if slope < 0 else "right"
+            if sides is not None and side not in sides:
+                continue
+            if side in self.lines:
+                # bring the filter to this frame before correcting it
+                self.lines[side].predict()
+                self.lines[side].update(position, slope)
+            else:
+                self.lines[side] = LaneLineFilter(position, slope)
+            self.confidence[side] = 1.0
+
+    def track(self, frame):
+        """
+        Search the bands around the predicted lines, then look for the
+        missing ones in the whole frame
+        """
+        for side, line in list(self.lines.items()):
+            line.predict()
+            measurement, confidence = self.search_band(frame, line)
+            self.confidence[side] = confidence
+            # too few rows to fit a line is as lost as too few hits
+            if measurement is None or confidence < self.min_confidence:
+                logger.info(f"Lost {side} lane line (confidence {confidence:.2f})")
+                del self.lines[side]
+                continue
+            line.update(*measurement)
+
+        missing = [side for side in ("left", "right") if side not in self.lines]
+        if missing:
+            self.acquire(frame, missing)
+
+    def search_band(self, frame, line):
+        """
+        Fit a line through the lane pixels in the band around a prediction.
+        Returns ((position, slope), confidence)
+        """
+        height, width = frame.shape[:2]
+        _, y0, _, y1 = roi_box(frame.shape, self.roi)
+        rows = np.arange(y1 - 1, y0 - 1, -self.row_step)
+        centers = np.rint(line.position + line.slope * (rows - height)).astype(np.intp)
+        cols = centers[:, None] + np.arange(-self.band_width, self.band_width)
+        inside = (cols >= 0) & (cols < width)
+
+        # straighten the band into a (rows, 2 * band_width) image and mask it
+        band = frame[rows[:, None], np.clip(cols, 0, width - 1)]
+        hits = (self.color_mask(band) > 0) & inside
+
+        counts = hits.sum(axis=1)
+        found = counts >= self.min_pixels
+        confidence = float(found.mean())
+        if found.sum() < 2:
+            return None, confidence
+
+        xs = (hits * cols).sum(axis=1)[found] / counts[found]
+        slope, intercept = np.polyfit(rows[found], xs, 1)
+        return (intercept + slope * height, slope), confidence
+
+    def lane_lines(self, shape):
+        """
+        The tracked lines as [[x1, y1, x2, y2]], left first, like make_points
+        """
+        height, width = shape[:2]
+        y1 = height
+        y2 = int(y1 * 1 / 2)
+
+        lane_lines = []
+        for side in ("left", "right"):
+            if side not in self.lines:
+                continue
+            line = self.lines[side]
+            x1 = line.position
+            x2 = line.position + line.slope * (y2 - y1)
+            x1 = max(-width, min(2 * width, int(x1)))
+            x2 = max(-width, min(2 * width, int(x2)))
+            lane_lines.append([[x1, y1, x2, y2]])
+        return lane_lines
@@ -2,6 +2,7 @@
     Utility functions for this module
 """
 import math
+import threading
 import cv2
 import numpy as np
 
@@ -35,30 +36,84 @@ def make_points(frame, line):
     return [[x1, y1, x2, y2]]
 
 
-def display_lines(frame, lines, line_color=(0, 255, 0), line_width=10):
+class OverlayCanvas(object):
     """
-    Display lines on a black background
+    Preallocated buffers for drawing overlays on frames of a fixed size.
+    The blended output rotates through num_outputs buffers, so a consumer in
+    another thread has that many frames of time to copy a result.
+    Every thread draws into buffers of its own, e.g. the lane worker
+    rendering a frame and the recorder rendering a deferred LazyOverlay.
+    """
+
+    def __init__(self, num_outputs=2):
+        self.num_outputs = num_outputs
+        self._local = threading.local()
+
+    @property
+    def line_image(self):
+        """
+        The calling thread's line buffer, None before its first clear
+        """
+        return getattr(self._local, "line_image", None)
+
+    def clear(self, frame):
+        """
+        Return the blank line buffer for this frame, allocating it only when
+        the frame size changes
+        """
+        local = self._local
+        if self.line_image is None or self.line_image.shape != frame.shape:
+            local.line_image = np.zeros_like(frame)
+            local.outputs = [np.empty_like(frame) for _ in range(self.num_outputs)]
+            local.next_output = 0
+        else:
+            local.line_image.fill(0)
+        return local.line_image
+
+    def blend(self, frame, out=None):
+        """
+        Blend the drawn lines over the frame, into out if given
+        """
+        local = self._local
+        if out is None:
+            out = local.outputs[local.next_output]
+            local.next_output = (local.next_output + 1) % self.num_outputs
+        return cv2.addWeighted(frame, 0.8, local.line_image, 1, 1, dst=out)
+
+
+class LazyOverlay(object):
+    """
+    An overlay that is only rendered when a recorder or viewer calls it
+    """
+
+    def __init__(self, render, *args):
+        self._render = render
+        self._args = args
+
+    def __call__(self, out=None):
+        return self._render(*self._args, out=out)
+
+
+def draw_lines(line_image, lines, line_color=(0, 255, 0), line_width=10):
+    """
+    Draw lines onto an image in place
     """
-    line_image = np.zeros_like(frame)
     if lines is not None:
         for line in lines:
             for x1, y1, x2, y2 in line:
                 cv2.line(line_image, (x1, y1), (x2, y2), line_color, line_width)
-    line_image = cv2.addWeighted(frame, 0.8, line_image, 1, 1)
-    return line_image
 
 
-def display_heading_line(
-    frame,
+def draw_heading_line(
+    line_image,
     steering_angle,
     line_color=(0, 0, 255),
     line_width=5,
 ):
     """
-    Find the heading line from steering angle
+    Draw the heading line for a steering angle onto an image in place
     """
-    heading_image = np.zeros_like(frame)
-    height, width, _ = frame.shape
+    height, width, _ = line_image.shape
 
     steering_angle_radian = steering_angle / 180.0 * math.pi
     x1 = int(width / 2)
@@ -66,7 +121,32 @@ def display_heading_line(
     x2 = int(x1 - height / 2 / math.tan(steering_angle_radian))
     y2 = int(height / 2)
 
-    cv2.line(heading_image, (x1, y1), (x2, y2), line_color, line_width)
-    heading_image = cv2.addWeighted(frame, 0.8, heading_image, 1, 1)
+    cv2.line(line_image, (x1, y1), (x2, y2), line_color, line_width)
+
 
-    return heading_image
+def display_lines(frame, lines, line_color=(0, 255, 0), line_width=10, canvas=None):
+    """
+    Display lines on a black background
+    canvas: OverlayCanvas to reuse, otherwise new buffers are allocated
+    """
+    if canvas is None:
+        canvas = OverlayCanvas(num_outputs=1)
+    draw_lines(canvas.clear(frame), lines, line_color, line_width)
+    return canvas.blend(frame)
+
+
+def display_heading_line(
+    frame,
+    steering_angle,
+    line_color=(0, 0, 255),
+    line_width=5,
+    canvas=None,
+):
+    """
+    Find the heading line from steering angle
+    canvas: OverlayCanvas to reuse, otherwise new buffers are allocated
+    """
+    if canvas is None:
+        canvas = OverlayCanvas(num_outputs=1)
+    draw_heading_line(canvas.clear(frame), steering_angle, line_color, line_width)
+    return canvas.blend(frame)
@@ -0,0 +1,63 @@
+"""
+    Background camera capture that always holds the freshest frame
+"""
+import logging
+import threading
+import time
+
+from src.pipeline.workers import DropOldestQueue, FramePacket
+
+logger = logging.getLogger(__name__)
+
+
+class CameraStream(threading.Thread):
+    """
+    Reads the camera in a dedicated thread and fans every frame out to
+    bounded subscriber queues, so slow consumers only ever see fresh frames
+    """
+
+    def __init__(self, camera, max_failed_reads=30):
+        """
+        camera: an opened cv2.VideoCapture
+        max_failed_reads: consecutive failed reads before the stream gives up
+        """
+        super().__init__(name="capture", daemon=True)
+        self.camera = camera
+        self.max_failed_reads = max_failed_reads
+        self.frames_read = 0
+        self._subscribers = []
+        self._stopping = threading.Event()
+
+    def subscribe(self, maxsize=1):
+        """
+        Register a new consumer; must be called before the stream is started
+        """
+        queue = DropOldestQueue(maxsize)
+        self._subscribers.append(queue)
+        return queue
+
+    def run(self):
+        logger.info("Starting capture thread")
+        failed_reads = 0
+        while not self._stopping.is_set() and self.camera.isOpened():
+            ret, frame = self.camera.read()
+            if not ret:
+                failed_reads += 1
+                if failed_reads >= self.max_failed_reads:
+                    logger.error("Camera stopped delivering frames")
+                    break
+                continue
+
+            failed_reads = 0
+            self.frames_read += 1
+            packet = FramePacket(self.frames_read, time.perf_counter(), frame)
+            for queue in self._subscribers:
+                queue.put(packet)
+
+        logger.info(f"Capture thread stopped after {self.frames_read} frames")
+
+    def stop(self):
+        """
+        Ask the capture thread to exit after the current read
+        """
+        self._stopping.set()
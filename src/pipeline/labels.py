@@ -0,0 +1,207 @@
+"""
+    Log the frames the lane follower saw with its steering angles while
+    driving, as training shards
+"""
+import json
+import logging
+import math
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from src.cnn_driving.utility import INPUT_HEIGHT, INPUT_WIDTH, Preprocessor
+from src.cnn_training.shards import MANIFEST, FrameStore
+
+logger = logging.getLogger(__name__)
+
+
+class LabelLogger(object):
+    """
+    Append-only store of labelled frames in the shard format of
+    src/cnn_training/shards.py, so ShardDataset and BatchLoader read it as
+    they read extracted videos, without decoding or relabelling anything.
+
+    Frames are copied into preallocated buffers and written to .npy shards
+    of shard_size frames by a background thread; when the writer falls
+    behind, frames are dropped. The manifest is replaced after every
+    finished shard, so an interrupted drive leaves all finished shards
+    readable.
+    """
+
+    def __init__(self, output_dir, layout="crop", shard_size=256, queue_size=16):
+        """
+        output_dir: directory of the shards and their manifest
+        layout: "frame", "crop" or "yuv" as for extract; yuv frames are
+            converted by the writer thread, not the drive loop
+        shard_size: frames per shard file
+        queue_size: frames waiting for the writer before dropping
+        """
+        logger.info(f"Logging labelled frames to {output_dir}")
+        self.output_dir = output_dir
+        self.layout = layout
+        # the drive loop only copies; the bottom half is all yuv needs
+        self._copy = FrameStore("crop" if layout == "yuv" else layout)
+        self.shard_size = shard_size
+        self.queue_size = queue_size
+        self.logged = 0
+        self.dropped = 0
+        self.shards = []
+
+        self._free = []
+        self._allocated = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._shard = None
+        os.makedirs(output_dir, exist_ok=True)
+        self._writer = threading.Thread(target=self._write, name="labels", daemon=True)
+        self._writer.start()
+
+    def log(self, frame, angle, confidence=math.nan, lines=-1, timestamp=None):
+        """
+        Queue a frame with its labels, never blocks.
+        frame: the full BGR frame the lane follower saw
+        angle: the steering angle it computed for it
+        confidence: lane line confidence from 0 to 1
+        lines: number of lane lines found
+        timestamp: seconds since the epoch, now by default
+        Returns True if the frame was kept.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        buffer = self._take_buffer(frame)
+        if buffer is None:
+            self.dropped += 1
+            return False
+        np.copyto(buffer, self._copy(frame))
+        self._queue.put((buffer, angle, confidence, lines, timestamp))
+        return True
+
+    def log_follower(self, frame, lane_follower, timestamp=None):
+        """
+        Log a frame with the labels a lane follower just computed for it
+        """
+        lane_lines = getattr(lane_follower, "lane_lines", None)
+        return self.log(
+            frame,
+            lane_follower.curr_steering_angle,
+            getattr(lane_follower, "lane_confidence", math.nan),
+            -1 if lane_lines is None else len(lane_lines),
+            timestamp,
+        )
+
+    def close(self):
+        """
+        Write the queued frames and the last, partial shard
+        """
+        self._queue.put(None)
+        self._writer.join()
+        logger.info(
+            f"Logged {self.logged} labelled frames in {len(self.shards)} shards, "
+            f"dropped {self.dropped}"
+        )
+
+    def _take_buffer(self, frame):
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            if self._allocated < self.queue_size:
+                self._allocated += 1
+                return np.empty(self._copy.shape(frame.shape), np.uint8)
+            return None
+
+    def _recycle(self, buffer):
+        with self._lock:
+            self._free.append(buffer)
+
+    def _write(self):
+        preprocess = Preprocessor(np.uint8, crop=False)
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._finish_shard()
+                return
+            buffer, angle, confidence, lines, timestamp = item
+            if self._shard is None:
+                self._start_shard(buffer.shape)
+
+            shard = self._shard
+            count = shard["count"]
+            if self.layout == "yuv":
+                preprocess(buffer, out=shard["images"][count])
+            else:
+                shard["images"][count] = buffer
+            self._recycle(buffer)
+            shard["angles"][count] = round(angle)
+            shard["confidence"][count] = confidence
+            shard["lines"][count] = lines
+            shard["timestamps"][count] = timestamp
+            shard["count"] += 1
+            self.logged += 1
+            if shard["count"] == self.shard_size:
+                self._finish_shard()
+
+    def _start_shard(self, copy_shape):
+        start = self.logged
+        name = f"labels_{start:06d}"
+        if self.layout == "yuv":
+            shape = (INPUT_HEIGHT, INPUT_WIDTH, 3)
+        else:
+            shape = copy_shape
+        images = np.lib.format.open_memmap(
+            os.path.join(self.output_dir, name + ".npy"),
+            mode="w+",
+            dtype=np.uint8,
+            shape=(self.shard_size,) + shape,
+        )
+        self._shard = {
+            "name": name,
+            "start": start,
+            "count": 0,
+            "images": images,
+            "angles": np.empty(self.shard_size, np.int16),
+            "confidence": np.empty(self.shard_size, np.float32),
+            "lines": np.empty(self.shard_size, np.int8),
+            "timestamps": np.empty(self.shard_size, np.float64),
+        }
+
+    def _finish_shard(self):
+        shard, self._shard = self._shard, None
+        if shard is None:
+            return
+        count = shard["count"]
+        path = os.path.join(self.output_dir, shard["name"])
+        images = shard.pop("images")
+        images.flush()
+        if count < len(images):
+            truncated = np.array(images[:count])
+            del images
+            np.save(path + ".npy", truncated)
+        else:
+            del images
+
+        entry = {
+            "images": shard["name"] + ".npy",
+            "video": None,
+            "start": shard["start"],
+            "count": count,
+        }
+        for key in ("angles", "confidence", "lines", "timestamps"):
+            entry[key] = f"{shard['name']}_{key}.npy"
+            np.save(path + f"_{key}.npy", shard[key][:count])
+        self.shards.append(entry)
+        self._write_manifest()
+
+    def _write_manifest(self):
+        manifest = {
+            "layout": self.layout,
+            "warmup": 0,
+            "frames": sum(shard["count"] for shard in self.shards),
+            "shards": self.shards,
+        }
+        path = os.path.join(self.output_dir, MANIFEST)
+        with open(path + ".tmp", "w") as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(path + ".tmp", path)
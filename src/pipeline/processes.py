@@ -0,0 +1,242 @@
+"""
+    Run a perception model in its own process, so its Python pre- and
+    post-processing does not compete with the lane follower for the GIL.
+    Frames travel through shared memory, only compact results are pickled.
+"""
+import logging
+import multiprocessing
+import queue
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from src.object_detection.boxes import BoundingBox, Detection
+
+logger = logging.getLogger(__name__)
+
+
+class SharedFrameRing(object):
+    """
+    Fixed number of preallocated frame slots in one shared memory block
+    """
+
+    def __init__(self, shape=(480, 640, 3), slots=2, name=None):
+        """
+        shape: shape of a single uint8 frame
+        slots: number of frames in the ring
+        name: attach to the existing block of that name instead of creating one
+        """
+        self.shape = tuple(shape)
+        self.slots = slots
+        size = slots * int(np.prod(self.shape))
+        self.owner = name is None
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            # the spawned child shares the parent's resource tracker, so the
+            # block stays registered once and is freed by the owner only
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.frames = np.ndarray(
+            (slots,) + self.shape, dtype=np.uint8, buffer=self.memory.buf
+        )
+        self._next = 0
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def write(self, frame, busy=()):
+        """
+        Copy a frame into the next slot not in busy and return the slot's index
+        """
+        for _ in range(self.slots):
+            slot = self._next
+            self._next = (slot + 1) % self.slots
+            if slot not in busy:
+                np.copyto(self.frames[slot], frame)
+                return slot
+        raise ValueError("Every slot of the ring is busy")
+
+    def close(self):
+        """
+        Detach from the block, the owner also frees it
+        """
+        self.frames = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+def detection_stage(**options):
+    """
+    Child side of the object detector: frame -> [(id, score, bbox)]
+    """
+    from src.object_detection.model import DetectionModel
+
+    model = DetectionModel(**options)
+
+    def run(frame):
+        objects, _ = model.detect_objects(frame)
+        return [(obj.id, float(obj.score), tuple(obj.bbox)) for obj in objects]
+
+    return run
+
+
+def steering_stage(**options):
+    """
+    Child side of the CNN lane follower: frame -> steering angle
+    """
+    from src.cnn_driving.driver import CNNDrive
+
+    model = CNNDrive(render_overlays=False, **options)
+    return model.compute_steering_angle
+
+
+def _serve(stage, options, ring_name, shape, slots, requests, responses):
+    """
+    Main loop of the child process
+    """
+    ring = SharedFrameRing(shape, slots, name=ring_name)
+    try:
+        process = stage(**options)
+        responses.put((0, "ready", None))
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+            seq, slot = request
+            try:
+                responses.put((seq, "ok", process(ring.frames[slot])))
+            except Exception as e:
+                responses.put((seq, "error", repr(e)))
+    except Exception as e:
+        responses.put((0, "error", repr(e)))
+    finally:
+        ring.close()
+
+
+class RemoteStage(object):
+    """
+    Callable that runs stage(**options) in a child process.
+    A call copies the frame into the next slot of the shared ring, hands the
+    child the slot and waits for the result. A slot stays busy until the
+    child answered for it, also after a call timed out, so the child never
+    reads a slot being written; when every slot is busy a call waits for a
+    late answer, then gives up. Use it as the process of a StageWorker.
+    """
+
+    def __init__(
+        self,
+        name,
+        stage,
+        shape=(480, 640, 3),
+        slots=2,
+        options=None,
+        start_timeout=120.0,
+        timeout=5.0,
+    ):
+        """
+        stage: module level factory returning the child's frame -> result
+            function, e.g. detection_stage
+        shape: shape of the frames that will be passed in
+        start_timeout: seconds to wait for the child to load its model
+        timeout: seconds to wait for a single result
+        """
+        logger.info(f"Starting {name} process")
+        self.name = name
+        self.timeout = timeout
+        self.ring = SharedFrameRing(shape, slots)
+        self._seq = 0
+        # sequence number -> slot of the requests the child has not answered
+        self._busy = {}
+
+        context = multiprocessing.get_context("spawn")
+        self.requests = context.Queue()
+        self.responses = context.Queue()
+        self.process = context.Process(
+            target=_serve,
+            name=name,
+            args=(
+                stage,
+                options or {},
+                self.ring.name,
+                self.ring.shape,
+                slots,
+                self.requests,
+                self.responses,
+            ),
+            daemon=True,
+        )
+        self.process.start()
+        try:
+            self._receive(start_timeout)
+        except Exception:
+            self.close()
+            raise
+
+    def __call__(self, frame):
+        """
+        Result of the stage for the frame
+        """
+        if len(self._busy) == self.ring.slots:
+            self._answer(self.timeout, busy=True)
+        slot = self.ring.write(frame, busy=set(self._busy.values()))
+        self._seq += 1
+        self._busy[self._seq] = slot
+        self.requests.put((self._seq, slot))
+        return self._receive(self.timeout)
+
+    def _answer(self, timeout, busy=False):
+        # the next answer of the child, which frees the slot it was about
+        try:
+            seq, status, value = self.responses.get(timeout=timeout)
+        except queue.Empty:
+            if busy:
+                raise RuntimeError(
+                    f"{self.name} process is still busy with {len(self._busy)} "
+                    "frames, dropping this one"
+                )
+            raise RuntimeError(f"{self.name} process did not answer in {timeout}s")
+        self._busy.pop(seq, None)
+        return seq, status, value
+
+    def _receive(self, timeout):
+        # skip late answers to calls that already timed out
+        while True:
+            seq, status, value = self._answer(timeout)
+            if seq >= self._seq or status == "error" and seq == 0:
+                break
+        if status == "error":
+            raise RuntimeError(f"{self.name} process failed: {value}")
+        return value
+
+    def close(self, timeout=1.0):
+        """
+        Stop the child and free the shared memory
+        """
+        if self.process.is_alive():
+            self.requests.put(None)
+            self.process.join(timeout)
+        if self.process.is_alive():
+            logger.warning(f"{self.name} process did not stop, terminating it")
+            self.process.terminate()
+            self.process.join(timeout)
+        self.ring.close()
+
+
+class RemoteDetector(RemoteStage):
+    """
+    DetectionModel.detect_objects running in a child process
+    """
+
+    def __init__(self, shape=(480, 640, 3), **kwargs):
+        super().__init__("detector", detection_stage, shape, **kwargs)
+
+    def detect_objects(self, frame):
+        """
+        (objects, frame) like DetectionModel.detect_objects
+        """
+        objects = [
+            Detection(id, score, BoundingBox(*bbox)) for id, score, bbox in self(frame)
+        ]
+        return objects, frame
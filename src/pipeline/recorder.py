@@ -0,0 +1,176 @@
+"""
+    Asynchronous, decimated video recording
+"""
+import logging
+import math
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class _Stream(object):
+    """
+    Book-keeping for one recorded video file
+    """
+
+    def __init__(self, name, writer, fps, frame_size, pool_size, ring_length):
+        width, height = frame_size
+        self.name = name
+        self.writer = writer
+        self.interval = 1.0 / fps
+        self.next_due = 0.0
+        self.free = [np.empty((height, width, 3), np.uint8) for _ in range(pool_size)]
+        self.ring = deque()
+        self.ring_length = ring_length
+        self.written = 0
+        self.dropped = 0
+
+
+class VideoRecorder(object):
+    """
+    Records several video streams without ever blocking the caller.
+    Frames are copied into preallocated buffers and encoded by a background
+    thread; when the encoder falls behind, frames are dropped.
+
+    In continuous mode every stream is decimated to its own frame rate.
+    In event mode frames only go to a per-stream ring buffer and the ring is
+    flushed to disk around the events passed to mark_event.
+    """
+
+    def __init__(
+        self,
+        frame_size,
+        fourcc="XVID",
+        queue_size=8,
+        event_mode=False,
+        pre_event_seconds=3.0,
+        post_event_seconds=3.0,
+    ):
+        """
+        frame_size: (width, height) of all recorded frames
+        queue_size: frames per stream waiting for the encoder before dropping
+        event_mode: only record the seconds around marked events
+        """
+        logger.info("Creating an instance of VideoRecorder")
+        self.frame_size = frame_size
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self.queue_size = queue_size
+        self.event_mode = event_mode
+        self.pre_event_seconds = pre_event_seconds
+        self.post_event_seconds = post_event_seconds
+        self.streams = {}
+
+        self._record_until = -math.inf
+        self._lock = threading.Lock()
+        # the per-stream buffer pools bound the number of queued frames
+        self._queue = queue.Queue()
+        self._encoder = threading.Thread(
+            target=self._encode, name="recorder", daemon=True
+        )
+        self._encoder.start()
+
+    def add_stream(self, name, filename, fps=20.0):
+        """
+        Open a video file that keeps at most fps frames per second
+        """
+        ring_length = math.ceil(self.pre_event_seconds * fps) if self.event_mode else 0
+        writer = cv2.VideoWriter(filename, self.fourcc, fps, self.frame_size)
+        self.streams[name] = _Stream(
+            name,
+            writer,
+            fps,
+            self.frame_size,
+            self.queue_size + ring_length + 1,
+            ring_length,
+        )
+        logger.debug(f"Recording {name} to {filename} at {fps} fps")
+
+    def write(self, name, frame, timestamp=None):
+        """
+        Record a frame of the named stream if it is due.
+        frame may be a LazyOverlay, which is only rendered when it is kept.
+        Returns True if the frame was kept, never blocks.
+        """
+        stream = self.streams[name]
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        if timestamp < stream.next_due:
+            return False
+        stream.next_due += stream.interval
+        if stream.next_due <= timestamp:
+            stream.next_due = timestamp + stream.interval
+
+        buffer = self._take_buffer(stream)
+        if buffer is None:
+            stream.dropped += 1
+            return False
+        if callable(frame):
+            frame(out=buffer)
+        else:
+            np.copyto(buffer, frame)
+
+        if self.event_mode and timestamp > self._record_until:
+            stream.ring.append(buffer)
+            if len(stream.ring) > stream.ring_length:
+                self._recycle(stream, stream.ring.popleft())
+            return True
+
+        self._enqueue(stream, buffer)
+        return True
+
+    def mark_event(self, reason, timestamp=None):
+        """
+        Keep the buffered seconds before this moment and keep recording
+        for post_event_seconds after it. No-op in continuous mode.
+        """
+        if not self.event_mode:
+            return
+        if timestamp is None:
+            timestamp = time.perf_counter()
+
+        if timestamp > self._record_until:
+            logger.info(f"Recording event: {reason}")
+        self._record_until = timestamp + self.post_event_seconds
+        for stream in self.streams.values():
+            while stream.ring:
+                self._enqueue(stream, stream.ring.popleft())
+
+    def close(self):
+        """
+        Encode whatever is still queued and release the video files
+        """
+        self._queue.put(None)
+        self._encoder.join()
+        for stream in self.streams.values():
+            stream.writer.release()
+            logger.info(
+                f"Recorded {stream.written} frames of {stream.name}, "
+                f"dropped {stream.dropped}"
+            )
+
+    def _take_buffer(self, stream):
+        with self._lock:
+            return stream.free.pop() if stream.free else None
+
+    def _recycle(self, stream, buffer):
+        with self._lock:
+            stream.free.append(buffer)
+
+    def _enqueue(self, stream, buffer):
+        self._queue.put((stream, buffer))
+
+    def _encode(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            stream, buffer = item
+            stream.writer.write(buffer)
+            stream.written += 1
+            self._recycle(stream, buffer)
@@ -0,0 +1,40 @@
+"""
+    Writers of per-frame records, shared by the replay and the telemetry sink
+"""
+import csv
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RecordWriter(object):
+    """
+    Writes records as JSON lines or, for a .csv path, as CSV with list
+    fields such as the detections JSON encoded
+    """
+
+    def __init__(self, path, fields=None):
+        """
+        fields: CSV columns, defaults to the keys of the first record
+        """
+        self.file = open(path, "w", newline="")
+        self.csv_path = path.endswith(".csv")
+        self.fields = fields
+        self.csv = None
+
+    def write(self, record):
+        if not self.csv_path:
+            self.file.write(json.dumps(record) + "\n")
+            return
+        if self.csv is None:
+            self.csv = csv.DictWriter(self.file, self.fields or list(record))
+            self.csv.writeheader()
+        row = {
+            key: json.dumps(value) if isinstance(value, (list, dict)) else value
+            for key, value in record.items()
+        }
+        self.csv.writerow(row)
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,332 @@
+"""
+Replay recorded drives through the lane follower and the object detector,
+without the car and as fast as the pipeline runs.
+
+    python -m src.pipeline.replay data/car_video*.avi --output replay.jsonl
+    python -m src.pipeline.replay data/car_video*.avi --follower cnn --detector
+
+Feed it the raw car_video*.avi recordings, not the overlay videos.
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from src.pipeline.records import RecordWriter
+from src.pipeline.startup import create_detector, create_lane_follower
+
+logger = logging.getLogger(__name__)
+
+
+class RecordingFrontWheels(object):
+    """
+    Stand-in for picar's front wheels, remembers the commanded angles
+    """
+
+    def __init__(self):
+        self.angle = 90
+        self.commands = []
+
+    def turn(self, angle):
+        self.angle = angle
+        self.commands.append(angle)
+
+
+class RecordingBackWheels(object):
+    """
+    Stand-in for picar's back wheels, remembers the commanded speeds
+    """
+
+    def __init__(self):
+        self._speed = 0
+        self.commands = []
+
+    @property
+    def speed(self):
+        return self._speed
+
+    @speed.setter
+    def speed(self, speed):
+        self._speed = speed
+        self.commands.append(speed)
+
+    def forward(self):
+        pass
+
+    def backward(self):
+        pass
+
+    def stop(self):
+        self.speed = 0
+
+
+class ReplayCar(object):
+    """
+    Stand-in for DriveBerry that records the wheel commands instead of
+    driving the servos
+    """
+
+    def __init__(self):
+        self.front_wheels = RecordingFrontWheels()
+        self.back_wheels = RecordingBackWheels()
+
+
+class VideoClock(object):
+    """
+    Time of the frame being replayed, derived from its index and the
+    recording's frame rate, so time based rules see recording time
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Replay(object):
+    """
+    Runs recorded frames through the same stages as DriveBerry.drive
+    """
+
+    def __init__(
+        self,
+        lane_follower=None,
+        detector=None,
+        car=None,
+        clock=None,
+        detection_every=1,
+        speed=35,
+    ):
+        """
+        lane_follower: AutoDrive or CNNDrive driving car
+        detector: DetectionModel driving car, optional
+        car: the ReplayCar both of them command
+        clock: the VideoClock the detector's rules run on
+        detection_every: run the detector on every Nth frame only
+        speed: speed the car starts every video at, as in DriveBerry.drive
+        """
+        self.lane_follower = lane_follower
+        self.detector = detector
+        self.car = car or ReplayCar()
+        self.clock = clock or VideoClock()
+        self.detection_every = detection_every
+        self.speed = speed
+
+    def reset(self):
+        """
+        Start a new recording: rewind the clock, straighten the wheels and
+        forget the lane lines, tracked objects and stop of the previous one
+        """
+        self.clock.now = 0.0
+        self.car.front_wheels.angle = 90
+        for stage in (self.lane_follower, self.detector):
+            if stage is not None:
+                stage.reset()
+
+    def run(self, video_path, max_frames=None):
+        """
+        Yield one record per frame: steering angle, speed, detections and
+        the time every stage took. Every video starts from a reset, so a
+        Replay can be reused for several of them.
+        """
+        cap = cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 20.0
+        index = 0
+        self.reset()
+        self.car.back_wheels.speed = self.speed
+        try:
+            while cap.isOpened() and (max_frames is None or index < max_frames):
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                self.clock.now = index / fps
+                yield self.process(video_path, index, frame)
+                index += 1
+        finally:
+            cap.release()
+
+    def process(self, video_path, index, frame):
+        """
+        Run one frame through the detector and lane follower
+        """
+        record = {"video": video_path, "frame": index, "time": self.clock.now}
+
+        detections = None
+        detect_ms = None
+        if self.detector is not None and index % self.detection_every == 0:
+            start = time.perf_counter()
+            objects, _ = self.detector.detect_objects(frame)
+            detect_ms = (time.perf_counter() - start) * 1000
+            self.detector.control_car(objects, self.clock.now)
+            labels = self.detector.labels
+            detections = [
+                {
+                    "label": labels[obj.id],
+                    "score": round(float(obj.score), 3),
+                    "bbox": [int(v) for v in obj.bbox],
+                }
+                for obj in objects
+            ]
+
+        lane_ms = None
+        if self.lane_follower is not None:
+            start = time.perf_counter()
+            self.lane_follower.follow_lane(frame)
+            lane_ms = (time.perf_counter() - start) * 1000
+
+        if self.detector is not None:
+            self.detector.tick()
+
+        lane_lines = getattr(self.lane_follower, "lane_lines", None)
+        record.update(
+            steering_angle=int(self.car.front_wheels.angle),
+            speed=int(self.car.back_wheels.speed),
+            lane_lines=None if lane_lines is None else len(lane_lines),
+            detections=detections,
+            lane_ms=lane_ms,
+            detect_ms=detect_ms,
+        )
+        return record
+
+
+# CSV columns of the replay records
+RECORD_FIELDS = [
+    "video",
+    "frame",
+    "time",
+    "steering_angle",
+    "speed",
+    "lane_lines",
+    "detections",
+    "lane_ms",
+    "detect_ms",
+]
+
+# record fields holding stage timings, summarized at the end of a replay
+STAGE_FIELDS = ["lane_ms", "detect_ms"]
+
+
+class StageStats(object):
+    """
+    Running mean and maximum of a stage's timings; the 95th percentile is
+    taken over a uniform sample of at most sample_size of them, so it is
+    exact for shorter replays and memory stays bounded for longer ones
+    """
+
+    def __init__(self, sample_size=10000, seed=0):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.sample = np.empty(sample_size)
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, value):
+        if self.count < len(self.sample):
+            self.sample[self.count] = value
+        else:
+            # reservoir sampling: every value so far is kept with equal odds
+            slot = self.rng.integers(self.count + 1)
+            if slot < len(self.sample):
+                self.sample[slot] = value
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def summary(self):
+        sample = self.sample[: min(self.count, len(self.sample))]
+        return {
+            "mean": self.total / self.count,
+            "p95": float(np.percentile(sample, 95)),
+            "max": self.max,
+        }
+
+
+class ReplaySummary(object):
+    """
+    Frame rate and per stage timings of a replay, updated record by record
+    so the records themselves need not be kept
+    """
+
+    def __init__(self, **kwargs):
+        """
+        kwargs: StageStats options, e.g. sample_size
+        """
+        self.frames = 0
+        self.stages = {stage: StageStats(**kwargs) for stage in STAGE_FIELDS}
+
+    def add(self, record):
+        self.frames += 1
+        for stage, stats in self.stages.items():
+            if record[stage] is not None:
+                stats.add(record[stage])
+
+    def summary(self, elapsed):
+        summary = {"frames": self.frames, "fps": self.frames / max(elapsed, 1e-9)}
+        for stage, stats in self.stages.items():
+            if stats.count:
+                summary[stage] = stats.summary()
+        return summary
+
+
+def create_replay(follower="opencv", detector=False, detection_every=1, **kwargs):
+    """
+    A Replay driving a ReplayCar with the selected lane follower and,
+    optionally, the object detector
+    """
+    car = ReplayCar()
+    clock = VideoClock()
+    lane_follower = None
+    if follower != "none":
+        lane_follower = create_lane_follower(
+            follower, car, render_overlays=False, **kwargs
+        )
+
+    object_detector = None
+    if detector:
+        object_detector = create_detector("edgetpu", car, clock=clock)
+
+    return Replay(lane_follower, object_detector, car, clock, detection_every)
+
+
+def main(argv=None):
+    """
+    Replay videos and write the per frame records
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("videos", nargs="+", help="recorded car_video*.avi files")
+    parser.add_argument(
+        "--follower", choices=["opencv", "cnn", "none"], default="opencv"
+    )
+    parser.add_argument("--detector", action="store_true", help="run DetectionModel")
+    parser.add_argument("--detection-every", type=int, default=1)
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--output", default=None, help=".jsonl or .csv records")
+    args = parser.parse_args(argv)
+
+    # one replay for all videos, so the models are loaded only once
+    replay = create_replay(args.follower, args.detector, args.detection_every)
+    writer = RecordWriter(args.output, RECORD_FIELDS) if args.output else None
+    summary = ReplaySummary()
+    start = time.perf_counter()
+    try:
+        for video in args.videos:
+            for record in replay.run(video, args.max_frames):
+                summary.add(record)
+                if writer is not None:
+                    writer.write(record)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    logger.info(f"Replay summary: {summary.summary(time.perf_counter() - start)}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
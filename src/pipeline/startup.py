@@ -0,0 +1,86 @@
+"""
+    Lane follower and detector selection by name, importing only what the
+    chosen ones need, and timing of the startup
+"""
+import importlib
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# name -> (module, class) of the selectable stages
+LANE_FOLLOWERS = {
+    "opencv": ("src.opencv_auto.driver", "AutoDrive"),
+    "cnn": ("src.cnn_driving.driver", "CNNDrive"),
+}
+DETECTORS = {
+    "edgetpu": ("src.object_detection.model", "DetectionModel"),
+}
+
+
+class StartupTimer(object):
+    """
+    Wall time of the named steps of a startup, in the order they ran
+    """
+
+    def __init__(self):
+        self.steps = {}
+
+    @contextmanager
+    def step(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    def report(self):
+        """
+        Log every step and the total, returns the steps in milliseconds
+        """
+        for name, ms in self.steps.items():
+            logger.info(f"Startup: {name:<28}{ms:>9.1f} ms")
+        logger.info(f"Startup: {'total':<28}{sum(self.steps.values()):>9.1f} ms")
+        return dict(self.steps)
+
+
+def load_class(kinds, name, timer=None):
+    """
+    Import the class registered under name, timed as "import name"
+    """
+    if name not in kinds:
+        raise ValueError(f"Unknown stage {name}, use one of {list(kinds)}")
+    module, cls = kinds[name]
+    with (timer or StartupTimer()).step(f"import {name}"):
+        return getattr(importlib.import_module(module), cls)
+
+
+def create_lane_follower(name, car=None, render_overlays=True, timer=None, **options):
+    """
+    Lane follower by name: "opencv" for AutoDrive or "cnn" for CNNDrive;
+    options go to its constructor, e.g. {"backend": "tflite"}
+    """
+    cls = load_class(LANE_FOLLOWERS, name, timer)
+    with (timer or StartupTimer()).step(f"create {name}"):
+        return cls(car, render_overlays=render_overlays, **options)
+
+
+def create_detector(name, car=None, timer=None, **options):
+    """
+    Object detector by name, "edgetpu" for DetectionModel; None for none
+    """
+    if name is None:
+        return None
+    cls = load_class(DETECTORS, name, timer)
+    with (timer or StartupTimer()).step(f"create {name}"):
+        return cls(car, **options)
+
+
+def warm_up(name, stage, frame, timer=None):
+    """
+    Run a stage once on a dummy frame, so its model is loaded and its first,
+    slow inference is done before the wheels turn
+    """
+    with (timer or StartupTimer()).step(f"warm up {name}"):
+        stage(frame)
@@ -0,0 +1,259 @@
+"""
+    Per-frame stage timings of the drive loop, their rolling percentiles and
+    a frame budget watchdog
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from src.pipeline.records import RecordWriter
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("capture", "detection", "lane", "actuation", "recording")
+
+
+class FrameBudget(object):
+    """
+    Watchdog over the frame latency. After degrade_after consecutive frames
+    over budget it degrades one level, after recover_after frames within
+    budget it recovers one: level 1 skips the overlays, level 2 also skips
+    object detection.
+    """
+
+    SKIP_OVERLAYS = 1
+    SKIP_DETECTION = 2
+
+    def __init__(self, budget_ms=None, degrade_after=3, recover_after=30):
+        """
+        budget_ms: latency budget of a frame, None only counts and never degrades
+        """
+        self.budget_ms = budget_ms
+        self.degrade_after = degrade_after
+        self.recover_after = recover_after
+        self.level = 0
+        self.over_budget = 0
+        self._over = 0
+        self._within = 0
+
+    @property
+    def skip_overlays(self):
+        return self.level >= self.SKIP_OVERLAYS
+
+    @property
+    def skip_detection(self):
+        return self.level >= self.SKIP_DETECTION
+
+    def check(self, total_ms, timings):
+        """
+        Account a finished frame, returns True if it was over budget
+        """
+        if self.budget_ms is None or total_ms <= self.budget_ms:
+            self._over = 0
+            self._within += 1
+            if self.level > 0 and self._within >= self.recover_after:
+                self._set_level(self.level - 1)
+            return False
+
+        self.over_budget += 1
+        self._within = 0
+        self._over += 1
+        slowest = max(timings, key=timings.get)
+        logger.warning(
+            f"Frame took {total_ms:.1f} ms, budget {self.budget_ms} ms, "
+            f"slowest stage {slowest} {timings[slowest]:.1f} ms"
+        )
+        if self.level < self.SKIP_DETECTION and self._over >= self.degrade_after:
+            self._set_level(self.level + 1)
+        return True
+
+    def _set_level(self, level):
+        logger.warning(f"Frame budget watchdog: level {self.level} -> {level}")
+        self.level = level
+        self._over = 0
+        self._within = 0
+
+
+class Telemetry(object):
+    """
+    Collects the time every stage of a frame takes. The loop calls
+    begin_frame, then mark(stage) after each stage and end_frame; time spent
+    in add() calls, e.g. wheel commands inside the lane follower, is booked
+    to its own stage instead of the surrounding one.
+    """
+
+    def __init__(
+        self, window=300, budget_ms=None, sink_path=None, startup=None, **watchdog
+    ):
+        """
+        window: frames the rolling percentiles are taken over
+        budget_ms: frame budget of the watchdog, see FrameBudget
+        sink_path: .jsonl or .csv file every frame's timings are written to
+        startup: milliseconds of the startup steps, served with the snapshot
+        """
+        self.watchdog = FrameBudget(budget_ms, **watchdog)
+        self.startup = startup
+        self.frames = 0
+        self.timings = {}
+        self._history = {stage: deque(maxlen=window) for stage in STAGES + ("total",)}
+        self._lock = threading.Lock()
+        self._start = None
+        self._last = None
+        self._nested = 0.0
+        self._server = None
+
+        self.sink = None
+        if sink_path is not None:
+            fields = ["frame", "time"] + [f"{s}_ms" for s in STAGES]
+            self.sink = RecordWriter(sink_path, fields + ["total_ms", "level"])
+
+    def begin_frame(self):
+        self._start = self._last = time.perf_counter()
+        self._nested = 0.0
+        self.timings = {}
+
+    def mark(self, stage):
+        """
+        Book the time since the previous mark to stage
+        """
+        now = time.perf_counter()
+        elapsed = now - self._last - self._nested
+        self.timings[stage] = self.timings.get(stage, 0.0) + elapsed * 1000
+        self._last = now
+        self._nested = 0.0
+
+    def add(self, stage, seconds):
+        """
+        Book time measured elsewhere to stage
+        """
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds * 1000
+        self._nested += seconds
+
+    def end_frame(self, index):
+        """
+        Finish the frame: update the statistics, write it to the sink and
+        let the watchdog check it. Returns True if it was over budget.
+        """
+        total_ms = (time.perf_counter() - self._start) * 1000
+        return self.record(index, self.timings, total_ms, self._start)
+
+    def record(self, index, timings, total_ms, start):
+        """
+        Account a frame whose stages were timed elsewhere, e.g. by the
+        workers of the pipelined loop, as end_frame does.
+        timings: milliseconds per stage
+        total_ms: latency of the frame
+        start: perf_counter time the frame started at
+        """
+        with self._lock:
+            self.frames += 1
+            for stage in STAGES:
+                self._history[stage].append(timings.get(stage, 0.0))
+            self._history["total"].append(total_ms)
+        over = self.watchdog.check(total_ms, timings)
+
+        if self.sink is not None:
+            record = {"frame": index, "time": start}
+            for stage in STAGES:
+                record[f"{stage}_ms"] = round(timings.get(stage, 0.0), 3)
+            record.update(total_ms=round(total_ms, 3), level=self.watchdog.level)
+            self.sink.write(record)
+        return over
+
+    def snapshot(self):
+        """
+        p50/p95/p99 in milliseconds of every stage over the window
+        """
+        with self._lock:
+            history = {stage: list(values) for stage, values in self._history.items()}
+            frames = self.frames
+        stages = {}
+        for stage, values in history.items():
+            if values:
+                p50, p95, p99 = np.percentile(values, [50, 95, 99])
+                stages[stage] = {
+                    "p50_ms": round(float(p50), 2),
+                    "p95_ms": round(float(p95), 2),
+                    "p99_ms": round(float(p99), 2),
+                }
+        return {
+            "frames": frames,
+            "over_budget": self.watchdog.over_budget,
+            "budget_ms": self.watchdog.budget_ms,
+            "level": self.watchdog.level,
+            "stages": stages,
+            "startup": self.startup,
+        }
+
+    def serve(self, port=8765, host="127.0.0.1"):
+        """
+        Answer every HTTP GET on host:port with the current snapshot as JSON,
+        e.g. curl localhost:8765
+        """
+        telemetry = self
+
+        class SnapshotHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(telemetry.snapshot()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self._server = ThreadingHTTPServer((host, port), SnapshotHandler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(
+            target=self._server.serve_forever, name="telemetry", daemon=True
+        )
+        thread.start()
+        logger.info(f"Serving telemetry on http://{host}:{self._server.server_port}")
+        return self._server.server_port
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+        logger.info(f"Telemetry: {self.snapshot()}")
+
+
+class TimedWheels(object):
+    """
+    Wraps picar wheels so the time spent commanding them is booked to the
+    actuation stage, wherever in the loop the command is sent
+    """
+
+    def __init__(self, wheels, telemetry, stage="actuation"):
+        self._wheels = wheels
+        self._telemetry = telemetry
+        self._stage = stage
+
+    def turn(self, angle):
+        start = time.perf_counter()
+        self._wheels.turn(angle)
+        self._telemetry.add(self._stage, time.perf_counter() - start)
+
+    @property
+    def speed(self):
+        return self._wheels.speed
+
+    @speed.setter
+    def speed(self, speed):
+        start = time.perf_counter()
+        self._wheels.speed = speed
+        self._telemetry.add(self._stage, time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self._wheels, name)
@@ -0,0 +1,208 @@
+"""
+    Thread primitives used by the pipelined drive loop
+"""
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+# a captured frame and the moment it left the camera
+FramePacket = namedtuple("FramePacket", ["index", "timestamp", "image"])
+
+# the output of a stage for the frame with the given index/timestamp, and
+# when the stage started and finished working on it
+StageResult = namedtuple(
+    "StageResult", ["index", "timestamp", "value", "started", "finished"]
+)
+
+
+class LatestValue(object):
+    """
+    Thread-safe slot that only ever holds the newest published value
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._value = None
+        self._seq = 0
+
+    def put(self, value):
+        """
+        Replace the current value and wake up any waiting consumer
+        """
+        with self._cond:
+            self._value = value
+            self._seq += 1
+            self._cond.notify_all()
+
+    def get(self):
+        """
+        Return (sequence number, value) of the newest value
+        """
+        with self._cond:
+            return self._seq, self._value
+
+    def wait_newer(self, seq, timeout=None):
+        """
+        Wait until a value newer than seq is published.
+        Returns (sequence number, value), unchanged if the wait timed out.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > seq, timeout)
+            return self._seq, self._value
+
+
+class DropOldestQueue(object):
+    """
+    Bounded queue that discards the oldest item instead of blocking the producer
+    """
+
+    def __init__(self, maxsize=1):
+        self._items = deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        """
+        Append an item, dropping the stalest one if the queue is full
+        """
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+        Pop the oldest item, or return None if nothing arrived within timeout
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: len(self._items) > 0, timeout):
+                return None
+            return self._items.popleft()
+
+
+class StageWorker(threading.Thread):
+    """
+    Runs one pipeline stage on the newest frames of a queue in its own thread
+    and publishes every result into a LatestValue slot.
+    The stage can be rate limited to every Nth frame and/or a maximum rate;
+    it keeps running averages of its achieved rate and of the latency from
+    capture to published result.
+    """
+
+    def __init__(
+        self,
+        name,
+        process,
+        frames,
+        every_nth=1,
+        max_rate=None,
+        poll_interval=0.1,
+        smoothing=0.1,
+    ):
+        """
+        name: thread name, used in the logs
+        process: callable taking a frame and returning the stage result
+        frames: DropOldestQueue of FramePacket, usually from CameraStream.subscribe
+        every_nth: only process every Nth frame this worker receives
+        max_rate: maximum number of frames processed per second
+        smoothing: weight of the newest sample in the running averages
+        """
+        super().__init__(name=name, daemon=True)
+        self.process = process
+        self.frames = frames
+        self.every_nth = every_nth
+        self.min_interval = 1.0 / max_rate if max_rate else 0.0
+        self.poll_interval = poll_interval
+        self.smoothing = smoothing
+        self.results = LatestValue()
+        # while paused, received frames are dropped without processing
+        self.paused = False
+        self.received = 0
+        self.processed = 0
+        self.rate = 0.0
+        self.latency = 0.0
+        self._last_done = None
+        self._stopping = threading.Event()
+
+    def run(self):
+        logger.info(f"Starting {self.name} worker")
+        next_due = 0.0
+        while not self._stopping.is_set():
+            # sleep off the rate limit first, so we then take the newest frame
+            delay = next_due - time.perf_counter()
+            if delay > 0 and self._stopping.wait(delay):
+                break
+
+            packet = self.frames.get(timeout=self.poll_interval)
+            if packet is None:
+                continue
+            # count what arrives, not the camera's index: frames dropped by
+            # the queue would otherwise skip the multiples of every_nth
+            self.received += 1
+            if self.paused or (self.received - 1) % self.every_nth != 0:
+                continue
+
+            started = time.perf_counter()
+            next_due = started + self.min_interval
+            try:
+                value = self.process(packet.image)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception(f"{self.name} worker failed on frame {packet.index}")
+                continue
+
+            finished = time.perf_counter()
+            self.results.put(
+                StageResult(packet.index, packet.timestamp, value, started, finished)
+            )
+            self._update_stats(packet.timestamp)
+
+        logger.info(
+            f"{self.name} worker stopped after {self.processed} frames, "
+            f"{self.frames.dropped} stale frames dropped; {self.stats()}"
+        )
+
+    def _update_stats(self, captured):
+        now = time.perf_counter()
+        self.processed += 1
+        if self._last_done is None:
+            self.latency = now - captured
+        else:
+            rate = 1.0 / max(now - self._last_done, 1e-9)
+            if self.processed == 2:
+                self.rate = rate
+            else:
+                self.rate += self.smoothing * (rate - self.rate)
+            self.latency += self.smoothing * ((now - captured) - self.latency)
+        self._last_done = now
+
+    def stats(self):
+        """
+        Achieved rate in Hz and capture-to-result latency in milliseconds
+        """
+        return {
+            "processed": self.processed,
+            "dropped": self.frames.dropped,
+            "rate_hz": round(self.rate, 1),
+            "latency_ms": round(self.latency * 1000, 1),
+        }
+
+    def stop(self):
+        """
+        Ask the worker to exit after the current frame
+        """
+        self._stopping.set()
+
+
+def stop_all(threads, timeout=1.0):
+    """
+    Stop and join a list of pipeline threads
+    """
+    for thread in threads:
+        thread.stop()
+    deadline = time.perf_counter() + timeout
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.perf_counter()))
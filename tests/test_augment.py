@@ -0,0 +1,47 @@
+import numpy as np
+
+from src.cnn_training.augment import BatchAugmenter
+
+
+def random_batch(count=6, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, (count, 40, 64, 3), dtype=np.uint8)
+
+
+def test_flip_mirrors_the_angle():
+    images = random_batch()
+    angles = np.array([30, 60, 90, 100, 135, 150])
+    # every augmentation drawn, all but the flip without effect
+    augment = BatchAugmenter(1.0, pan=0.0, zoom=(1, 1), brightness=(1, 1), blur=(1, 1))
+    flipped, new_angles = augment(images.copy(), angles)
+    np.testing.assert_array_equal(flipped, images[:, :, ::-1])
+    np.testing.assert_array_equal(new_angles, 180 - angles)
+
+
+def test_nothing_changes_with_p_zero():
+    images = random_batch()
+    augmented, angles = BatchAugmenter(p=0.0)(images.copy(), np.full(6, 70))
+    np.testing.assert_array_equal(augmented, images)
+    np.testing.assert_array_equal(angles, 70)
+
+
+def test_same_seed_same_batch():
+    images = random_batch()
+    first = BatchAugmenter(seed=3)(images.copy(), np.arange(6))
+    second = BatchAugmenter()(images.copy(), np.arange(6), np.random.default_rng(3))
+    np.testing.assert_array_equal(first[0], second[0])
+    np.testing.assert_array_equal(first[1], second[1])
+
+
+def test_warp_pans_before_zooming():
+    images = np.zeros((1, 100, 200, 3), np.uint8)
+    images[0, 59:62, 139:142] = 255
+    shifts = np.array([[10.0, -5.0]])
+    BatchAugmenter().warp(images, [0], shifts, np.array([1.2]))
+
+    ys, xs = np.nonzero(images[0, :, :, 0])
+    weights = images[0, ys, xs, 0].astype(float)
+    center = np.array([100.0, 50.0])
+    expected = 1.2 * (np.array([140.0, 60.0]) + shifts[0] - center) + center
+    found = [np.average(xs, weights=weights), np.average(ys, weights=weights)]
+    np.testing.assert_allclose(found, expected, atol=0.5)
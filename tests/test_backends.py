@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from src.cnn_driving.backends import TFLiteBackend  # noqa: E402
+from src.cnn_driving.convert import STEERING_TOLERANCE  # noqa: E402
+from src.cnn_driving.convert import compare_backends, convert  # noqa: E402
+
+
+class FunctionBackend(object):
+    """
+    The float model as a backend, without KerasBackend's model loading
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, x):
+        return np.asarray(self.model(x))
+
+
+@pytest.fixture(scope="module")
+def model():
+    """
+    A small model of the lane follower's shape, steering around 90 degrees
+    """
+    tf.keras.utils.set_random_seed(0)
+    inputs = tf.keras.Input(shape=(66, 200, 3))
+    x = tf.keras.layers.Conv2D(8, 5, strides=4, activation="elu")(inputs)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    x = tf.keras.layers.Dense(1)(x)
+    outputs = tf.keras.layers.Rescaling(10.0, offset=90.0)(x)
+    return tf.keras.Model(inputs, outputs)
+
+
+@pytest.fixture(scope="module")
+def samples():
+    rng = np.random.default_rng(0)
+    return list(rng.random((40, 66, 200, 3), dtype=np.float32))
+
+
+@pytest.mark.parametrize("quantization", ["float32", "float16", "int8"])
+def test_converted_model_within_tolerance(model, samples, tmp_path, quantization):
+    path = str(tmp_path / f"model_{quantization}.tflite")
+    convert(model, quantization, samples[::2], path)
+    backend = TFLiteBackend(path)
+    differences = compare_backends(FunctionBackend(model), backend, samples[1::2])
+    assert differences.max() <= STEERING_TOLERANCE[quantization]
+    assert backend.raw_pixel_input == (quantization == "int8")
+
+
+def test_batches_match_single_frames(model, samples, tmp_path):
+    path = str(tmp_path / "model_int8.tflite")
+    convert(model, "int8", samples, path)
+    backend = TFLiteBackend(path)
+    x = np.stack(samples[:7])
+    single = np.concatenate([backend.predict(x[i : i + 1]) for i in range(len(x))])
+    batch = backend.predict(x)
+    assert backend.input_shape[0] == 7
+    np.testing.assert_allclose(batch, single, atol=1e-4)
+
+    # raw pixels skip the quantization of the normalized input
+    pixels = np.rint(x * 255).astype(np.uint8)
+    np.testing.assert_allclose(backend.predict(pixels), batch, atol=1e-4)
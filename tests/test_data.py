@@ -0,0 +1,76 @@
+import json
+
+import numpy as np
+import pytest
+
+from src.cnn_training.augment import BatchAugmenter
+from src.cnn_training.data import BatchLoader, ShardDataset, split_by_shard
+from src.cnn_training.shards import MANIFEST
+
+
+def write_shards(shard_dir, counts, shape=(24, 32, 3)):
+    """
+    Crop layout shards whose frames are filled with their dataset index
+    """
+    shards = []
+    start = 0
+    for number, count in enumerate(counts):
+        name = f"video_{number:06d}"
+        indices = np.arange(start, start + count)
+        images = np.broadcast_to(indices[:, None, None, None] % 256, (count,) + shape)
+        np.save(shard_dir / f"{name}.npy", images.astype(np.uint8))
+        np.save(shard_dir / f"{name}_angles.npy", (indices % 180).astype(np.int16))
+        shards.append(
+            {
+                "images": f"{name}.npy",
+                "angles": f"{name}_angles.npy",
+                "video": None,
+                "start": start,
+                "count": count,
+            }
+        )
+        start += count
+    manifest = {"layout": "crop", "warmup": 0, "frames": start, "shards": shards}
+    with open(shard_dir / MANIFEST, "w") as file:
+        json.dump(manifest, file)
+    return str(shard_dir)
+
+
+def test_splits_share_no_shard(tmp_path):
+    dataset = ShardDataset(write_shards(tmp_path, [5, 7, 3, 9, 4, 6]))
+    train, valid = split_by_shard(dataset, validation=0.3, seed=1)
+    assert len(train) + len(valid) == len(dataset)
+    assert sorted(np.concatenate([train, valid])) == list(range(len(dataset)))
+    train_shards = set(dataset.shard_of(train).tolist())
+    valid_shards = set(dataset.shard_of(valid).tolist())
+    assert train_shards.isdisjoint(valid_shards)
+    assert len(valid_shards) == 2
+    again = split_by_shard(dataset, validation=0.3, seed=1)
+    np.testing.assert_array_equal(again[1], valid)
+
+
+def test_validation_batches_keep_the_order(tmp_path):
+    dataset = ShardDataset(write_shards(tmp_path, [5, 7]))
+    _, valid = split_by_shard(dataset)
+    loader = BatchLoader(dataset, valid, batch_size=4, training=False)
+    batches = list(loader.batches(workers=2))
+    assert loader.steps == len(batches) == -(-len(valid) // 4)
+    x, y = batches[0]
+    assert x.shape == (4, 66, 200, 3) and x.dtype == np.float32
+    np.testing.assert_array_equal(np.concatenate([y for _, y in batches]), valid)
+
+
+@pytest.mark.parametrize("training", [True, False])
+def test_tf_dataset_matches_the_batches(tmp_path, training):
+    pytest.importorskip("tensorflow")
+    dataset = ShardDataset(write_shards(tmp_path, [5, 7, 6]))
+    augment = BatchAugmenter() if training else None
+    loader = BatchLoader(
+        dataset, batch_size=4, training=training, augment=augment, seed=7
+    )
+    expected = list(loader.batches(epochs=2, workers=2))
+    batches = list(loader.tf_dataset().take(len(expected)).as_numpy_iterator())
+    assert len(batches) == 2 * loader.steps
+    for (x, y), (tf_x, tf_y) in zip(expected, batches):
+        np.testing.assert_array_equal(tf_x, x)
+        np.testing.assert_array_equal(tf_y, y)
@@ -0,0 +1,95 @@
+import numpy as np
+
+from src.opencv_auto.color_lut import ColorMaskLUT
+from src.opencv_auto.frame_processing import average_slope_intercept, hsv_mask
+from src.opencv_auto.utility import make_points
+
+FRAME = np.zeros((480, 640, 3), np.uint8)
+
+
+def reference_average_slope_intercept(frame, line_segments):
+    """
+    The per segment np.polyfit implementation average_slope_intercept replaced
+    """
+    _, width, _ = frame.shape
+    left_fit, right_fit = [], []
+    for line_segment in line_segments:
+        for x1, y1, x2, y2 in line_segment:
+            if x1 == x2:
+                continue
+            slope, intercept = np.polyfit((x1, x2), (y1, y2), 1)
+            if slope < 0:
+                if x1 < width * 2 / 3 and x2 < width * 2 / 3:
+                    left_fit.append((slope, intercept))
+            elif x1 > width / 3 and x2 > width / 3:
+                right_fit.append((slope, intercept))
+    lane_lines = []
+    if left_fit:
+        lane_lines.append(make_points(frame, np.average(left_fit, axis=0)))
+    if right_fit:
+        lane_lines.append(make_points(frame, np.average(right_fit, axis=0)))
+    return lane_lines
+
+
+def random_segments(rng, count):
+    segments = rng.integers(0, 480, (count, 1, 4))
+    segments[..., 0::2] = rng.integers(0, 640, (count, 1, 2))
+    # horizontal segments are decided differently on purpose, see below
+    flat = segments[..., 1] == segments[..., 3]
+    segments[..., 3][flat] += 1
+    return segments
+
+
+def test_lane_segments_match_reference():
+    segments = np.array(
+        [
+            [[100, 480, 250, 240]],
+            [[110, 470, 240, 260]],
+            [[540, 480, 400, 240]],
+            [[530, 460, 410, 250]],
+        ]
+    )
+    assert average_slope_intercept(FRAME, segments) == (
+        reference_average_slope_intercept(FRAME, segments)
+    )
+
+
+def test_random_segments_within_a_pixel_of_reference():
+    rng = np.random.default_rng(0)
+    differing = 0
+    for _ in range(200):
+        segments = random_segments(rng, rng.integers(1, 300))
+        lines = np.array(average_slope_intercept(FRAME, segments))
+        expected = np.array(reference_average_slope_intercept(FRAME, segments))
+        assert lines.shape == expected.shape
+        assert np.abs(lines - expected).max(initial=0) <= 1
+        differing += not np.array_equal(lines, expected)
+    # the closed form fit rounds differently from np.polyfit in rare cases
+    assert differing <= 5
+
+
+def test_horizontal_segments_count_as_right():
+    # slope 0.9 and intercept -60, averaged with slope 0 and intercept 300
+    right = np.array([[[400, 300, 600, 480]]])
+    flat = np.array([[[300, 300, 500, 300]]])
+    lines = average_slope_intercept(FRAME, np.concatenate([right, flat]))
+    assert lines == [make_points(FRAME, (0.45, 120.0))]
+
+
+def test_only_horizontal_segments_make_no_line():
+    flat = np.array([[[300, 300, 500, 300]], [[350, 400, 600, 400]]])
+    assert average_slope_intercept(FRAME, flat) == []
+
+
+def test_vertical_segments_are_skipped():
+    assert average_slope_intercept(FRAME, np.array([[[300, 480, 300, 240]]])) == []
+    assert average_slope_intercept(FRAME, None) == []
+
+
+def test_color_lut_matches_hsv_mask(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    frame = np.random.default_rng(0).integers(0, 256, (48, 64, 3), np.uint8)
+    lut = ColorMaskLUT()
+    np.testing.assert_array_equal(lut(frame), hsv_mask(frame))
+    # the disk cache is opt-in
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from src.cnn_training.index import AngleIndex, hamming, perceptual_hashes
+from src.cnn_training.index import prune_duplicates
+
+
+def gradient_frames(count, seed=0):
+    """
+    Frames whose brightness rises left to right, with a little noise
+    """
+    rng = np.random.default_rng(seed)
+    ramp = np.linspace(0, 200, 160, dtype=np.float32)
+    frames = np.broadcast_to(ramp[None, None, :, None], (count, 120, 160, 3))
+    noise = rng.integers(0, 4, (count, 120, 160, 3))
+    return (frames + noise).astype(np.uint8)
+
+
+def test_hashes_are_deterministic():
+    frames = gradient_frames(5)
+    first = perceptual_hashes(frames, chunk=2)
+    second = perceptual_hashes(frames.copy(), chunk=3)
+    np.testing.assert_array_equal(first, second)
+    np.testing.assert_array_equal(first, perceptual_hashes(frames[:1]).repeat(5, 0))
+
+
+def test_hashes_follow_the_gradient():
+    rising = perceptual_hashes(gradient_frames(1))
+    falling = perceptual_hashes(gradient_frames(1)[:, :, ::-1].copy())
+    assert (rising == 255).all()
+    assert (falling == 0).all()
+    assert hamming(rising[0], falling[0]) == 64
+
+
+def test_different_frames_are_not_pruned():
+    frames = np.concatenate([gradient_frames(3), gradient_frames(3)[:, :, ::-1]])
+    hashes = perceptual_hashes(frames)
+    angles = np.full(len(frames), 90)
+    np.testing.assert_array_equal(prune_duplicates(hashes, angles), [0, 3])
+
+
+def test_duplicates_with_another_angle_are_kept():
+    hashes = perceptual_hashes(gradient_frames(3))
+    kept = prune_duplicates(hashes, np.array([90, 90, 100]))
+    np.testing.assert_array_equal(kept, [0, 2])
+
+
+def test_sample_draws_from_every_bin():
+    angles = np.array([45] * 10 + [90] * 100 + [135] * 10)
+    index = AngleIndex(np.arange(120) + 1000, angles, [0, 60, 120, 180], per_bin=10)
+    assert index.epoch_size == 30
+    samples = index.sample(3000, np.random.default_rng(0))
+    counts = np.bincount(np.digitize(angles[samples - 1000], [60, 120]))
+    assert counts.min() > 900
+
+
+def test_sample_from_an_empty_index_raises():
+    index = AngleIndex([], [], [0, 90, 180])
+    with pytest.raises(ValueError):
+        index.sample(4)
@@ -0,0 +1,56 @@
+import threading
+
+import numpy as np
+
+from src.opencv_auto.utility import OverlayCanvas, draw_lines
+
+FRAME = np.full((120, 160, 3), 50, np.uint8)
+
+
+def render(canvas, lines, between=None):
+    """
+    Draw and blend lines, calling between after drawing
+    """
+    draw_lines(canvas.clear(FRAME), lines)
+    if between is not None:
+        between()
+    return canvas.blend(FRAME).copy()
+
+
+def test_threads_do_not_share_the_line_image():
+    canvas = OverlayCanvas()
+    left = [[[10, 120, 40, 60]]]
+    right = [[[150, 120, 120, 60]]]
+    expected_left = render(OverlayCanvas(), left)
+    expected_right = render(OverlayCanvas(), right)
+
+    # the second thread clears and draws while the first one has drawn its
+    # lines but not blended them yet
+    drawn, done = threading.Event(), threading.Event()
+    results = {}
+
+    def first():
+        results["left"] = render(canvas, left, lambda: (drawn.set(), done.wait(5)))
+
+    def second():
+        drawn.wait(5)
+        results["right"] = render(canvas, right)
+        done.set()
+
+    threads = [threading.Thread(target=first), threading.Thread(target=second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    np.testing.assert_array_equal(results["left"], expected_left)
+    np.testing.assert_array_equal(results["right"], expected_right)
+
+
+def test_outputs_rotate():
+    canvas = OverlayCanvas(num_outputs=2)
+    canvas.clear(FRAME)
+    first = canvas.blend(FRAME)
+    second = canvas.blend(FRAME)
+    third = canvas.blend(FRAME)
+    assert first is not second
+    assert first is third
@@ -0,0 +1,114 @@
+import time
+
+import numpy as np
+import pytest
+
+from src.pipeline.processes import RemoteStage, SharedFrameRing
+
+
+def checksum_stage(offset=0):
+    """
+    Child side of a test stage: frame -> sum of its pixels plus offset
+    """
+
+    def run(frame):
+        if frame[0, 0, 0] == 255:
+            raise ValueError("bad frame")
+        return int(frame.sum(dtype=np.int64)) + offset
+
+    return run
+
+
+def slow_stage(delay=0.4):
+    """
+    Child side of a test stage that is slow on frames starting with 1, and
+    sums the frame only after the delay, so an overwrite would show
+    """
+
+    def run(frame):
+        if frame[0, 0, 0] == 1:
+            time.sleep(delay)
+        return int(frame.sum(dtype=np.int64))
+
+    return run
+
+
+def test_ring_round_trip():
+    ring = SharedFrameRing((4, 6, 3), slots=2)
+    attached = SharedFrameRing((4, 6, 3), slots=2, name=ring.name)
+    try:
+        frames = np.random.default_rng(0).integers(0, 255, (3, 4, 6, 3), np.uint8)
+        assert [ring.write(frame) for frame in frames] == [0, 1, 0]
+        np.testing.assert_array_equal(attached.frames[0], frames[2])
+        np.testing.assert_array_equal(attached.frames[1], frames[1])
+    finally:
+        attached.close()
+        ring.close()
+
+
+def test_remote_stage_sees_the_frames():
+    shape = (8, 8, 3)
+    stage = RemoteStage("test", checksum_stage, shape, options={"offset": 1})
+    try:
+        for value in (1, 7, 42):
+            frame = np.full(shape, value, np.uint8)
+            assert stage(frame) == value * frame.size + 1
+        with pytest.raises(RuntimeError, match="bad frame"):
+            stage(np.full(shape, 255, np.uint8))
+        assert stage(np.zeros(shape, np.uint8)) == 1
+    finally:
+        stage.close()
+    assert not stage.process.is_alive()
+
+
+def test_ring_skips_busy_slots():
+    ring = SharedFrameRing((2, 2, 3), slots=3)
+    try:
+        frame = np.ones((2, 2, 3), np.uint8)
+        assert [ring.write(frame, busy={1}) for _ in range(3)] == [0, 2, 0]
+        with pytest.raises(ValueError):
+            ring.write(frame, busy={0, 1, 2})
+    finally:
+        ring.close()
+
+
+def test_timed_out_slot_is_not_overwritten():
+    shape = (8, 8, 3)
+    stage = RemoteStage("test", slow_stage, shape, slots=2, timeout=0.3)
+    try:
+        with pytest.raises(RuntimeError, match="did not answer"):
+            stage(np.ones(shape, np.uint8))
+        slow_slot = stage._busy[1]
+        # the other slot takes the next frame, the slow one keeps its frame
+        assert stage(np.full(shape, 2, np.uint8)) == 2 * 192
+        assert stage._busy == {}
+        assert stage.ring.frames[slow_slot].max() == 1
+        assert stage(np.full(shape, 3, np.uint8)) == 3 * 192
+    finally:
+        stage.close()
+
+
+def test_call_waits_for_a_late_answer_when_every_slot_is_busy():
+    shape = (8, 8, 3)
+    stage = RemoteStage("test", slow_stage, shape, slots=1, timeout=0.3)
+    try:
+        with pytest.raises(RuntimeError, match="did not answer"):
+            stage(np.ones(shape, np.uint8))
+        # the late answer arrives within this call's timeout and frees the slot
+        assert stage(np.full(shape, 2, np.uint8)) == 2 * 192
+    finally:
+        stage.close()
+
+
+def test_call_gives_up_while_the_slot_stays_busy():
+    shape = (8, 8, 3)
+    options = {"delay": 1.0}
+    stage = RemoteStage("test", slow_stage, shape, 1, options=options, timeout=0.2)
+    try:
+        with pytest.raises(RuntimeError, match="did not answer"):
+            stage(np.ones(shape, np.uint8))
+        with pytest.raises(RuntimeError, match="still busy"):
+            stage(np.full(shape, 2, np.uint8))
+        assert list(stage._busy) == [1]
+    finally:
+        stage.close()
@@ -0,0 +1,92 @@
+import json
+
+import cv2
+import numpy as np
+
+import src.pipeline.replay as replay
+from src.object_detection.control import StopSignController
+from src.pipeline.replay import Replay, ReplaySummary, StageStats
+
+
+class TurningFollower(object):
+    """
+    Lane follower that turns one degree further every frame
+    """
+
+    def __init__(self, car):
+        self.car = car
+        self.resets = 0
+
+    def reset(self):
+        self.resets += 1
+
+    def follow_lane(self, frame):
+        self.car.front_wheels.turn(self.car.front_wheels.angle + 1)
+
+
+def write_video(path, frames, fps=10.0):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (64, 48))
+    for _ in range(frames):
+        writer.write(np.zeros((48, 64, 3), np.uint8))
+    writer.release()
+    return path
+
+
+def test_main_replays_every_video_with_one_replay(tmp_path, monkeypatch):
+    videos = [write_video(str(tmp_path / f"car_video{i}.avi"), 3) for i in range(2)]
+    created = []
+
+    def create_replay(*args):
+        created.append(Replay())
+        created[-1].lane_follower = TurningFollower(created[-1].car)
+        return created[-1]
+
+    monkeypatch.setattr(replay, "create_replay", create_replay)
+    output = str(tmp_path / "replay.jsonl")
+    assert replay.main(videos + ["--output", output]) == 0
+
+    assert len(created) == 1
+    assert created[0].lane_follower.resets == 2
+    with open(output) as file:
+        records = [json.loads(line) for line in file]
+    # every video starts at time 0 with straight wheels
+    assert [r["frame"] for r in records] == [0, 1, 2, 0, 1, 2]
+    assert [r["time"] for r in records] == [0.0, 0.1, 0.2] * 2
+    assert [r["steering_angle"] for r in records] == [91, 92, 93] * 2
+
+
+def test_summary_matches_the_records():
+    rng = np.random.default_rng(0)
+    times = rng.random(500) * 20
+    summary = ReplaySummary()
+    for index, lane_ms in enumerate(times):
+        detect_ms = lane_ms * 2 if index % 2 == 0 else None
+        summary.add({"lane_ms": lane_ms, "detect_ms": detect_ms})
+
+    result = summary.summary(elapsed=2.0)
+    assert result["frames"] == 500
+    assert result["fps"] == 250
+    assert np.isclose(result["lane_ms"]["mean"], times.mean())
+    assert result["lane_ms"]["p95"] == np.percentile(times, 95)
+    assert result["lane_ms"]["max"] == times.max()
+    assert result["detect_ms"]["max"] == times[::2].max() * 2
+
+
+def test_stage_stats_sample_is_bounded():
+    stats = StageStats(sample_size=200)
+    for value in np.random.default_rng(1).random(20000):
+        stats.add(value)
+    assert stats.count == 20000
+    assert len(stats.sample) == 200
+    assert abs(stats.summary()["p95"] - 0.95) < 0.05
+
+
+def test_stop_sign_rule_reset_drops_the_stop():
+    now = [0.0]
+    rule = StopSignController(rearm_delay=5.0, clock=lambda: now[0])
+    assert rule.trigger()
+    rule.update()
+    rule.reset()
+    assert rule.state == rule.DRIVING
+    assert rule.armed
+    assert rule.stops == 1
@@ -0,0 +1,47 @@
+import csv
+import json
+
+from src.pipeline.records import RecordWriter
+from src.pipeline.telemetry import Telemetry
+
+
+def test_record_writer_jsonl(tmp_path):
+    path = str(tmp_path / "records.jsonl")
+    writer = RecordWriter(path)
+    writer.write({"frame": 1, "lane_lines": [[1, 2, 3, 4]]})
+    writer.close()
+    with open(path) as file:
+        assert [json.loads(line) for line in file] == [
+            {"frame": 1, "lane_lines": [[1, 2, 3, 4]]}
+        ]
+
+
+def test_record_writer_csv_takes_the_first_record_as_header(tmp_path):
+    path = str(tmp_path / "records.csv")
+    writer = RecordWriter(path)
+    writer.write({"frame": 1, "detections": [{"id": 0}]})
+    writer.write({"frame": 2, "detections": []})
+    writer.close()
+    with open(path, newline="") as file:
+        rows = list(csv.DictReader(file))
+    assert rows == [
+        {"frame": "1", "detections": '[{"id": 0}]'},
+        {"frame": "2", "detections": "[]"},
+    ]
+
+
+def test_frames_timed_elsewhere_drive_the_watchdog(tmp_path):
+    path = str(tmp_path / "telemetry.csv")
+    telemetry = Telemetry(budget_ms=10, sink_path=path, degrade_after=2)
+    for index in range(4):
+        over = telemetry.record(index, {"lane": 12.0, "capture": 1.0}, 15.0, 0.0)
+        assert over
+    assert telemetry.watchdog.skip_detection
+    snapshot = telemetry.snapshot()
+    assert snapshot["frames"] == 4
+    assert snapshot["stages"]["lane"]["p50_ms"] == 12.0
+    telemetry.close()
+    with open(path, newline="") as file:
+        rows = list(csv.DictReader(file))
+    assert [row["level"] for row in rows] == ["0", "1", "1", "2"]
+    assert rows[0]["detection_ms"] == "0.0"
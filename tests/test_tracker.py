@@ -0,0 +1,33 @@
+import pickle
+
+import numpy as np
+
+from src.object_detection.boxes import BoundingBox, Detection
+from src.object_detection.tracker import ObjectTracker, iou_matrix
+
+
+def test_box_is_attribute_compatible():
+    box = BoundingBox(10, 20, 50, 40)
+    assert (box.width, box.height, box.area) == (40, 20, 800)
+    moved = box.translate(5, -5)
+    assert moved == (15, 15, 55, 35)
+    assert isinstance(moved, BoundingBox)
+    assert pickle.loads(pickle.dumps(Detection(1, 0.9, box))).bbox.width == 40
+
+
+def test_iou_matrix():
+    boxes = [(0, 0, 10, 10), (5, 0, 15, 10), (20, 20, 30, 30)]
+    overlap = iou_matrix([(0, 0, 10, 10)], boxes)
+    np.testing.assert_allclose(overlap, [[1.0, 1 / 3, 0.0]])
+
+
+def test_tracks_keep_their_id_and_extrapolate():
+    tracker = ObjectTracker(min_hits=2)
+    assert tracker.update([Detection(1, 0.9, BoundingBox(0, 0, 10, 10))], 0.0) == []
+    confirmed = tracker.update([Detection(1, 0.8, BoundingBox(2, 0, 12, 10))], 0.1)
+    assert [track.track_id for track in confirmed] == [1]
+
+    track = tracker.predict(0.2)[0]
+    assert isinstance(track.bbox, BoundingBox)
+    assert track.bbox.xmin > 2
+    assert tracker.predict(2.0) == []
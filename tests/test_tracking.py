@@ -0,0 +1,89 @@
+import cv2
+import numpy as np
+
+import src.opencv_auto.tracking as tracking
+from src.opencv_auto.tracking import LaneLineFilter, LaneTracker
+
+LANE_COLOR = (150, 90, 40)
+
+
+def lane_frame(shift=0, height=480, width=640, sides=("left", "right")):
+    """
+    Dark frame with a blue lane line on the given sides, moved by shift pixels
+    """
+    frame = np.zeros((height, width, 3), np.uint8)
+    if "left" in sides:
+        start, end = (100 + shift, height), (250 + shift, height // 2)
+        cv2.line(frame, start, end, LANE_COLOR, 12)
+    if "right" in sides:
+        start, end = (540 + shift, height), (400 + shift, height // 2)
+        cv2.line(frame, start, end, LANE_COLOR, 12)
+    return frame
+
+
+def bottom_positions(lane_lines):
+    return [line[0][0] for line in lane_lines]
+
+
+def test_tracks_lines_without_redetecting():
+    tracker = LaneTracker(redetect_interval=1000)
+    first = tracker.detect(lane_frame())
+    assert len(first) == 2
+    for shift in range(0, 20, 2):
+        lane_lines = tracker.detect(lane_frame(shift))
+    assert tracker.frames_since_detection == 10
+    assert len(lane_lines) == 2
+    expected = np.array(bottom_positions(first)) + 18
+    np.testing.assert_allclose(bottom_positions(lane_lines), expected, atol=6)
+
+
+def test_line_without_a_fit_is_lost(monkeypatch):
+    tracker = LaneTracker()
+    tracker.detect(lane_frame())
+    # a confident search that still found too few rows to fit a line
+    monkeypatch.setattr(tracker, "search_band", lambda frame, line: (None, 1.0))
+    acquired = []
+    monkeypatch.setattr(
+        tracker, "acquire", lambda frame, sides=None: acquired.append(sides)
+    )
+    tracker.track(lane_frame())
+    assert tracker.lines == {}
+    assert acquired == [["left", "right"]]
+
+
+def test_lost_line_comes_back_on_the_next_frame():
+    tracker = LaneTracker(redetect_interval=1000)
+    assert len(tracker.detect(lane_frame())) == 2
+    tracker.detect(lane_frame(sides=("right",)))
+    assert list(tracker.lines) == ["right"]
+
+    lane_lines = tracker.detect(lane_frame())
+    assert sorted(tracker.lines) == ["left", "right"]
+    assert len(lane_lines) == 2
+    # only the missing side was searched for, the interval keeps running
+    assert tracker.frames_since_detection == 2
+
+
+def test_acquire_predicts_tracked_lines(monkeypatch):
+    tracker = LaneTracker()
+    line = LaneLineFilter(100.0, -0.5)
+    tracker.lines["left"] = line
+    calls = []
+    monkeypatch.setattr(line, "predict", lambda: calls.append("predict"))
+    monkeypatch.setattr(line, "update", lambda *args: calls.append("update"))
+    monkeypatch.setattr(
+        tracking, "detect_lane", lambda frame, **kwargs: ([[[100, 480, 220, 240]]], [])
+    )
+    tracker.acquire(lane_frame())
+    assert calls == ["predict", "update"]
+    assert tracker.confidence["left"] == 1.0
+
+
+def test_filter_follows_a_moving_line():
+    line = LaneLineFilter(100.0, -0.5)
+    for step in range(1, 30):
+        line.predict()
+        line.update(100.0 + 3 * step, -0.5)
+    line.predict()
+    assert abs(line.position - 190.0) < 1.0
+    assert abs(line.slope + 0.5) < 1e-3
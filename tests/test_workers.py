@@ -0,0 +1,76 @@
+import threading
+import time
+
+import src.pipeline.workers as workers
+from src.pipeline.workers import DropOldestQueue, FramePacket, LatestValue
+from src.pipeline.workers import StageWorker
+
+
+def test_queue_drops_the_oldest_item():
+    frames = DropOldestQueue(maxsize=2)
+    for item in range(5):
+        frames.put(item)
+    assert frames.dropped == 3
+    assert [frames.get(0), frames.get(0)] == [3, 4]
+    assert frames.get(timeout=0.01) is None
+
+
+def test_queue_get_wakes_up_on_put():
+    frames = DropOldestQueue()
+    threading.Timer(0.05, frames.put, ("frame",)).start()
+    assert frames.get(timeout=2.0) == "frame"
+
+
+def test_latest_value_keeps_the_newest():
+    slot = LatestValue()
+    assert slot.get() == (0, None)
+    slot.put("a")
+    slot.put("b")
+    assert slot.get() == (2, "b")
+    assert slot.wait_newer(2, timeout=0.01) == (2, "b")
+    threading.Timer(0.05, slot.put, ("c",)).start()
+    assert slot.wait_newer(2, timeout=2.0) == (3, "c")
+
+
+def run_worker(packets, paused=False, **kwargs):
+    frames = DropOldestQueue(maxsize=len(packets))
+    for packet in packets:
+        frames.put(packet)
+    seen = []
+    worker = StageWorker("test", seen.append, frames, poll_interval=0.01, **kwargs)
+    worker.paused = paused
+    worker.start()
+    deadline = time.perf_counter() + 2.0
+    while worker.received < len(packets) and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    worker.stop()
+    worker.join(1.0)
+    return worker, seen
+
+
+def test_every_nth_counts_received_frames():
+    # odd camera indices only, as when every other frame was dropped upstream
+    packets = [FramePacket(index, 0.0, index) for index in range(1, 13, 2)]
+    worker, seen = run_worker(packets, every_nth=2)
+    assert seen == [1, 5, 9]
+    assert worker.received == 6
+    assert worker.results.get()[1].index == 9
+
+
+def test_paused_worker_drops_frames():
+    packets = [FramePacket(index, 0.0, index) for index in range(4)]
+    worker, seen = run_worker(packets, paused=True)
+    assert seen == []
+    assert worker.received == 4
+
+
+def test_rate_starts_at_the_first_measurement(monkeypatch):
+    clock = iter([10.0, 10.05, 10.15])
+    monkeypatch.setattr(workers.time, "perf_counter", lambda: next(clock))
+    worker = StageWorker("test", None, DropOldestQueue(), smoothing=0.1)
+    worker._update_stats(9.99)
+    assert worker.rate == 0.0
+    worker._update_stats(10.0)
+    assert abs(worker.rate - 20.0) < 1e-6
+    worker._update_stats(10.1)
+    assert abs(worker.rate - 19.0) < 1e-6